@@ -10,9 +10,9 @@ from .cli import cli
 # from .model import Model
 
 # set the module functions as globals
+# (binding class/static methods directly avoids inspecting every signature on import)
 for k,v in Module.__dict__.items():
+    if isinstance(v, (classmethod, staticmethod)):
+        v = getattr(Module, k)
     globals()[k] = v
-
-for f in Module.get_class_methods() + Module.get_static_methods():
-    globals()[f] = getattr(Module, f)
     
\ No newline at end of file
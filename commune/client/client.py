@@ -6,8 +6,18 @@ from functools import partial
 import commune as c
 import aiohttp
 import json
+import base64
+import uuid
 
 class Client(c.Module):
+    # one keep-alive session per event loop, shared by every client (and c.connect result) on that loop
+    loop2session = {}
+    session_config = {
+        'limit': 100, # max open connections per session
+        'limit_per_host': 32, # max open connections per server
+        'ttl_dns_cache': 300, # seconds to cache dns lookups
+        'keepalive_timeout': 30, # seconds to keep idle connections open
+    }
 
     def __init__( 
             self,
@@ -16,10 +26,12 @@ class Client(c.Module):
             network: bool = None,
             key : str = None,
             save_history: bool = True,
-            history_path : str = 'history',
+            history_path : str = 'client',
             loop: 'asyncio.EventLoop' = None, 
             debug: bool = False,
             serializer= 'serializer',
+            binary: bool = False,
+            pool: bool = True,
             **kwargs
         ):
         self.loop = c.get_event_loop() if loop == None else loop
@@ -31,8 +43,10 @@ class Client(c.Module):
         self.start_timestamp = c.timestamp()
         self.save_history = save_history
         self.history_path = history_path
+        self.history_store = c.module('history').store(history_path) if save_history else None
         self.debug = debug
-
+        self.binary = binary
+        self.pool = pool
         
 
     
@@ -54,39 +68,99 @@ class Client(c.Module):
     def resolve_client(self, ip: str = None, port: int = None) -> None:
         if ip != None or port != None:
             self.set_client(ip =ip,port = port)
+
+    @classmethod
+    def get_session(cls, loop: 'asyncio.AbstractEventLoop' = None) -> aiohttp.ClientSession:
+        """
+        returns the pooled session of the loop (the running loop by default), 
+        sessions cannot be shared across loops so each loop gets its own
+        """
+        loop = loop or asyncio.get_running_loop()
+        session = cls.loop2session.get(loop, None)
+        if session == None or session.closed:
+            if len(cls.loop2session) == 0:
+                import atexit
+                atexit.register(cls.close_sessions)
+            # drop the sessions of loops that no longer exist
+            for l in [l for l in cls.loop2session if l.is_closed()]:
+                del cls.loop2session[l]
+            connector = aiohttp.TCPConnector(**cls.session_config)
+            session = aiohttp.ClientSession(connector=connector)
+            cls.loop2session[loop] = session
+        return session
+
+    @classmethod
+    def set_session_config(cls, **kwargs) -> dict:
+        """
+        updates the connector config (limit, limit_per_host, ttl_dns_cache, keepalive_timeout), 
+        sessions opened from here on use the new config
+        """
+        cls.session_config = {**cls.session_config, **kwargs}
+        cls.close_sessions()
+        return cls.session_config
+
+    @classmethod
+    def close_sessions(cls) -> dict:
+        n = 0
+        for loop, session in list(cls.loop2session.items()):
+            if not session.closed and not loop.is_closed():
+                if loop.is_running():
+                    loop.create_task(session.close())
+                else:
+                    loop.run_until_complete(session.close())
+                n += 1
+        cls.loop2session = {}
+        return {'success': True, 'closed': n}
     
 
 
-    async def async_forward(self,
-        fn: str,
-        args: list = None,
-        kwargs: dict = None,
-        ip: str = None,
-        port : int= None,
-        timeout: int = 10,
-        generator: bool = False,
-        headers : dict ={'Content-Type': 'application/json'},
-        ):
-        self.resolve_client(ip=ip, port=port)
+    def get_request(self, 
+                    args: list = None, 
+                    kwargs: dict = None, 
+                    binary: bool = False, 
+                    headers: dict = {'Content-Type': 'application/json'}) -> dict:
+        """
+        serializes and signs the request, sign it once per server
+        (the servers reject a signature they already received, the nonce keeps
+        identical calls within the same second from signing the same payload)
+        """
         args = args if args else []
         kwargs = kwargs if kwargs else {}
-        url = f"http://{self.address}/{fn}/"
         input =  { 
                         "args": args,
                         "kwargs": kwargs,
                         "ip": self.my_ip,
                         "timestamp": c.timestamp(),
+                        "nonce": uuid.uuid4().hex,
                         }
-        # serialize this into a json string
-        request = self.serializer.serialize(input)
-        request = self.key.sign(request, return_json=True)
+        if binary:
+            # the frame is sent as is, with its signature in the headers
+            request = self.serializer.serialize(input, mode='binary')
+            headers = self.serializer.sign_binary(request, key=self.key)
+            request_kwargs = {'data': request, 'headers': headers}
+        else:
+            # serialize this into a json string
+            request = self.serializer.serialize(input)
+            request = self.key.sign(request, return_json=True)
+            request_kwargs = {'data': json.dumps(request), 'headers': headers}
+        return {'input': input, 'request_kwargs': request_kwargs}
 
-        
-        
-        # start a client session and send the request
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, json=request, headers=headers) as response:
-                if response.content_type == 'text/event-stream':
+    async def send_request(self, url:str, request_kwargs:dict, timeout:int = 10):
+        """
+        posts a signed request (see get_request) and returns the deserialized result
+        """
+        # send the request over the pooled keep-alive session of this loop
+        if self.pool:
+            session = self.get_session()
+        else:
+            session = aiohttp.ClientSession()
+        try:
+            async with session.post(url, timeout=aiohttp.ClientTimeout(total=timeout), **request_kwargs) as response:
+                if response.content_type == self.serializer.binary_content_type:
+                    # binary frames are already deserialized into {'data': result}
+                    result = await asyncio.wait_for(response.read(), timeout=timeout)
+                    result = self.serializer.deserialize(result)
+                elif response.content_type == 'text/event-stream':
                     STREAM_PREFIX = 'data: '
                     BYTES_PER_MB = 1e6
                     if self.debug:
@@ -134,41 +208,201 @@ class Client(c.Module):
                     result = await asyncio.wait_for(response.text(), timeout=timeout)
                 else:
                     raise ValueError(f"Invalid response content type: {response.content_type}")
-        if isinstance(result, dict):
-            result = self.serializer.deserialize(result)
-        elif isinstance(result, str):
-            result = self.serializer.deserialize(result)
+        finally:
+            if not self.pool:
+                await session.close()
+        if response.content_type != self.serializer.binary_content_type:
+            if isinstance(result, dict):
+                result = self.serializer.deserialize(result)
+            elif isinstance(result, str):
+                result = self.serializer.deserialize(result)
         if isinstance(result, dict) and 'data' in result:
             result = result['data']
+        return result
+
+    async def async_forward(self,
+        fn: str,
+        args: list = None,
+        kwargs: dict = None,
+        ip: str = None,
+        port : int= None,
+        timeout: int = 10,
+        generator: bool = False,
+        headers : dict ={'Content-Type': 'application/json'},
+        binary: bool = None,
+        ):
+        """
+        binary: send the request as a binary frame (tensors and arrays as raw buffers), 
+                the server then responds with a binary frame as well
+        """
+        binary = self.binary if binary == None else binary
+        self.resolve_client(ip=ip, port=port)
+        request = self.get_request(args=args, kwargs=kwargs, binary=binary, headers=headers)
+        input = request['input']
+        url = f"http://{self.address}/{fn}/"
+        result = await self.send_request(url, request['request_kwargs'], timeout=timeout)
         if self.save_history:
             input['fn'] = fn
             input['result'] = result
             input['module']  = self.address
             input['latency'] =  c.time() - input['timestamp']
-            path = self.history_path+'/' + self.server_name + '/' + str(input['timestamp'])
-            self.put(path, input)
+            input['key'] = self.key.ss58_address
+            self.history_store.add(input)
         return result
     
+    @staticmethod
+    def resolve_target(target: Union[str, tuple, dict], fn:str = 'info', args:list = None, kwargs:dict = None) -> dict:
+        """
+        target: an address, an (address, fn, args, kwargs) tuple or a dict with those keys
+        """
+        if isinstance(target, str):
+            target = {'address': target}
+        elif isinstance(target, (list, tuple)):
+            target = dict(zip(['address', 'fn', 'args', 'kwargs'], target))
+        target = {'fn': fn, 'args': args, 'kwargs': kwargs, **target}
+        target['args'] = target['args'] or []
+        target['kwargs'] = target['kwargs'] or {}
+        if isinstance(target['address'], str) and '://' in target['address']:
+            target['address'] = target['address'].split('://')[-1]
+        return target
+
+    async def batch_forward(self, 
+                            targets: List[Union[str, tuple, dict]], 
+                            fn: str = 'info',
+                            args: list = None,
+                            kwargs: dict = None,
+                            concurrency: int = 64, 
+                            timeout: int = 10, 
+                            min_successes: int = None, 
+                            binary: bool = None):
+        """
+        fans out a list of targets, (address, fn, args, kwargs), and yields the results as they complete
+        (a dict target can set its own timeout)
+            {'index', 'address', 'fn', 'result', 'success', 'code', 'latency'}
+        code: ok, remote_error, timeout, connection_error, error or unresolved (no address)
+        
+        every target gets its own signature (a server rejects a signature it already received,
+        and the signature does not cover the server or the function), at most concurrency requests are in flight 
+        and the rest of the batch is cancelled once min_successes is reached
+        """
+        binary = self.binary if binary == None else binary
+        targets = [self.resolve_target(t, fn=fn, args=args, kwargs=kwargs) for t in targets]
+        async def call(index, target):
+            t0 = c.time()
+            response = {'index': index, 'address': target['address'], 'fn': target['fn']}
+            try:
+                if target['address'] == None:
+                    raise LookupError(f'No address for target {target}')
+                request = self.get_request(args=target['args'], kwargs=target['kwargs'], binary=binary)
+                url = f"http://{target['address']}/{target['fn']}/"
+                target_timeout = target.get('timeout', None) or timeout
+                result = await asyncio.wait_for(self.send_request(url, request['request_kwargs'], timeout=target_timeout), timeout=target_timeout)
+                code = 'remote_error' if isinstance(result, dict) and 'error' in result else 'ok'
+            except asyncio.TimeoutError:
+                result, code = {'error': f"TimeoutError: {target.get('timeout', None) or timeout} seconds"}, 'timeout'
+            except LookupError as e:
+                result, code = c.detailed_error(e), 'unresolved'
+            except (aiohttp.ClientConnectionError, OSError) as e:
+                result, code = c.detailed_error(e), 'connection_error'
+            except Exception as e:
+                result, code = c.detailed_error(e), 'error'
+            response.update({'result': result, 
+                             'success': code == 'ok', 
+                             'code': code, 
+                             'latency': c.time() - t0})
+            return response
+
+        pending = set()
+        queue = iter(enumerate(targets))
+        n_successes = 0
+        try:
+            while True:
+                # keep the window full
+                for index, target in queue:
+                    pending.add(asyncio.ensure_future(call(index, target)))
+                    if len(pending) >= concurrency:
+                        break
+                if len(pending) == 0:
+                    break
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    response = task.result()
+                    n_successes += response['success']
+                    yield response
+                if min_successes != None and n_successes >= min_successes:
+                    break
+        finally:
+            # early exit (min_successes or the caller closing the generator) cancels the rest
+            for task in pending:
+                task.cancel()
+
+    async def async_batch(self, 
+                          calls: List[Union[tuple, dict]], 
+                          timeout: int = 10, 
+                          binary: bool = None) -> list:
+        """
+        sends many calls to the server in one signed request (the server's /batch endpoint)
+        calls: a list of (fn, args, kwargs) tuples or {'fn', 'args', 'kwargs'} dicts
+        returns the results in the order of the calls, failed calls return their error
+        """
+        binary = self.binary if binary == None else binary
+        calls = [self.resolve_call(call) for call in calls]
+        request = self.get_request(kwargs={'calls': calls}, binary=binary)
+        url = f"http://{self.address}/batch"
+        return await self.send_request(url, request['request_kwargs'], timeout=timeout)
+
+    async def batch_stream(self, calls: List[Union[tuple, dict]], timeout: int = 10, binary: bool = None):
+        """
+        like async_batch, but yields {'index', 'result'} as the calls complete on the server
+        (the events are signed by the server, in the format of the request)
+        """
+        binary = self.binary if binary == None else binary
+        calls = [self.resolve_call(call) for call in calls]
+        request = self.get_request(kwargs={'calls': calls, 'stream': True}, binary=binary)
+        url = f"http://{self.address}/batch"
+        STREAM_PREFIX = 'data: '
+        session = self.get_session()
+        async with session.post(url, timeout=aiohttp.ClientTimeout(total=timeout), **request['request_kwargs']) as response:
+            if response.content_type != 'text/event-stream':
+                # the batch failed as a whole (signature, staleness or backpressure)
+                yield {'index': None, 'result': await response.json()}
+                return
+            async for line in response.content:
+                event_data = line.decode('utf-8').strip()
+                if not event_data.startswith(STREAM_PREFIX):
+                    continue
+                event_data = json.loads(event_data[len(STREAM_PREFIX):])
+                if 'binary' in event_data:
+                    event_data = base64.b64decode(event_data['binary'])
+                yield self.serializer.deserialize(event_data)['data']
+
+    def batch(self, calls: List[Union[tuple, dict]], timeout: int = 10, **kwargs) -> list:
+        return self.loop.run_until_complete(self.async_batch(calls, timeout=timeout, **kwargs))
+
+    @staticmethod
+    def resolve_call(call: Union[str, tuple, dict]) -> dict:
+        if isinstance(call, str):
+            call = {'fn': call}
+        elif isinstance(call, (list, tuple)):
+            call = dict(zip(['fn', 'args', 'kwargs'], call))
+        return {'fn': call['fn'], 'args': call.get('args', None) or [], 'kwargs': call.get('kwargs', None) or {}}
+
     @classmethod
-    def history(cls, key=None, history_path='history'):
-        key = c.get_key(key)
-        return cls.ls(history_path + '/' + key.ss58_address)
+    def history(cls, key=None, history_path='client', **kwargs):
+        return c.module('history').history(key=key, history_path=history_path, **kwargs)
     @classmethod
-    def all_history(cls, key=None, history_path='history'):
-        key = c.get_key(key)
-        return cls.glob(history_path)
+    def all_history(cls, key=None, history_path='client', **kwargs):
+        return c.module('history').all_history(history_path=history_path, **kwargs)
         
 
 
     @classmethod
-    def rm_key_history(cls, key=None, history_path='history'):
-        key = c.get_key(key)
-        return cls.rm(history_path + '/' + key.ss58_address)
+    def rm_key_history(cls, key=None, history_path='client'):
+        return c.module('history').rm_key_history(key=key, history_path=history_path)
     
     @classmethod
-    def rm_history(cls, key=None, history_path='history'):
-        key = c.get_key(key)
-        return cls.rm(history_path)
+    def rm_history(cls, key=None, history_path='client'):
+        return c.module('history').rm_history(history_path=history_path)
 
 
     def process_output(self, result):
@@ -191,6 +425,42 @@ class Client(c.Module):
         
     __call__ = forward
 
+    @classmethod
+    def benchmark(cls, n:int = 200, concurrency:int = 32, port:int = None, timeout:int = 60) -> dict:
+        """
+        sequential and concurrent echo calls against a local server, 
+        with a new session per call (pool=False) vs the pooled keep-alive session (pool=True)
+        """
+        port = port or c.free_port()
+        process = c.module('server').echo_process(port=port, timeout=timeout)
+        results = {}
+        try:
+            for pool in [False, True]:
+                client = cls(ip='0.0.0.0', port=port, save_history=False, pool=pool)
+                client.forward(fn='echo', args=['warmup'], timeout=timeout)
+                t0 = c.time()
+                for i in range(n):
+                    assert client.forward(fn='echo', args=[str(i)], timeout=timeout) == str(i)
+                sequential = c.time() - t0
+                semaphore = asyncio.Semaphore(concurrency)
+                async def call(i):
+                    async with semaphore:
+                        return await client.async_forward(fn='echo', args=[str(i)], timeout=timeout)
+                async def run():
+                    return await asyncio.gather(*[call(i) for i in range(n)])
+                t0 = c.time()
+                assert client.loop.run_until_complete(run()) == [str(i) for i in range(n)]
+                concurrent = c.time() - t0
+                results['pool' if pool else 'no_pool'] = {
+                    'sequential_rps': n / sequential, 
+                    'sequential_latency': sequential / n,
+                    'concurrent_rps': n / concurrent,
+                }
+        finally:
+            process.kill()
+        results['speedup'] = {k: results['pool'][k] / results['no_pool'][k] for k in ['sequential_rps', 'concurrent_rps']}
+        return results
+
     def __str__ ( self ):
         return "Client({})".format(self.address) 
     def __repr__ ( self ):
@@ -4,9 +4,9 @@ class Executor(c.Module):
     modes = ['thread', 'process']
     
     @classmethod
-    def executor(cls, max_workers:int = None, mode:str = 'thread'):
+    def executor(cls, max_workers:int = None, mode:str = 'thread', **kwargs):
         assert mode in cls.modes, f"mode must be one of {cls.modes}"
-        return c.module(f'executor.{mode}')(max_workers=max_workers)
+        return c.module(f'executor.{mode}')(max_workers=max_workers, **kwargs)
     
     @classmethod
     def test(cls):
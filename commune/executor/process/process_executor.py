@@ -57,7 +57,9 @@ import threading
 import weakref
 from functools import partial
 import itertools
+import heapq
 import sys
+import asyncio
 from traceback import format_exception
 import commune as c
 import inspect
@@ -644,9 +646,162 @@ class BrokenProcessPool(_base.BrokenExecutor):
     while a future was in the running state.
     """
 
+
+# the modules and functions a worker resolved, so every module is imported and instantiated once per worker
+_worker_modules = {}
+_worker_fns = {}
+_inherited_loops = []
+
+
+def _worker_module(path):
+    if path not in _worker_modules:
+        _worker_modules[path] = c.module(path)()
+    return _worker_modules[path]
+
+
+def _init_worker(modules, initializer=None, initargs=()):
+    """
+    warms up a worker: commune is imported and the modules are instantiated before the first call
+    """
+    # a forked worker inherits the event loop of the parent without the threads of its default executor,
+    # so anything that runs in it (like aiofiles under c.get/c.put) would never return.
+    # the inherited loop is kept (never closed), closing it would unregister its fds from the epoll it shares with the parent
+    _inherited_loops.append(asyncio.get_event_loop_policy().get_event_loop())
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    for path in modules or []:
+        _worker_module(path)
+    if initializer is not None:
+        initializer(*initargs)
+
+
+def _resolve_fn(fn):
+    """
+    resolves module/fn in the worker, a method of a module instance is called on the cached instance
+    """
+    if not isinstance(fn, str):
+        return fn
+    if fn not in _worker_fns:
+        module_path, fn_name = fn.rsplit('/', 1) if '/' in fn else ('module', fn)
+        module = c.module(module_path)
+        if c.classify_fn(getattr(module, fn_name)) == 'self':
+            module = _worker_module(module_path)
+        _worker_fns[fn] = getattr(module, fn_name)
+    return _worker_fns[fn]
+
+
+class SharedArray:
+    """
+    a handle of an array that a worker wrote to shared memory, only the handle is pickled through the pipe
+    """
+    def __init__(self, name, shape, dtype, kind='numpy'):
+        self.name = name
+        self.shape = shape
+        self.dtype = dtype
+        self.kind = kind
+
+    @classmethod
+    def share(cls, array, kind='numpy'):
+        from multiprocessing import shared_memory, resource_tracker
+        import numpy as np
+        array = np.ascontiguousarray(array)
+        shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+        # the parent unlinks it once it is read, not the tracker of the worker
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        shm.close()
+        return cls(shm.name, array.shape, array.dtype.str, kind=kind)
+
+    def load(self):
+        """
+        copies the array out of shared memory and frees it (this can only be called once)
+        """
+        from multiprocessing import shared_memory
+        import numpy as np
+        shm = shared_memory.SharedMemory(name=self.name)
+        try:
+            array = np.ndarray(self.shape, dtype=np.dtype(self.dtype), buffer=shm.buf).copy()
+        finally:
+            shm.close()
+            shm.unlink()
+        if self.kind == 'torch':
+            import torch
+            return torch.from_numpy(array)
+        return array
+
+
+def _share(obj, min_bytes):
+    """
+    replaces the arrays/tensors of at least min_bytes in the result (also inside dicts, lists and tuples) with SharedArray handles
+    """
+    module = type(obj).__module__
+    if module == 'numpy' and type(obj).__name__ == 'ndarray':
+        return SharedArray.share(obj) if obj.nbytes >= min_bytes and not obj.dtype.hasobject else obj
+    if module == 'torch' and type(obj).__name__ in ['Tensor', 'Parameter']:
+        if obj.element_size() * obj.nelement() >= min_bytes:
+            return SharedArray.share(obj.detach().cpu().numpy(), kind='torch')
+        return obj
+    if isinstance(obj, dict):
+        return {k: _share(v, min_bytes) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_share(v, min_bytes) for v in obj)
+    return obj
+
+
+def _unshare(obj):
+    if isinstance(obj, SharedArray):
+        return obj.load()
+    if isinstance(obj, dict):
+        return {k: _unshare(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_unshare(v) for v in obj)
+    return obj
+
+
+def _run(fn, args, kwargs, min_shared_bytes=None):
+    """
+    the call of a task in the worker, failures are returned as error dicts like in the thread executor
+    """
+    try:
+        result = _resolve_fn(fn)(*args, **kwargs)
+    except Exception as e:
+        return c.detailed_error(e)
+    if min_shared_bytes is not None:
+        result = _share(result, min_shared_bytes)
+    return result
+
+
+class _SharedFuture(_base.Future):
+    """
+    a future that reads the shared memory arrays of its result when the result arrives,
+    a future resolved by its deadline drops the late result of the worker (and its call is skipped if it did not start)
+    """
+    def set_running_or_notify_cancel(self):
+        with self._condition:
+            if self._state == _base.FINISHED:
+                return False
+            return super().set_running_or_notify_cancel()
+
+    def set_result(self, result):
+        try:
+            result = _unshare(result)
+        except Exception as e:
+            result = c.detailed_error(e)
+        with self._condition:
+            if self._state == _base.FINISHED:
+                return
+            super().set_result(result)
+
+    def set_exception(self, exception):
+        with self._condition:
+            if self._state == _base.FINISHED:
+                return
+            super().set_exception(exception)
+
+
 class ProcessPoolExecutor(_base.Executor,c.Module):
     def __init__(self, max_workers=None, mp_context=None,
-                 initializer=None, initargs=(), *, max_tasks_per_child=None):
+                 initializer=None, initargs=(), *, max_tasks_per_child=None,
+                 warm=True, modules=None, min_shared_bytes=1_000_000):
         """Initializes a new ProcessPoolExecutor instance.
 
         Args:
@@ -664,6 +819,13 @@ class ProcessPoolExecutor(_base.Executor,c.Module):
                 live as long as the executor. Requires a non-'fork' mp_context
                 start method. When given, we default to using 'spawn' if no
                 mp_context is supplied.
+            warm: Start every worker now (with commune imported and the
+                modules instantiated) instead of on the first calls.
+            modules: The module paths every worker instantiates up front,
+                a task fn 'module/fn' runs on the worker's cached instance.
+            min_shared_bytes: Arrays/tensors of at least this size in a
+                result come back through shared memory instead of the pipe
+                (None to always pickle them).
         """
         _check_system_limits()
 
@@ -680,7 +842,8 @@ class ProcessPoolExecutor(_base.Executor,c.Module):
                 raise ValueError(
                     f"max_workers must be <= {_MAX_WINDOWS_WORKERS}")
 
-            self._max_workers = max_workers
+            # more processes than cores only add contention for cpu bound work
+            self._max_workers = min(max_workers, os.cpu_count() or 1)
 
         if mp_context is None:
             if max_tasks_per_child is not None:
@@ -695,8 +858,10 @@ class ProcessPoolExecutor(_base.Executor,c.Module):
 
         if initializer is not None and not callable(initializer):
             raise TypeError("initializer must be a callable")
-        self._initializer = initializer
-        self._initargs = initargs
+        self._initializer = _init_worker
+        self._initargs = (modules, initializer, initargs)
+        self.modules = modules
+        self.min_shared_bytes = min_shared_bytes
 
         if max_tasks_per_child is not None:
             if not isinstance(max_tasks_per_child, int):
@@ -755,6 +920,16 @@ class ProcessPoolExecutor(_base.Executor,c.Module):
         self._result_queue = mp_context.SimpleQueue()
         self._work_ids = queue.Queue()
 
+        # the deadlines of the futures with a timeout, resolved by a watchdog thread
+        self._deadlines = [] # heap of (deadline, seq, future, fn_name, timeout)
+        self._deadline_changed = threading.Condition()
+        self._deadline_count = itertools.count()
+        self._watchdog_thread = None
+        self._timeouts = 0
+        if warm:
+            self._launch_processes()
+            self._start_executor_manager_thread()
+
     def _start_executor_manager_thread(self):
         if self._executor_manager_thread is None:
             # Start the processes so that their sentinels are known.
@@ -799,10 +974,9 @@ class ProcessPoolExecutor(_base.Executor,c.Module):
         p.start()
         self._processes[p.pid] = p
 
-    
-    def submit(self, fn, *args, return_future:bool = True, init_kwargs:dict=None,  **kwargs):
+
+    def _submit(self, fn, args, kwargs, future_class=_base.Future):
         with self._shutdown_lock:
-            fn = c.resolve_fn(fn)
             if self._broken:
                 raise BrokenProcessPool(self._broken)
             if self._shutdown_thread:
@@ -811,7 +985,7 @@ class ProcessPoolExecutor(_base.Executor,c.Module):
                 raise RuntimeError('cannot schedule new futures after '
                                    'interpreter shutdown')
 
-            f = _base.Future()
+            f = future_class()
             w = _WorkItem(f, fn, args, kwargs)
 
             self._pending_work_items[self._queue_count] = w
@@ -822,12 +996,52 @@ class ProcessPoolExecutor(_base.Executor,c.Module):
             if self._safe_to_dynamically_spawn_children:
                 self._adjust_process_count()
             self._start_executor_manager_thread()
-            if return_future:
-                return f
-            return f.result()
-        
+            return f
 
-    submit.__doc__ = _base.Executor.submit.__doc__
+    def submit(self, fn, args:list = None, kwargs:dict = None, timeout:int = None, return_future:bool = True):
+        """
+        runs fn(*args, **kwargs) in a worker (the same call as the thread executor)
+
+        fn is a picklable callable or 'module/fn', which the worker resolves once (on its cached module instance),
+        failures resolve as error dicts and large arrays/tensors of the result come back through shared memory.
+        a future still pending timeout seconds after submission resolves with a timeout error dict,
+        the worker is not interrupted (its late result is dropped)
+        """
+        f = self._submit(_run, (fn, list(args or []), dict(kwargs or {}), self.min_shared_bytes), {}, future_class=_SharedFuture)
+        if timeout is not None:
+            fn_name = fn if isinstance(fn, str) else getattr(fn, '__name__', str(fn))
+            self._add_deadline(f, timeout, fn_name)
+        if return_future:
+            return f
+        return f.result()
+
+    def _add_deadline(self, future, timeout, fn_name):
+        with self._deadline_changed:
+            deadline = c.time() + timeout
+            if len(self._deadlines) == 0 or deadline < self._deadlines[0][0]:
+                self._deadline_changed.notify()
+            heapq.heappush(self._deadlines, (deadline, next(self._deadline_count), future, fn_name, timeout))
+            if len(self._deadlines) > 2 * len(self._pending_work_items) + 1024:
+                # drop the resolved futures, so their results are not kept until their deadlines
+                self._deadlines = [entry for entry in self._deadlines if not entry[2].done()]
+                heapq.heapify(self._deadlines)
+            if self._watchdog_thread is None:
+                self._watchdog_thread = threading.Thread(target=self._watchdog, daemon=True)
+                self._watchdog_thread.start()
+
+    def _watchdog(self):
+        """
+        resolves the futures past their deadlines with a timeout error, like the thread executor
+        """
+        with self._deadline_changed:
+            while not self._shutdown_thread:
+                now = c.time()
+                while len(self._deadlines) > 0 and (self._deadlines[0][0] <= now or self._deadlines[0][2].done()):
+                    deadline, _, future, fn_name, timeout = heapq.heappop(self._deadlines)
+                    if not future.done():
+                        future.set_result({'error': f'TimeoutError: task {fn_name} did not finish within {timeout} seconds', 'success': False})
+                        self._timeouts += 1
+                self._deadline_changed.wait(timeout=self._deadlines[0][0] - now if len(self._deadlines) > 0 else None)
 
     def map(self, fn, *iterables, timeout=None, chunksize=1):
         """Returns an iterator equivalent to map(fn, iter).
@@ -852,11 +1066,14 @@ class ProcessPoolExecutor(_base.Executor,c.Module):
         """
         if chunksize < 1:
             raise ValueError("chunksize must be >= 1.")
+        end_time = None if timeout is None else c.time() + timeout
+        fs = [self._submit(partial(_process_chunk, fn), (chunk,), {})
+              for chunk in _get_chunks(*iterables, chunksize=chunksize)]
 
-        results = super().map(partial(_process_chunk, fn),
-                              _get_chunks(*iterables, chunksize=chunksize),
-                              timeout=timeout)
-        return _chain_from_iterable_of_lists(results)
+        def result_iterator():
+            for f in fs:
+                yield f.result(None if end_time is None else max(end_time - c.time(), 0))
+        return _chain_from_iterable_of_lists(result_iterator())
 
     def shutdown(self, wait=True, *, cancel_futures=False):
         with self._shutdown_lock:
@@ -865,6 +1082,8 @@ class ProcessPoolExecutor(_base.Executor,c.Module):
             if self._executor_manager_thread_wakeup is not None:
                 # Wake up queue management thread
                 self._executor_manager_thread_wakeup.wakeup()
+        with self._deadline_changed:
+            self._deadline_changed.notify()
 
         if self._executor_manager_thread is not None and wait:
             self._executor_manager_thread.join()
@@ -880,23 +1099,107 @@ class ProcessPoolExecutor(_base.Executor,c.Module):
 
     @property
     def num_tasks(self):
-        return self._call_queue.__sizeof__()
+        return len(self._pending_work_items)
+
+    @property
+    def max_workers(self):
+        return self._max_workers
+
+    def metrics(self) -> dict:
+        return {'max_workers': self._max_workers,
+                'workers': len(self._processes or {}),
+                'pending': len(self._pending_work_items),
+                'submitted': self._queue_count,
+                'timeouts': self._timeouts,
+                'broken': bool(self._broken)}
+
+    shutdown.__doc__ = _base.Executor.shutdown.__doc__
 
     @staticmethod
     def fn(x=2):
         result =  x*2
         return result
-    shutdown.__doc__ = _base.Executor.shutdown.__doc__
-    @classmethod
-    def test(cls):
 
-        self = cls()
-        futures = []
-        for i in range(10):
-            futures += [self.submit('module/ls', return_future=True)]
-        # for future in c.tqdm(futures):
-        #     future.result()
-        c.print(c.wait(futures))
+    @staticmethod
+    def sleep_fn(seconds:float = 1):
+        import time
+        time.sleep(seconds)
+        return seconds
+
+    @staticmethod
+    def cpu_fn(n:int = 200000):
+        # pure python work that holds the GIL
+        total = 0
+        for i in range(n):
+            total += i * i % 7
+        return total
+
+    @staticmethod
+    def array_fn(size:int = 1_000_000, torch:bool = False):
+        import numpy as np
+        array = np.arange(size, dtype='float64')
+        if torch:
+            import torch
+            return {'tensor': torch.from_numpy(array)}
+        return {'array': array, 'size': size}
 
+    @classmethod
+    def test(cls, max_workers:int = 2):
+        import numpy as np
+        self = cls(max_workers=max_workers, modules=['module'])
+        try:
+            futures = [self.submit('module/ls') for i in range(10)]
+            results = c.wait(futures, timeout=30)
+            assert len(results) == 10 and all(isinstance(r, list) for r in results), results
+            assert self.submit(cls.fn, args=[3], return_future=False) == 6
+            # failures are error dicts like in the thread executor
+            error = self.submit(cls.fn, kwargs={'x': None}, return_future=False)
+            assert error['success'] == False, error
+            # a large array comes back through shared memory
+            result = self.submit(cls.array_fn, kwargs={'size': 1_000_000}, return_future=False)
+            assert isinstance(result['array'], np.ndarray) and result['array'][-1] == 999_999 and result['size'] == 1_000_000
+            tensor = self.submit(cls.array_fn, kwargs={'size': 1_000_000, 'torch': True}, return_future=False)['tensor']
+            assert type(tensor).__module__ == 'torch' and tensor[-1].item() == 999_999
+            assert list(self.map(cls.fn, range(5), chunksize=2)) == [0, 2, 4, 6, 8]
+            assert self.metrics()['workers'] == self.max_workers
+            # a task past its deadline resolves with the timeout error of the thread executor, running or queued
+            t0 = c.time()
+            futures = [self.submit(cls.sleep_fn, args=[1], timeout=0.3) for i in range(self.max_workers + 2)]
+            results = c.wait(futures, timeout=10)
+            assert c.time() - t0 < 1, c.time() - t0
+            assert all(r['success'] == False and r['error'].startswith('TimeoutError') for r in results), results
+            assert self.metrics()['timeouts'] == len(futures)
+            # the late results are dropped and the pool keeps working
+            c.sleep(1.5)
+            assert self.submit(cls.fn, args=[4], timeout=10, return_future=False) == 8
+        finally:
+            self.shutdown()
         return {'success': True, 'msg': 'process pool test passed'}
-    
\ No newline at end of file
+
+    @classmethod
+    def benchmark(cls, n:int = 32, work:int = 200000, array_size:int = 10_000_000, max_workers:int = None):
+        """
+        a cpu bound workload on the thread and the process executor, and a large result with and without shared memory
+        """
+        thread_executor = c.module('executor.thread')(max_workers=max_workers or os.cpu_count() or 1)
+        process_executor = cls(max_workers=max_workers)
+        pickle_executor = cls(max_workers=1, min_shared_bytes=None)
+        try:
+            stats = {'n': n, 'cpus': os.cpu_count(), 'process_workers': process_executor.max_workers}
+            for mode, executor in [('thread', thread_executor), ('process', process_executor)]:
+                t0 = c.time()
+                results = c.wait([executor.submit(fn=cls.cpu_fn, args=[work], timeout=60) for i in range(n)], timeout=60)
+                assert len(results) == n and len(set(results)) == 1, results
+                stats[f'{mode}_seconds'] = c.time() - t0
+            stats['process_speedup'] = stats['thread_seconds'] / stats['process_seconds']
+            for mode, executor in [('shared', process_executor), ('pickled', pickle_executor)]:
+                t0 = c.time()
+                result = executor.submit(cls.array_fn, kwargs={'size': array_size}, return_future=False)
+                assert result['array'].shape == (array_size,)
+                stats[f'{mode}_result_seconds'] = c.time() - t0
+            stats['result_mb'] = array_size * 8 / 1e6
+        finally:
+            process_executor.shutdown()
+            pickle_executor.shutdown()
+            thread_executor.shutdown()
+        return stats
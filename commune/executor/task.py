@@ -13,10 +13,13 @@
 # threads finish.
 
 import time
+import threading
 from concurrent.futures._base import Future
 import commune as c
 
 class Task(c.Module):
+    local = threading.local() # the task that runs in the thread
+
     def __init__(self, 
                 fn:str,
                 args:list, 
@@ -28,19 +31,27 @@ class Task(c.Module):
                 **extra_kwargs):
         
         self.future = Future()
+        self.future.task = self # so the caller can cancel a running task from its future
         self.fn = fn # the function to run
         self.start_time = time.time() # the time the task was created
         self.args = args # the arguments of the task
         self.kwargs = kwargs # the arguments of the task
         self.timeout = timeout # the timeout of the task
+        self.deadline = self.start_time + timeout if timeout != None else float('inf') # the future is resolved by then
         self.priority = priority # the priority of the task
         self.data = None # the result of the task
+        self.run_time = None # the time the task started running
+        self.end_time = None # the time the future was resolved
+        self.cancel_event = threading.Event() # set when the task is cancelled or past its deadline
+        self.abandoned = False # the future was resolved while the task was still running
+        self.lock = threading.Lock()
     
         self.fn_name = fn.__name__ if fn != None else str(fn) # the name of the function
         # for the sake of simplicity, we'll just add all the extra kwargs to the task object
         self.extra_kwargs = extra_kwargs
         self.save = save
-        self.status = 'pending' # pending, running, done
+        self.path = path
+        self.status = 'pending' # pending, running, complete, failed, timeout, expired, cancelled
         self.__dict__.update(extra_kwargs)
         # save the task state
 
@@ -78,33 +89,100 @@ class Task(c.Module):
             return self.put(self.paths[self.status], self.state)
         else:
             raise ValueError(f"Task status must be pending or complete, not {self.status}")
-    
+
+    @classmethod
+    def current(cls) -> 'Task':
+        """
+        the task that runs in this thread (None outside of an executor)
+        """
+        return getattr(cls.local, 'task', None)
+
+    @classmethod
+    def should_stop(cls) -> bool:
+        """
+        long running functions check this to stop once their task is cancelled or past its deadline
+        """
+        task = cls.current()
+        return task != None and task.cancel_event.is_set()
+
+    @classmethod
+    def close_loop(cls):
+        """
+        closes the event loop the tasks of this thread ran with (when its worker exits)
+        """
+        loop = getattr(cls.local, 'loop', None)
+        cls.local.loop = None
+        if loop != None and not loop.is_running() and not loop.is_closed():
+            loop.close()
+
+    def start(self) -> bool:
+        """
+        marks the task as running, False if its future is already resolved (expired or cancelled in the queue)
+        """
+        with self.lock:
+            if self.future.done() or not self.future.set_running_or_notify_cancel():
+                return False
+            self.status = 'running'
+            self.run_time = time.time()
+            return True
+
+    def resolve(self, data, status:str) -> bool:
+        """
+        resolves the future once, False if it was already resolved (the result of an abandoned task is dropped)
+        """
+        with self.lock:
+            if self.future.done():
+                return False
+            self.status = status
+            self.end_time = time.time()
+            self.future.set_result(data)
+            return True
+
     def run(self):
         """Run the given work item"""
-        # Checks if future is canceled or if work item is stale
-        if (not self.future.set_running_or_notify_cancel()) or (
-            (time.time() - self.start_time) > self.timeout
-        ):
-            self.future.set_exception(TimeoutError('Task timed out'))
-
+        if time.time() > self.deadline:
+            self.expire() # it waited in the queue past its deadline
+            return False
+        if not self.start():
+            return False
+        if not getattr(Task.local, 'loop', None):
+            # the thread gets an event loop before its first task, the function is never called twice
+            Task.local.loop = c.get_event_loop(nest_asyncio=True)
+        Task.local.task = self
         try:
             data = self.fn(*self.args, **self.kwargs)
-            self.status = 'complete'
+            status = 'complete'
         except Exception as e:
-
-            # what does this do? A: it sets the exception of the future, and sets the status to failed
             data = c.detailed_error(e)
-            if 'event loop' in data['error']: 
-                c.new_event_loop(nest_asyncio=True)
-            self.status = 'failed'
+            status = 'failed'
+        finally:
+            Task.local.task = None
 
-        self.future.set_result(data)
         # store the result of the task
-        
         self.data = data       
+        resolved = self.resolve(data, status)
 
         if self.save:
             self.save_state()
+        return resolved
+
+    def expire(self, reason:str = None) -> str:
+        """
+        resolves the future with a timeout error and tells the function to stop (it is not interrupted),
+        returns the status it had (None if it was already resolved)
+        """
+        with self.lock:
+            if self.future.done():
+                return None
+            status = self.status
+            self.abandoned = status == 'running'
+            reason = reason or f'TimeoutError: task {self.fn_name} did not finish within {self.timeout} seconds ({status})'
+            self.status = 'timeout' if status == 'running' else 'expired'
+            self.end_time = time.time()
+            self.cancel_event.set()
+            # like a failed task, the future holds the error (a pending task is skipped by the worker)
+            self.future.set_result({'error': reason, 'success': False})
+            return status
 
     def result(self) -> object:
         return self.future.result()
@@ -120,8 +198,12 @@ class Task(c.Module):
     def _waiters(self) -> bool:
         return self.future._waiters
 
-    def cancel(self) -> bool:
-        self.future.cancel()
+    def cancel(self) -> str:
+        """
+        cancels a pending task, a running task is told to stop and its future is resolved with an error,
+        returns the status it had (None if it was already resolved)
+        """
+        return self.expire(reason=f'CancelledError: task {self.fn_name} was cancelled')
 
     def running(self) -> bool:
         return self.future.running()
@@ -136,6 +218,3 @@ class Task(c.Module):
             return self.priority < other
         else:
             raise TypeError(f"Cannot compare Task with {type(other)}")
-
-
-
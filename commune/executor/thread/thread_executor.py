@@ -1,37 +1,39 @@
 
 import os
-import sys
 import time
-import queue
-import random
-import weakref
+import heapq
 import itertools
 import threading
 
-from loguru import logger
 from typing import Callable
-import concurrent
 from concurrent.futures._base import Future
 import commune as c
-import gc
 
 Task = c.module('executor.task')
 
-NULL_ENTRY = (sys.maxsize, Task(None, (), {}))
-
 class ThreadPoolExecutor(c.Module):
-    """Base threadpool executor with a priority queue"""
+    """
+    Threadpool executor with a priority queue and per task deadlines
+
+    - the queue is a heap of (priority + aging * queued seconds, seq), a lower value runs first and a waiting task
+      gains aging priority per second, so low priority work is not starved by a stream of high priority work
+    - every task has a deadline (its timeout from submission), a watchdog resolves the future of a task past
+      its deadline with a timeout error, whether it is queued or running. a running task is told to stop
+      (Task.should_stop) and its worker is abandoned: a replacement worker is started while it finishes
+    - submit blocks on a condition until there is room in the queue (or the deadline of the task)
+    """
 
     # Used to assign unique thread names when thread_name_prefix is not supplied.
     _counter = itertools.count().__next__
-    # submit.__doc__ = _base.Executor.submit.__doc__
-    threads_queues = weakref.WeakKeyDictionary()
 
     def __init__(
         self,
         max_workers: int =None,
         maxsize : int =200 ,
         thread_name_prefix : str ="",
+        aging : float = 0.1, # priority a queued task gains per second
+        max_abandoned : int = None, # workers that can be stuck in tasks past their deadline (max_workers if None)
+        idle_timeout : float = 60, # seconds an idle worker (or the watchdog) waits before it exits
     ):
         """Initializes a new ThreadPoolExecutor instance.
         Args:
@@ -43,141 +45,247 @@ class ThreadPoolExecutor(c.Module):
         max_workers = (os.cpu_count() or 1) * 5 if max_workers == None else max_workers
         if max_workers <= 0:
             raise ValueError("max_workers must be greater than 0")
-            
+
         self.max_workers = max_workers
-        self.work_queue = queue.PriorityQueue(maxsize=maxsize)
-        self.idle_semaphore = threading.Semaphore(0)
-        self.threads = []
+        self.maxsize = maxsize
+        self.aging = aging
+        self.max_abandoned = max_workers if max_abandoned == None else max_abandoned
+        self.idle_timeout = idle_timeout
+        self.created = time.time()
+        self.queue = [] # heap of (priority key, seq, task)
+        self.deadlines = [] # heap of (deadline, seq, task) of the queued and running tasks
+        self.seq = itertools.count()
+        self.lock = threading.Lock()
+        self.not_empty = threading.Condition(self.lock)
+        self.not_full = threading.Condition(self.lock)
+        self.deadline_changed = threading.Condition(self.lock)
+        self.workers = 0 # live worker threads
+        self.idle = 0 # workers waiting for a task
+        self.abandoned = 0 # workers still running a task past its deadline
+        self.running = set() # the tasks the workers run
+        self.abandoned_tasks = set() # the running tasks whose futures were resolved (timed out or cancelled)
         self.broken = False
-        self.shutdown = False
-        self.shutdown_lock = threading.Lock()
+        self.stopped = False
+        self.watchdog = None
         self.thread_name_prefix = thread_name_prefix or ("ThreadPoolExecutor-%d" % self._counter() )
+        self.stats = {'submitted': 0,
+                      'completed': 0,
+                      'failed': 0,
+                      'timeouts': 0, # past the deadline while running
+                      'expired': 0, # past the deadline while queued
+                      'cancelled': 0,
+                      'abandoned_total': 0,
+                      'admission_waits': 0,
+                      'rejected': 0,
+                      'queue_wait': 0, # total seconds in the queue of the started tasks
+                      'max_queue_wait': 0,
+                      'run_time': 0, # total seconds of the finished tasks
+                      'max_run_time': 0,
+                      'started': 0}
 
     @property
     def is_empty(self):
-        return self.work_queue.empty()
+        return len(self.queue) == 0
+
+    @property
+    def num_tasks(self):
+        return len(self.queue)
 
-    
-    def submit(self, 
+    def submit(self,
                fn: Callable,
-                args:dict=None, 
-                kwargs:dict=None, 
-                timeout=200, 
+                args:dict=None,
+                kwargs:dict=None,
+                timeout=200,
                 return_future:bool=True,
-                wait = True, 
-                path:str=None) -> Future:
+                wait = True,
+                path:str=None,
+                priority:int = None) -> Future:
         args = args or ()
         kwargs = kwargs or {}
-        # check if the queue is full and if so, raise an exception
-        if self.work_queue.full():
-            if wait:
-                while self.work_queue.full():
-                    time.sleep(0.1)
-            else:
-                return {'success': False, 'msg':"cannot schedule new futures after maxsize exceeded"}
-        with self.shutdown_lock:
+        if priority == None:
+            priority = kwargs.pop("priority", 1)
+        task = Task(fn=fn, args=args, kwargs=kwargs, timeout=timeout, priority=priority, path=path)
+        with self.lock:
             if self.broken:
                 raise Exception("ThreadPoolExecutor is broken")
-            if self.shutdown:
+            if self.stopped:
                 raise RuntimeError("cannot schedule new futures after shutdown")
-            priority = kwargs.get("priority", 1)
-            if "priority" in kwargs:
-                del kwargs["priority"]
-
-            task = Task(fn=fn, args=args, kwargs=kwargs, timeout=timeout, path=path)
-            # add the work item to the queue
-            self.work_queue.put((priority, task), block=False)
-            # adjust the thread count to match the new task
-            self.adjust_thread_count()
-            
+            # wait for room in the queue until the deadline of the task
+            while len(self.queue) >= self.maxsize:
+                if not wait:
+                    self.stats['rejected'] += 1
+                    return {'success': False, 'msg':"cannot schedule new futures after maxsize exceeded"}
+                remaining = task.deadline - time.time()
+                if remaining <= 0:
+                    break
+                self.stats['admission_waits'] += 1
+                self.not_full.wait(timeout=remaining)
+            if len(self.queue) >= self.maxsize:
+                self.stats['rejected'] += 1
+                task.expire(reason=f'TimeoutError: the queue stayed full for {timeout} seconds')
+            else:
+                seq = next(self.seq)
+                heapq.heappush(self.queue, (priority + self.aging * (task.start_time - self.created), seq, task))
+                self.stats['submitted'] += 1
+                if task.deadline != float('inf'):
+                    if len(self.deadlines) == 0 or task.deadline < self.deadlines[0][0]:
+                        self.deadline_changed.notify()
+                    heapq.heappush(self.deadlines, (task.deadline, seq, task))
+                    if len(self.deadlines) > 2 * (len(self.queue) + self.workers) + 1024:
+                        # drop the finished tasks, so their results are not kept until their deadlines
+                        self.deadlines = [entry for entry in self.deadlines if not entry[2].done()]
+                        heapq.heapify(self.deadlines)
+                self.not_empty.notify()
+                # adjust the thread count to match the new task
+                self.adjust_thread_count()
+
         # return the future (MAYBE WE CAN RETURN THE TASK ITSELF)
         if return_future:
             return task.future
-        else: 
+        else:
             return task.future.result()
 
-
     def adjust_thread_count(self):
-        # if idle threads are available, don't spin new threads
-        if self.idle_semaphore.acquire(timeout=0):
+        """
+        starts a worker if none is idle and the pool (without the abandoned workers) is not full, hold the lock
+        """
+        if self.idle >= len(self.queue):
             return
-
-        # When the executor gets lost, the weakref callback will wake up
-        # the worker threads.
-        def weakref_cb(_, q=self.work_queue):
-            q.put(NULL_ENTRY)
-
-        num_threads = len(self.threads)
-        if num_threads < self.max_workers:
-            thread_name = "%s_%d" % (self.thread_name_prefix or self, num_threads)
-            t = threading.Thread(
-                name=thread_name,
-                target=self.worker,
-                args=(
-                    weakref.ref(self, weakref_cb),
-                    self.work_queue,
-                ),
-            )
-            t.daemon = True
+        if self.workers - self.abandoned < self.max_workers:
+            self.workers += 1
+            thread_name = "%s_%d" % (self.thread_name_prefix or self, self.workers)
+            t = threading.Thread(name=thread_name, target=self.worker, daemon=True)
             t.start()
-            self.threads.append(t)
-            self.threads_queues[t] = self.work_queue
+        if self.watchdog == None:
+            self.watchdog = threading.Thread(name=f'{self.thread_name_prefix}_watchdog', target=self.watch_deadlines, daemon=True)
+            self.watchdog.start()
 
     def shutdown(self, wait=True):
-        with self.shutdown_lock:
-            self.shutdown = True
-            self.work_queue.put(NULL_ENTRY)
+        with self.lock:
+            self.stopped = True
+            self.not_empty.notify_all()
+            self.not_full.notify_all()
+            self.deadline_changed.notify_all()
         if wait:
-            for t in self.threads:
-                try:
-                    t.join(timeout=2)
-                except Exception:
-                    pass
-
-    @staticmethod
-    def worker(executor_reference, work_queue):
-        c.new_event_loop(nest_asyncio=True)
-    
-        try:
-            while True:
-                work_item = work_queue.get(block=True)
-                priority = work_item[0]
-
-                if priority == sys.maxsize:
-                    # Wake up queue management thread.
-                    work_queue.put(NULL_ENTRY)
-                    break
+            t0 = time.time()
+            while self.workers - self.abandoned > 0 and time.time() - t0 < 2:
+                time.sleep(0.01)
 
-                item = work_item[1]
+    def worker(self):
+        while True:
+            with self.lock:
+                while len(self.queue) == 0 and not self.stopped:
+                    self.idle += 1
+                    notified = self.not_empty.wait(timeout=self.idle_timeout)
+                    self.idle -= 1
+                    if not notified:
+                        break
+                if len(self.queue) == 0:
+                    self.workers -= 1
+                    Task.close_loop()
+                    return
+                _, _, task = heapq.heappop(self.queue)
+                self.running.add(task)
+                self.not_full.notify()
+            started = task.run_time == None and not task.done()
+            queue_wait = time.time() - task.start_time
+            task.run()
+            with self.lock:
+                if task.run_time != None and started:
+                    stats = self.stats
+                    run_time = time.time() - task.run_time
+                    stats['started'] += 1
+                    stats['queue_wait'] += queue_wait
+                    stats['max_queue_wait'] = max(stats['max_queue_wait'], queue_wait)
+                    stats['run_time'] += run_time
+                    stats['max_run_time'] = max(stats['max_run_time'], run_time)
+                    if task.status == 'complete':
+                        stats['completed'] += 1
+                    elif task.status == 'failed':
+                        stats['failed'] += 1
+                self.running.discard(task)
+                if task in self.abandoned_tasks:
+                    self.abandoned_tasks.discard(task)
+                    self.abandoned -= 1
+                    # a replacement took the place of this worker
+                    if self.workers - self.abandoned > self.max_workers:
+                        self.workers -= 1
+                        Task.close_loop()
+                        return
+            del task
 
-                if item is not None:
-                    item.run()
-                    # Delete references to object. See issue16284
-                    del item
+    def watch_deadlines(self):
+        """
+        resolves the futures of the tasks past their deadline
+        """
+        while True:
+            expired = []
+            with self.lock:
+                while len(self.deadlines) > 0 and self.deadlines[0][2].done():
+                    heapq.heappop(self.deadlines)
+                if self.stopped and self.workers - self.abandoned == 0:
+                    self.watchdog = None
+                    return
+                if len(self.deadlines) == 0:
+                    if not self.deadline_changed.wait(timeout=self.idle_timeout) and len(self.deadlines) == 0:
+                        self.watchdog = None # started again with the next worker
+                        return
+                    continue
+                now = time.time()
+                while len(self.deadlines) > 0 and self.deadlines[0][0] <= now:
+                    expired.append(heapq.heappop(self.deadlines)[2])
+                if len(expired) == 0:
+                    self.deadline_changed.wait(timeout=self.deadlines[0][0] - now)
                     continue
+            for task in expired:
+                status = task.expire()
+                with self.lock:
+                    if status == 'pending':
+                        self.stats['expired'] += 1
+                    elif status == 'running':
+                        self.stats['timeouts'] += 1
+                        self.abandon(task)
 
-                executor = executor_reference()
-                # Exit if:
-                #   - The interpreter is shutting down OR
-                #   - The executor that owns the worker has been collected OR
-                #   - The executor that owns the worker has been shutdown.
-                if executor is None or executor.shutdown:
-                    # Flag the executor as shutting down as early as possible if it
-                    # is not gc-ed yet.
-                    if executor is not None:
-                        executor.shutdown = True
-                    # Notice other workers
-                    work_queue.put(NULL_ENTRY)
-                    return
-                del executor
-        except Exception as e:
-            e = c.detailed_error(e)
+    def abandon(self, task:'Task'):
+        """
+        counts the worker of a running task whose future was resolved as abandoned and starts a replacement,
+        unless the worker already finished it, hold the lock
+        """
+        if task not in self.running or task in self.abandoned_tasks:
+            return
+        self.abandoned_tasks.add(task)
+        self.abandoned += 1
+        self.stats['abandoned_total'] += 1
+        if self.abandoned <= self.max_abandoned:
+            self.adjust_thread_count()
 
-    @property
-    def num_tasks(self):
-        return self.work_queue.qsize()
+    def cancel(self, future:Future) -> bool:
+        """
+        cancels the task of the future (a running task is told to stop and a replacement worker takes its place)
+        """
+        task = future.task
+        status = task.cancel()
+        if status == 'running':
+            with self.lock:
+                self.stats['cancelled'] += 1
+                self.abandon(task)
+        elif status == 'pending':
+            with self.lock:
+                self.stats['cancelled'] += 1
+        return status != None
 
-    @classmethod
+    def metrics(self) -> dict:
+        with self.lock:
+            stats = dict(self.stats)
+            return {**stats,
+                    'queued': len(self.queue),
+                    'workers': self.workers,
+                    'idle': self.idle,
+                    'abandoned': self.abandoned,
+                    'avg_queue_wait': stats['queue_wait'] / max(stats['started'], 1),
+                    'avg_run_time': stats['run_time'] / max(stats['started'], 1)}
+
+    @staticmethod
     def as_completed(futures: list):
         assert isinstance(futures, list), "futures must be a list"
         return [f for f in futures if not f.done()]
@@ -190,29 +298,95 @@ class ThreadPoolExecutor(c.Module):
             results += [future.result()]
         return results
 
-    
+
     @classmethod
     def test(cls):
         def fn(x):
             result =  x*2
-            c.print(result)
             return result
-            
+
         self = cls()
         futures = []
         for i in range(10):
             futures += [self.submit(fn=fn, kwargs=dict(x=i))]
-        for future in c.tqdm(futures):
+        for future in futures:
             future.result()
         for i in range(10):
             futures += [self.submit(fn=fn, kwargs=dict(x=i))]
 
         results = c.wait(futures, timeout=10)
-        
-        while self.num_tasks > 0:
-            c.print(self.num_tasks, 'tasks remaining', color='red')
+        assert results == [i * 2 for i in range(10)] * 2, results
+
+        # a running task past its deadline is resolved on time, it is told to stop and a new worker takes its place
+        self = cls(max_workers=1, maxsize=4)
+        stopped = []
+        def stubborn(seconds):
+            t0 = time.time()
+            while time.time() - t0 < seconds:
+                if Task.should_stop():
+                    stopped.append(True)
+                    return 'stopped'
+                time.sleep(0.01)
+            return 'done'
+        t0 = time.time()
+        slow = self.submit(fn=stubborn, args=[5], timeout=0.3)
+        fast = self.submit(fn=fn, kwargs=dict(x=1), timeout=5)
+        assert 'TimeoutError' in slow.result(timeout=2)['error'] and time.time() - t0 < 1
+        assert fast.result(timeout=2) == 2 # ran on the replacement worker
+        time.sleep(0.1)
+        assert stopped == [True] and self.metrics()['timeouts'] == 1
+
+        # a failing task resolves with its error instead of killing the worker
+        error = self.submit(fn=lambda: 1/0).result(timeout=2)
+        assert 'division by zero' in str(error) and self.submit(fn=fn, kwargs=dict(x=2)).result(timeout=2) == 4
+
+        # the worker has an event loop before the first call, and a failing function is never called again
+        calls = []
+        def loop_fn():
+            import asyncio
+            calls.append(asyncio.get_event_loop())
+            raise RuntimeError('no event loop here')
+        assert 'event loop' in str(self.submit(fn=loop_fn).result(timeout=2)) and len(calls) == 1 and calls[0] != None
+
+        # a queued task past its deadline is not run, submit blocks while the queue is full
+        self = cls(max_workers=1, maxsize=2, aging=0)
+        blocker = self.submit(fn=time.sleep, args=[0.5], timeout=5)
+        queued = [self.submit(fn=fn, kwargs=dict(x=i), timeout=0.2) for i in range(2)]
+        t0 = time.time()
+        late = self.submit(fn=fn, kwargs=dict(x=3), timeout=5) # waits for room
+        assert time.time() - t0 > 0.1 and self.stats['admission_waits'] >= 1
+        assert all('TimeoutError' in f.result(timeout=2)['error'] for f in queued) and late.result(timeout=2) == 6
+        assert self.metrics()['expired'] == 2
 
+        # priorities, and aging lets the old low priority tasks run before the new high priority ones
+        for aging, expected in [(0, ['high', 'high', 'low']), (100, ['low', 'high', 'high'])]:
+            self = cls(max_workers=1, aging=aging)
+            order = []
+            self.submit(fn=time.sleep, args=[0.2], timeout=5)
+            self.submit(fn=order.append, args=['low'], priority=10, timeout=5)
+            time.sleep(0.1)
+            futures = [self.submit(fn=order.append, args=['high'], priority=1, timeout=5) for i in range(2)]
+            c.wait(futures, timeout=5)
+            time.sleep(0.05)
+            assert order == expected, (aging, order)
 
-        return {'success': True, 'msg': 'thread pool test passed'}
+        # cancelling a running task
+        self = cls(max_workers=1)
+        future = self.submit(fn=stubborn, args=[5], timeout=10)
+        time.sleep(0.1)
+        assert self.cancel(future) and 'CancelledError' in future.result(timeout=1)['error']
+        # the cancelled worker is replaced, and it leaves once it returns
+        assert self.submit(fn=fn, kwargs=dict(x=3), timeout=5).result(timeout=2) == 6
+        time.sleep(0.1)
+        metrics = self.metrics()
+        assert metrics['abandoned'] == 0 and metrics['workers'] == 1 and metrics['cancelled'] == 1, metrics
+        assert self.submit(fn=fn, kwargs=dict(x=4), timeout=5).result(timeout=2) == 8
 
-        
\ No newline at end of file
+        # overhead per task
+        self = cls(max_workers=8, maxsize=10000)
+        n = 10000
+        t0 = time.time()
+        futures = [self.submit(fn=fn, kwargs=dict(x=i)) for i in range(n)]
+        c.wait(futures, timeout=30)
+        task_us = 1e6 * (time.time() - t0) / n
+        return {'success': True, 'msg': 'thread pool test passed', 'task_us': task_us, 'metrics': self.metrics()}
@@ -1,33 +1,336 @@
 import commune as c
+import os
+import json
+import atexit
+import threading
+from typing import *
 
 class History(c.Module):
-    def __init__(self, key=None, history_path='history'):
-        self.key = c.get_key(key)
+    """
+    Append-only history of requests
+
+    records are buffered in memory and flushed in batches (write-behind) to rotating segment files,
+    every process writes its own segments and index, so writers never contend for a file
+        {history_path}/{writer}.{segment}.jsonl    one json record per line
+        {history_path}/{writer}.index.json         per segment: n, size, time range, modules, keys and fns
+    queries only read the segments whose index matches
+    """
+    path2store = {} # one store per history path per process
+
+    def __init__(self,
+                 history_path:str = 'history',
+                 flush_interval:float = 1.0, # seconds between background flushes
+                 max_buffer:int = 1000, # flush once this many records are buffered
+                 segment_size:int = 10000, # records per segment before rotating
+                 ):
         self.history_path = history_path
-        c.print(f"History path: {self.history_path}", color='green')
-        
-    def add_history(self, item:dict,  key=None):
-        path = self.history_path+'/' + self.key.ss58_address + '/' + str(item['timestamp'])
-        return self.put(path, item)
-    
+        self.dirpath = self.resolve_path(history_path)
+        os.makedirs(self.dirpath, exist_ok=True)
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.segment_size = segment_size
+        self.writer = f'{int(c.time() * 1000)}_{os.getpid()}'
+        self.buffer = []
+        self.lock = threading.Lock() # guards the buffer
+        self.flush_lock = threading.Lock() # guards the segments and the index
+        self.flush_event = threading.Event()
+        self.index = {} # segment -> info, for the segments of this writer
+        self.segment = None
+        self.closed = False
+        c.thread(self.flush_loop)
+        atexit.register(self.flush)
+
     @classmethod
-    def history(cls, key=None, history_path='history'):
-        key = c.get_key(key)
-        return cls.ls(history_path + '/' + key.ss58_address)
-    
-    
+    def store(cls, history_path:str = 'history', **kwargs) -> 'History':
+        """
+        the shared store of a history path
+        """
+        if history_path not in cls.path2store:
+            cls.path2store[history_path] = cls(history_path=history_path, **kwargs)
+        return cls.path2store[history_path]
+
+    def add(self, record:dict) -> dict:
+        """
+        buffers the record, it is written to disk by the next flush
+        """
+        if 'timestamp' not in record:
+            record['timestamp'] = c.timestamp()
+        with self.lock:
+            self.buffer.append(record)
+            n = len(self.buffer)
+        if n >= self.max_buffer:
+            self.flush_event.set()
+        return {'success': True, 'buffered': n}
+
+    add_history = add
+
+    def flush_loop(self):
+        while not self.closed:
+            self.flush_event.wait(timeout=self.flush_interval)
+            self.flush_event.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                c.print(f'Failed to flush {self.history_path}: {e}', color='red')
+
+    def flush(self) -> dict:
+        """
+        appends the buffered records to the segments (rotating them) and writes the index
+        """
+        with self.flush_lock:
+            with self.lock:
+                records, self.buffer = self.buffer, []
+            n = len(records)
+            while len(records) > 0:
+                if self.segment == None or self.index[self.segment]['n'] >= self.segment_size:
+                    self.segment = f'{self.writer}.{len(self.index):06d}'
+                    self.index[self.segment] = {'n': 0,
+                                                'size': 0,
+                                                'start_time': None,
+                                                'end_time': None,
+                                                'modules': set(),
+                                                'keys': set(),
+                                                'fns': set()}
+                info = self.index[self.segment]
+                chunk = records[:self.segment_size - info['n']]
+                records = records[len(chunk):]
+                lines = ''.join(json.dumps(r, default=str) + '\n' for r in chunk)
+                with open(self.segment_path(self.segment), 'a') as f:
+                    f.write(lines)
+                timestamps = [r['timestamp'] for r in chunk]
+                info['n'] += len(chunk)
+                info['size'] += len(lines)
+                info['start_time'] = min(timestamps + ([info['start_time']] if info['start_time'] != None else []))
+                info['end_time'] = max(timestamps + ([info['end_time']] if info['end_time'] != None else []))
+                for r in chunk:
+                    info['modules'].add(r.get('module', None))
+                    info['keys'].add(r.get('key', None))
+                    info['fns'].add(r.get('fn', None))
+            if n > 0:
+                self.write_index()
+        return {'success': True, 'n': n}
+
+    def segment_path(self, segment:str) -> str:
+        return os.path.join(self.dirpath, f'{segment}.jsonl')
+
+    def write_index(self):
+        index = {segment: {k: list(v) if isinstance(v, set) else v for k,v in info.items()} for segment, info in self.index.items()}
+        path = os.path.join(self.dirpath, f'{self.writer}.index.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(index, f)
+        os.replace(path + '.tmp', path)
+
+    def read_index(self) -> Dict[str, dict]:
+        """
+        the index of every writer of this history path
+        """
+        index = {}
+        for filename in os.listdir(self.dirpath):
+            if filename.endswith('.index.json'):
+                try:
+                    with open(os.path.join(self.dirpath, filename)) as f:
+                        index.update(json.load(f))
+                except Exception as e:
+                    c.print(f'Failed to read {filename}: {e}', color='red')
+        return index
+
+    def segments(self,
+                 module:str = None,
+                 key:str = None,
+                 fn:str = None,
+                 start_time:float = None,
+                 end_time:float = None,
+                 index:Dict[str, dict] = None) -> List[str]:
+        """
+        the segments that can hold matching records, newest first
+        """
+        segments = []
+        index = index if index != None else self.read_index()
+        for segment, info in index.items():
+            if info['n'] == 0:
+                continue
+            if module != None and module not in info['modules']:
+                continue
+            if key != None and key not in info['keys']:
+                continue
+            if fn != None and fn not in info['fns']:
+                continue
+            if start_time != None and info['end_time'] < start_time:
+                continue
+            if end_time != None and info['start_time'] > end_time:
+                continue
+            segments.append((info['end_time'], segment))
+        return [segment for _, segment in sorted(segments, reverse=True)]
+
+    @staticmethod
+    def matches(record:dict,
+                module:str = None,
+                key:str = None,
+                fn:str = None,
+                start_time:float = None,
+                end_time:float = None) -> bool:
+        return (module == None or record.get('module') == module) and \
+               (key == None or record.get('key') == key) and \
+               (fn == None or record.get('fn') == fn) and \
+               (start_time == None or record['timestamp'] >= start_time) and \
+               (end_time == None or record['timestamp'] <= end_time)
+
+    def query(self,
+              module:str = None,
+              key:str = None,
+              fn:str = None,
+              start_time:float = None,
+              end_time:float = None,
+              n:int = None) -> List[dict]:
+        """
+        the matching records, newest first (including the ones that are not flushed yet)
+        """
+        filters = dict(module=module, key=key, fn=fn, start_time=start_time, end_time=end_time)
+        match = lambda r: self.matches(r, **filters)
+        # a snapshot of the buffer and of the segment sizes, no flush can move records between them while it is taken,
+        # the segments are read outside the lock and only up to their size in the snapshot
+        with self.flush_lock:
+            with self.lock:
+                buffer = list(self.buffer)
+            index = self.read_index()
+        results = [r for r in reversed(buffer) if match(r)]
+        for segment in self.segments(index=index, **filters):
+            if n != None and len(results) >= n:
+                break
+            path = self.segment_path(segment)
+            if not os.path.exists(path):
+                continue
+            with open(path) as f:
+                lines = f.read(index[segment]['size']).splitlines()
+            segment_results = []
+            for line in lines:
+                try:
+                    record = json.loads(line)
+                except Exception as e:
+                    continue # cut by a rewrite of the segment (rm_records) after the snapshot
+                if match(record):
+                    segment_results.append(record)
+            results += sorted(segment_results, key=lambda r: r['timestamp'], reverse=True)
+        return results[:n] if n != None else results
+
+    def df(self, features:List[str] = None, **kwargs):
+        df = c.df(self.query(**kwargs))
+        if features != None and len(df) > 0:
+            df = df[[f for f in features if f in df.columns]]
+        return df
+
+    def rm_records(self, module:str = None, key:str = None, fn:str = None) -> dict:
+        """
+        rewrites the segments without the matching records and updates their index,
+        the segments of other writers are updated in their index files (a writer that is still running keeps its own index)
+        """
+        self.flush()
+        n = 0
+        with self.flush_lock:
+            writer2index = {}
+            for segment in self.segments(module=module, key=key, fn=fn):
+                path = self.segment_path(segment)
+                if not os.path.exists(path):
+                    continue
+                with open(path) as f:
+                    lines = f.read().splitlines()
+                records = [json.loads(l) for l in lines]
+                keep = [i for i, r in enumerate(records) if not self.matches(r, module=module, key=key, fn=fn)]
+                if len(keep) == len(lines):
+                    continue
+                n += len(lines) - len(keep)
+                with open(path + '.tmp', 'w') as f:
+                    f.write(''.join(lines[i] + '\n' for i in keep))
+                os.replace(path + '.tmp', path)
+                writer = segment.rsplit('.', 1)[0]
+                writer2index.setdefault(writer, {})[segment] = self.segment_info([records[i] for i in keep], [lines[i] for i in keep])
+            for writer, updates in writer2index.items():
+                if writer == self.writer:
+                    self.index.update(updates)
+                    self.write_index()
+                else:
+                    path = os.path.join(self.dirpath, f'{writer}.index.json')
+                    with open(path) as f:
+                        index = json.load(f)
+                    index.update({segment: {k: list(v) if isinstance(v, set) else v for k, v in info.items()} for segment, info in updates.items()})
+                    with open(path + '.tmp', 'w') as f:
+                        json.dump(index, f)
+                    os.replace(path + '.tmp', path)
+        return {'success': True, 'removed': n}
+
+    @staticmethod
+    def segment_info(records:List[dict], lines:List[str]) -> dict:
+        """
+        the index entry of a segment with the records (and their json lines)
+        """
+        timestamps = [r['timestamp'] for r in records]
+        return {'n': len(records),
+                'size': sum(len(l) + 1 for l in lines),
+                'start_time': min(timestamps, default=None),
+                'end_time': max(timestamps, default=None),
+                'modules': set(r.get('module', None) for r in records),
+                'keys': set(r.get('key', None) for r in records),
+                'fns': set(r.get('fn', None) for r in records)}
+
     @classmethod
-    def all_history(cls, key=None, history_path='history'):
+    def history(cls, key=None, history_path='history', **kwargs):
         key = c.get_key(key)
-        return cls.glob(history_path)
-        
+        return cls.store(history_path).query(key=key.ss58_address, **kwargs)
+
+    @classmethod
+    def all_history(cls, history_path='history', **kwargs):
+        return cls.store(history_path).query(**kwargs)
+
     @classmethod
     def rm_key_history(cls, key=None, history_path='history'):
         key = c.get_key(key)
-        return cls.rm(history_path + '/' + key.ss58_address)
-    
+        return cls.store(history_path).rm_records(key=key.ss58_address)
+
     @classmethod
-    def rm_history(cls, key=None, history_path='history'):
-        key = c.get_key(key)
+    def rm_history(cls, history_path='history'):
+        store = cls.path2store.pop(history_path, None)
+        if store != None:
+            store.closed = True
+            with store.lock:
+                store.buffer = []
         return cls.rm(history_path)
 
+    @classmethod
+    def test(cls, n:int = 2500, history_path:str = 'test_history'):
+        cls.rm_history(history_path)
+        self = cls.store(history_path, segment_size=1000)
+        t0 = c.time()
+        for i in range(n):
+            self.add({'module': f'module{i % 5}', 'key': f'key{i % 3}', 'fn': 'forward', 'timestamp': t0 + i})
+        add_us = 1e6 * (c.time() - t0) / n
+        assert len(self.query(module='module0')) == n // 5
+        self.flush()
+        assert len(self.index) == -(-n // 1000), self.index.keys()
+        assert len(self.query(module='module0')) == n // 5
+        assert len(self.query(key='key1', n=10)) == 10
+        assert len(self.query(start_time=t0 + n - 100)) == 100
+        assert self.query(n=1)[0]['timestamp'] == t0 + n - 1
+        assert self.rm_records(module='module1')['removed'] == n // 5
+        assert len(self.query(module='module1')) == 0
+        # the index no longer points the removed module at any segment, and the sizes match the rewritten files
+        index = self.read_index()
+        assert self.segments(module='module1') == [] and sum(info['n'] for info in index.values()) == n - n // 5
+        assert all(info['size'] == os.path.getsize(self.segment_path(segment)) for segment, info in index.items())
+        # records added after the removal are appended after the rewritten records
+        self.add({'module': 'module1', 'key': 'key0', 'fn': 'forward', 'timestamp': t0 + n})
+        self.flush()
+        assert [r['timestamp'] for r in self.query(module='module1')] == [t0 + n]
+        assert len(self.query()) == n - n // 5 + 1
+        # queries that run while records are flushed see every record once
+        def add_and_flush():
+            for i in range(n):
+                self.add({'module': 'module9', 'key': 'key0', 'fn': 'forward', 'timestamp': t0 + n + 1 + i})
+                if i % 100 == 0:
+                    self.flush()
+        thread = c.thread(add_and_flush)
+        while thread.is_alive():
+            timestamps = [r['timestamp'] for r in self.query(module='module9')]
+            assert len(timestamps) == len(set(timestamps)), 'a record was read twice'
+        assert len(self.query(module='module9')) == n
+        cls.rm_history(history_path)
+        return {'success': True, 'msg': 'history test passed', 'add_us': add_us}
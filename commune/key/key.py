@@ -1,5 +1,6 @@
 
 import json
+import os
 from scalecodec.utils.ss58 import ss58_encode, ss58_decode, get_ss58_format
 from scalecodec.base import ScaleBytes
 from typing import Union, Optional
@@ -319,6 +320,13 @@ class Keypair(c.Module):
 
     
 
+    @classmethod
+    def keystore(cls):
+        """
+        the index of the key directory, shared by every lookup in this process
+        """
+        return c.module('key.store').store(cls.resolve_path(''))
+
     @classmethod
     def get_key(cls, 
                 path:str,
@@ -334,26 +342,18 @@ class Keypair(c.Module):
             else:
                 raise ValueError(f'key does not exist at --> {path}')
         
-        key_json = cls.get(path)
-
-        # if key is encrypted, decrypt it
-        if c.is_encrypted(key_json):
-            key_json = cls.decrypt(data=key_json, password=password)
-            if key_json == None:
-                c.print({'status': 'error', 'message': f'key is encrypted, please {path} provide password'}, color='red')
-            return None
-
-
-        if isinstance(key_json, str):
-            key_json = c.jload(key_json)
-
-
+        # the keys are decoded once and cached until their file changes
+        keystore = cls.keystore()
         if json:
-            key_json['path'] = path
-            return key_json
+            key_json = keystore.key_json(path, password=password)
+            if key_json != None:
+                key_json = {**key_json, 'path': path}
         else:
-            key = cls.from_json(key_json)
-            return key
+            key_json = key = keystore.get_key(path, password=password)
+        if key_json == None:
+            c.print({'status': 'error', 'message': f'key is encrypted, please {path} provide password'}, color='red')
+            return None
+        return key_json if json else key
         
         
         
@@ -372,21 +372,11 @@ class Keypair(c.Module):
         
     @classmethod
     def key2address(cls, search=None, update:bool=False):
-        path = 'key2address'
-        key2address = []
-        if not update:
-            key2address =  cls.get(path, key2address)
-        
-        if len(key2address) == 0:
-            key2address =  { k: v.ss58_address for k,v  in cls.get_keys(search).items()}
-            cls.put(path, key2address)
-        if search != None:
-            key2address =  {k:v for k,v in key2address.items() if  search in k}
-        return key2address
+        return cls.keystore().key2address(search=search, update=update)
 
     @classmethod
     def address2key(cls, search:Optional[str]=None, update:bool=False):
-        address2key =  { v: k for k,v in cls.key2address(update=update).items()}
+        address2key = cls.keystore().address2key(update=update)
         if search != None :
             return address2key.get(search, None)
         return address2key
@@ -408,14 +398,12 @@ class Keypair(c.Module):
     
     @classmethod
     def key_paths(cls):
-        return cls.ls()
+        return list(cls.key2path().values())
     
 
     @classmethod
     def key2path(cls) -> dict:
-        
-        key2path = {'.'.join(path.split('/')[-1].split('.')[:-1]):path for path in cls.key_paths()}
-        return key2path
+        return cls.keystore().key2path()
 
     @classmethod
     def keys(cls, search : str = None, 
@@ -442,12 +430,8 @@ class Keypair(c.Module):
     
     @classmethod
     def key_exists(cls, key):
-        key_exists =  key in cls.keys()
-        if not key_exists:
-            addresses = list(cls.key2address().values())
-            if key in addresses:
-                key_exists = True
-        return key_exists
+        # by name or by address
+        return cls.keystore().exists(key)
     
 
     @classmethod
@@ -996,20 +980,32 @@ class Keypair(c.Module):
         -------
         True if data is signed with this Keypair, otherwise False
         """
+        signature, data, public_key = self.resolve_signature_input(data, signature=signature, public_key=public_key, seperator=seperator)
+        return self.verify_signatures(self.crypto_type, [(signature, data, public_key)])[0]
+
+    def resolve_signature_input(self, data: Union[ScaleBytes, bytes, str, dict], 
+                                signature: Union[bytes, str] = None,
+                                public_key:Optional[str]= None, 
+                                seperator = "<DATA::SIGNATURE>") -> tuple:
+        """
+        normalizes the input of verify into (signature, data, public_key) bytes
+        """
         if isinstance(data, str) and seperator in data:
             data, signature = data.split(seperator)
 
-        data = c.copy(data)
-
         if isinstance(data, dict):
-
-            crypto_type = int(data.pop('crypto_type'))
-            signature = data.pop('signature')
-            public_key = c.ss58_decode(data.pop('address'))
+            # read the fields instead of copying and popping the whole input
+            signature = data['signature']
+            public_key = c.ss58_decode(data['address'])
             if 'data' in data:
-                data = data.pop('data')
+                data = data['data']
+            else:
+                data = {k:v for k,v in data.items() if k not in ['crypto_type', 'signature', 'address']}
             
-            if not isinstance(data, str):
+            if isinstance(data, (dict, list)):
+                # same encoding as python2str, without its deepcopy
+                data = json.dumps(data)
+            elif not isinstance(data, str):
                 data = c.python2str(data)
             
                 
@@ -1034,23 +1030,110 @@ class Keypair(c.Module):
         if type(signature) is not bytes:
             raise TypeError("Signature should be of type bytes or a hex-string")
 
-        if self.crypto_type == KeypairType.SR25519:
+        return signature, data, public_key
+
+    @staticmethod
+    def verify_signatures(crypto_type:int, items:list) -> list:
+        """
+        verifies normalized [(signature, data, public_key)] of one crypto type, this runs in the workers of verify_batch
+        """
+        if crypto_type == KeypairType.SR25519:
             crypto_verify_fn = sr25519.verify
-        elif self.crypto_type == KeypairType.ED25519:
+        elif crypto_type == KeypairType.ED25519:
             crypto_verify_fn = ed25519_zebra.ed_verify
-        elif self.crypto_type == KeypairType.ECDSA:
+        elif crypto_type == KeypairType.ECDSA:
             crypto_verify_fn = ecdsa_verify
         else:
             raise ConfigurationError("Crypto type not supported")
 
-        verified = crypto_verify_fn(signature, data, public_key)
+        results = []
+        for signature, data, public_key in items:
+            try:
+                verified = crypto_verify_fn(signature, data, public_key)
+                if not verified:
+                    # Another attempt with the data wrapped, as discussed in https://github.com/polkadot-js/extension/pull/743
+                    # Note: As Python apps are trusted sources on its own, no need to wrap data when signing from this lib
+                    verified = crypto_verify_fn(signature, b'<Bytes>' + data + b'</Bytes>', public_key)
+            except Exception as e:
+                verified = False
+            results.append(bool(verified))
+        return results
+
+    def verify_batch(self, items:list, 
+                     workers:int = None, 
+                     chunk_size:int = 256, 
+                     timeout:int = 60) -> list:
+        """
+        verifies many signatures at once, [self.verify(item) for item in items] as a list of bools
+        (an item is a signed dict, a data<DATA::SIGNATURE>signature string or a (data, signature, public_key) tuple)
 
-        if not verified:
-            # Another attempt with the data wrapped, as discussed in https://github.com/polkadot-js/extension/pull/743
-            # Note: As Python apps are trusted sources on its own, no need to wrap data when signing from this lib
-            verified = crypto_verify_fn(signature, b'<Bytes>' + data + b'</Bytes>', public_key)
+        every payload is normalized once in this process, then the signatures are checked in chunks.
+        the crypto backends have no batch verification and hold the GIL, so with workers > 1 the chunks
+        run on the warm process pool (c.executor(mode='process')), which pays off for large batches and ECDSA.
+        an item that cannot be normalized is False
+        """
+        results = [False] * len(items)
+        indices, resolved = [], []
+        for i, item in enumerate(items):
+            try:
+                if isinstance(item, (list, tuple)):
+                    item = self.resolve_signature_input(*item)
+                else:
+                    item = self.resolve_signature_input(item)
+            except Exception as e:
+                continue
+            indices.append(i)
+            resolved.append(item)
+        workers = min(workers or 1, os.cpu_count() or 1)
+        if workers > 1 and len(resolved) > chunk_size:
+            chunk_size = max(chunk_size, -(-len(resolved) // (workers * 4)))
+            chunks = [resolved[i:i+chunk_size] for i in range(0, len(resolved), chunk_size)]
+            executor = c.executor(mode='process', max_workers=workers)
+            futures = [executor.submit(fn=self.verify_signatures, args=[self.crypto_type, chunk], timeout=timeout) for chunk in chunks]
+            verified = []
+            for chunk, future in zip(chunks, futures):
+                result = future.result(timeout=timeout)
+                verified += result if isinstance(result, list) else [False] * len(chunk)
+        else:
+            verified = self.verify_signatures(self.crypto_type, resolved)
+        for i, v in zip(indices, verified):
+            results[i] = v
+        return results
+
+    def sign_batch(self, items:list, 
+                   return_json:bool = False, 
+                   return_str:bool = False, 
+                   seperator:str = "<DATA::SIGNATURE>") -> list:
+        """
+        signs many payloads, [self.sign(item) for item in items] with the key and the signing function resolved once
+        """
+        if not self.private_key:
+            raise ConfigurationError('No private key set to create signatures')
+        if self.crypto_type == KeypairType.SR25519:
+            keypair = (self.public_key, self.private_key)
+            sign_fn = lambda data: sr25519.sign(keypair, data)
+        elif self.crypto_type == KeypairType.ED25519:
+            sign_fn = lambda data: ed25519_zebra.ed_sign(self.private_key, data)
+        elif self.crypto_type == KeypairType.ECDSA:
+            sign_fn = lambda data: ecdsa_sign(self.private_key, data)
+        else:
+            raise ConfigurationError("Crypto type not supported")
 
-        return verified
+        signatures = []
+        for data in items:
+            if not isinstance(data, str):
+                data = c.python2str(data)
+            if data[0:2] == '0x':
+                data = bytes.fromhex(data[2:])
+            else:
+                data = data.encode()
+            signature = sign_fn(data)
+            if return_json:
+                signature = {'data': data.decode(), 'crypto_type': self.crypto_type, 'signature': signature.hex(), 'address': self.ss58_address}
+            elif return_str:
+                signature = f'{data.decode()}{seperator}{signature.hex()}'
+            signatures.append(signature)
+        return signatures
 
 
 
@@ -1183,6 +1266,53 @@ class Keypair(c.Module):
         assert self.verify(sig, self.public_key)
         return {'success':True}
 
+    def test_batch_signing(self, n:int = 20):
+        data = [{'args': [i], 'timestamp': c.timestamp()} for i in range(n)]
+        signed = self.sign_batch(data, return_json=True)
+        # sr25519 signatures are randomized, everything else is the same as sign
+        assert {**signed[0], 'signature': None} == {**self.sign(data[0], return_json=True), 'signature': None}
+        other = Keypair.create_from_uri('//Bob')
+        items = signed + [{**signed[0], 'data': signed[1]['data']},
+                          other.sign('test', return_str=True),
+                          ('test', self.sign('test'), self.public_key),
+                          {'data': 'not signed'}]
+        results = self.verify_batch(items)
+        assert results == [True] * n + [False, False, True, False], results
+        assert results == [self.verify(item) if not isinstance(item, tuple) else self.verify(*item) for item in items[:-1]] + [False]
+        return {'success':True}
+
+    @classmethod
+    def benchmark_batch(cls, n:int = 1000, workers:int = None, crypto_types:list = ['sr25519', 'ed25519', 'ecdsa']):
+        """
+        signatures per second of verify, verify_batch and sign_batch for every crypto type
+        (ECDSA is pure python, so it runs on n // 10 payloads)
+        """
+        workers = workers or os.cpu_count() or 1
+        stats = {'cpus': os.cpu_count(), 'workers': workers}
+        for crypto_type in crypto_types:
+            key = cls.gen(crypto_type=crypto_type)
+            m = n // 10 if crypto_type == 'ecdsa' else n
+            data = [{'args': [i], 'timestamp': c.timestamp()} for i in range(m)]
+            t0 = c.time()
+            signed = key.sign_batch(data, return_json=True)
+            sign_seconds = c.time() - t0
+            t0 = c.time()
+            assert all(key.verify(s) for s in signed)
+            verify_seconds = c.time() - t0
+            t0 = c.time()
+            assert all(key.verify_batch(signed))
+            batch_seconds = c.time() - t0
+            stat = {'n': m,
+                    'sign_batch_per_second': m / sign_seconds,
+                    'verify_per_second': m / verify_seconds,
+                    'verify_batch_per_second': m / batch_seconds}
+            if workers > 1:
+                t0 = c.time()
+                assert all(key.verify_batch(signed, workers=workers, chunk_size=max(m // (4 * workers), 1)))
+                stat['verify_batch_workers_per_second'] = m / (c.time() - t0)
+            stats[crypto_type] = stat
+        return stats
+
     encrypted_prefix = 'ENCRYPTED::'
 
     @classmethod
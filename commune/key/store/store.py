@@ -0,0 +1,260 @@
+import commune as c
+import os
+import json
+import hashlib
+import threading
+from typing import *
+
+
+class KeyStore(c.Module):
+    """
+    In memory index of the key directory {name: {path, ss58_address, crypto_type, mtime, encrypted}}
+
+    the directory is listed again when its mtime changed (a key was added or removed) or every scan_interval seconds
+    (a key file rewritten in place), and only the key files whose (mtime, size) changed are read again.
+    the decoded keys are cached until their file changes, a decrypted key only for encrypted_ttl seconds
+    and only for the same password (None means decrypted keys are not cached)
+    """
+    path2store = {} # one store per key directory per process
+
+    def __init__(self, path:str = None, scan_interval:float = 1.0, encrypted_ttl:float = None):
+        self.path = path or c.module('key').resolve_path('')
+        self.scan_interval = scan_interval
+        self.encrypted_ttl = encrypted_ttl
+        self.lock = threading.Lock()
+        self.name2info = {}
+        self.address2name = {}
+        self.ignored = {} # name -> signature of the json files that are not keys
+        self.name2key = {} # name -> {signature, json, key, password, expires}
+        self.dir_mtime = None
+        self.scan_time = 0
+        self.version = 0
+        self.stats = {'scans': 0, 'reads': 0, 'key_hits': 0, 'key_misses': 0}
+
+    @classmethod
+    def store(cls, path:str = None, **kwargs) -> 'KeyStore':
+        """
+        the shared store of a key directory
+        """
+        path = path or c.module('key').resolve_path('')
+        if path not in cls.path2store:
+            cls.path2store[path] = cls(path=path, **kwargs)
+        return cls.path2store[path]
+
+    def sync(self, force:bool = False) -> int:
+        """
+        brings the index up to date with the directory, returns the version of the index
+        """
+        from commune.storage.cache.cache import StorageCache
+        # the keys written behind by the storage cache are flushed to the directory first
+        StorageCache.flush_path(self.path)
+        try:
+            dir_mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            dir_mtime = None
+        if not force and dir_mtime == self.dir_mtime and c.time() - self.scan_time < self.scan_interval:
+            return self.version
+        with self.lock:
+            name2info, ignored = {}, {}
+            entries = os.scandir(self.path) if dir_mtime != None else []
+            for entry in entries:
+                if not entry.name.endswith('.json') or not entry.is_file():
+                    continue
+                name = entry.name[:-len('.json')]
+                stat = entry.stat()
+                signature = (stat.st_mtime_ns, stat.st_size)
+                info = self.name2info.get(name, None)
+                if info != None and info['signature'] == signature:
+                    name2info[name] = info
+                elif self.ignored.get(name, None) == signature:
+                    ignored[name] = signature
+                else:
+                    info = self.read_info(entry.path, signature)
+                    if info != None:
+                        name2info[name] = info
+                    else:
+                        ignored[name] = signature
+            if name2info != self.name2info:
+                self.name2info = name2info
+                self.address2name = {info['ss58_address']: name for name, info in sorted(name2info.items()) if info['ss58_address'] != None}
+                # the keys that were removed or rewritten are decoded again
+                self.name2key = {name: cached for name, cached in self.name2key.items()
+                                 if name in name2info and cached['signature'] == name2info[name]['signature']}
+                self.version += 1
+            self.ignored = ignored
+            self.dir_mtime = dir_mtime
+            self.scan_time = c.time()
+            self.stats['scans'] += 1
+        return self.version
+
+    def read_info(self, path:str, signature:tuple) -> Optional[dict]:
+        """
+        the index entry of a key file (None if the file is not a key)
+        """
+        self.stats['reads'] += 1
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except Exception as e:
+            return None
+        encrypted = isinstance(data, dict) and data.get('encrypted', False) == True
+        if isinstance(data, dict) and 'data' in data:
+            data = data['data']
+        info = {'path': path, 'signature': signature, 'mtime': signature[0] / 1e9, 'encrypted': encrypted, 'ss58_address': None, 'crypto_type': None}
+        if isinstance(data, str):
+            try:
+                data = json.loads(data)
+            except Exception as e:
+                # an encrypted key only shows its name until it is decrypted
+                info['encrypted'] = True
+                return info
+        if not isinstance(data, dict) or 'ss58_address' not in data or 'public_key' not in data:
+            return None
+        info.update(ss58_address=data['ss58_address'], crypto_type=data.get('crypto_type', None))
+        return info
+
+    def resolve_name(self, key:str) -> Optional[str]:
+        """
+        the name of a key from its name or its ss58 address
+        """
+        self.sync()
+        if key in self.name2info:
+            return key
+        return self.address2name.get(key, None)
+
+    def exists(self, key:str) -> bool:
+        return self.resolve_name(key) != None
+
+    def names(self, search:str = None) -> List[str]:
+        self.sync()
+        return sorted(name for name in self.name2info if search == None or search in name)
+
+    def key2path(self) -> Dict[str, str]:
+        self.sync()
+        return {name: info['path'] for name, info in sorted(self.name2info.items())}
+
+    def key2address(self, search:str = None, update:bool = False) -> Dict[str, str]:
+        self.sync(force=update)
+        return {name: info['ss58_address'] for name, info in sorted(self.name2info.items())
+                if info['ss58_address'] != None and (search == None or search in name)}
+
+    def address2key(self, update:bool = False) -> Dict[str, str]:
+        self.sync(force=update)
+        return dict(self.address2name)
+
+    def key_json(self, key:str, password:str = None) -> Optional[dict]:
+        """
+        the json of the key (None if it is encrypted and cannot be decrypted), do not mutate it
+        """
+        cached = self.cached(key, password)
+        return cached['json'] if cached != None else None
+
+    def get_key(self, key:str, password:str = None) -> Optional['Keypair']:
+        """
+        the decoded key from the cache, or from its file if it changed
+        """
+        cached = self.cached(key, password)
+        if cached == None:
+            return None
+        if cached['key'] == None:
+            cached['key'] = c.module('key').from_json(dict(cached['json']))
+        return cached['key']
+
+    def cached(self, key:str, password:str = None) -> Optional[dict]:
+        name = self.resolve_name(key)
+        if name == None:
+            raise ValueError(f'key does not exist at --> {key}')
+        info = self.name2info[name]
+        password_hash = hashlib.sha256(str(password).encode()).hexdigest() if password != None else None
+        cached = self.name2key.get(name, None)
+        if cached != None and cached['signature'] == info['signature']:
+            if not info['encrypted'] or (cached['password'] == password_hash and c.time() < cached['expires']):
+                self.stats['key_hits'] += 1
+                return cached
+        self.stats['key_misses'] += 1
+        with open(info['path']) as f:
+            data = json.load(f)
+        if isinstance(data, dict) and 'data' in data:
+            data = data['data']
+        if info['encrypted']:
+            if password == None:
+                return None
+            try:
+                data = c.decrypt(data, password=password)
+            except Exception as e:
+                return None
+            if data == None:
+                return None
+        if isinstance(data, str):
+            data = json.loads(data)
+        cached = {'signature': info['signature'], 'json': data, 'key': None, 'password': password_hash, 'expires': float('inf')}
+        if info['encrypted']:
+            if self.encrypted_ttl == None:
+                return cached
+            cached['expires'] = c.time() + self.encrypted_ttl
+        self.name2key[name] = cached
+        return cached
+
+    def metrics(self) -> dict:
+        return {'keys': len(self.name2info), 'cached_keys': len(self.name2key), 'version': self.version, **self.stats}
+
+    @classmethod
+    def test(cls, n:int = 300, path:str = None) -> dict:
+        import shutil
+        Keypair = c.module('key')
+        path = path or cls.resolve_path('test_keys')
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path)
+        def write(name, key):
+            with open(os.path.join(path, f'{name}.json'), 'w') as f:
+                json.dump({'data': key.to_json(), 'encrypted': False, 'timestamp': c.timestamp()}, f)
+        keys = {f'key.{i}': Keypair.gen() for i in range(n)}
+        for name, key in keys.items():
+            write(name, key)
+        with open(os.path.join(path, 'key2address.json'), 'w') as f:
+            json.dump({'data': {name: key.ss58_address for name, key in keys.items()}}, f)
+        try:
+            # decoding every key file, like key2address did before the index
+            t0 = c.time()
+            baseline = {}
+            for file in os.listdir(path):
+                with open(os.path.join(path, file)) as f:
+                    data = json.load(f)['data']
+                if isinstance(data, str):
+                    baseline[file[:-len('.json')]] = Keypair.from_json(data).ss58_address
+            baseline_ms = 1e3 * (c.time() - t0)
+            self = cls(path=path)
+            t0 = c.time()
+            key2address = self.key2address()
+            build_ms = 1e3 * (c.time() - t0)
+            assert key2address == {name: key.ss58_address for name, key in keys.items()}, 'the index does not match the keys'
+            assert 'key2address' not in self.names() # not a key
+            t0 = c.time()
+            for i in range(1000):
+                self.address2key()
+            lookup_us = 1e3 * (c.time() - t0)
+            name = 'key.0'
+            assert self.get_key(name).ss58_address == keys[name].ss58_address
+            assert self.get_key(keys[name].ss58_address) is self.get_key(name) # cached, by name or address
+            t0 = c.time()
+            for i in range(1000):
+                self.get_key(name)
+            get_key_us = 1e3 * (c.time() - t0)
+            # a key added, rewritten and removed by another process
+            new_key = Keypair.gen()
+            write('new', new_key)
+            assert self.key2address()['new'] == new_key.ss58_address
+            other_key = Keypair.gen()
+            write(name, other_key)
+            self.sync(force=True)
+            assert self.get_key(name).ss58_address == other_key.ss58_address
+            os.remove(os.path.join(path, 'new.json'))
+            assert not self.exists('new') and not self.exists(new_key.ss58_address)
+            reads = self.stats['reads']
+            self.sync(force=True)
+            assert self.stats['reads'] == reads # nothing changed, nothing is read
+            return {'success': True, 'msg': 'keystore test passed', 'n': n,
+                    'decode_all_ms': baseline_ms, 'index_build_ms': build_ms,
+                    'address2key_us': lookup_us, 'get_key_us': get_key_us}
+        finally:
+            shutil.rmtree(path, ignore_errors=True)
@@ -4,7 +4,6 @@ import concurrent
 from copy import deepcopy
 from typing import Optional, Union, Dict, List, Any, Tuple, Callable
 from munch import Munch
-from rich.console import Console
 import json
 from glob import glob
 import sys
@@ -32,7 +31,7 @@ class c:
     repo_path  = os.path.dirname(root_path) # the path to the repo
     library_name = libname = lib = root_dir = root_path.split('/')[-1] # the name of the library
     pwd = os.getenv('PWD') # the current working directory from the process starts 
-    console = Console() # the consolve
+    console = None # the console (rich is imported on the first print)
     helper_functions = ['info',
                         'schema',
                         'server_name',
@@ -238,6 +237,47 @@ class c:
 
 
 
+    @classmethod
+    def async_call_many(cls, 
+                        targets: list, 
+                        fn: str = 'info', 
+                        *args,
+                        kwargs: dict = None,
+                        network: str = None,
+                        key: str = None,
+                        concurrency: int = 64,
+                        timeout: int = 10,
+                        min_successes: int = None,
+                        **extra_kwargs):
+        """
+        returns an async generator of the responses as they complete (see Client.batch_forward)
+        targets: module names, addresses, (module, fn, args, kwargs) tuples or dicts with those keys
+        """
+        kwargs = {**(kwargs or {}), **extra_kwargs}
+        client = c.module('client')(key=key, save_history=False)
+        targets = [client.resolve_target(t, fn=fn, args=list(args), kwargs=kwargs) for t in targets]
+        names = [t['address'] for t in targets if not c.is_address(t['address'])]
+        if len(names) > 0:
+            namespace = c.namespace(network=network)
+            for t in targets:
+                if not c.is_address(t['address']):
+                    t['module'] = t['address']
+                    t['address'] = namespace.get(t['address'], None)
+        return client.batch_forward(targets, 
+                                    concurrency=concurrency, 
+                                    timeout=timeout, 
+                                    min_successes=min_successes)
+
+    @classmethod
+    def call_many(cls, targets: list, fn: str = 'info', *args, **kwargs) -> List[dict]:
+        """
+        calls many modules at once and returns the responses in the order they completed
+        c.call_many(['model.0', 'model.1'], 'forward', 'hey', min_successes=1)
+        """
+        async def collect():
+            return [r async for r in c.async_call_many(targets, fn, *args, **kwargs)]
+        return c.get_event_loop().run_until_complete(collect())
+
     def getattr(self, k:str)-> Any:
         return getattr(self,  k)
 
@@ -597,10 +637,8 @@ class c:
 
         Return the value
         '''
-        if cache:
-            if k in cls.cache:
-                return cls.cache[k]
-
+        # the json files are cached by the storage cache (only read again when they change),
+        # so cache is only kept for the callers that pass it
         data = getattr(cls, f'get_{mode}')(k,default=default, **kwargs)
             
 
@@ -624,10 +662,6 @@ class c:
                 if 'data' in data:
                     data = data['data']
 
-        # local cache
-        if cache:
-            cls.cache[k] = data
-
         return data
     
 
@@ -1344,13 +1378,26 @@ class c:
         return ports
     
     @classmethod
-    def used_ports(cls, ip='0.0.0.0') -> List[int]:
-        used_ports = []
-        for port in range(*cls.port_range()): 
-            if not cls.port_available(port=port, ip=ip):
-                used_ports += [port]
-                
-        return used_ports
+    def used_ports(cls, ip='0.0.0.0', ports:List[int] = None, concurrency:int = 256, timeout:float = 1) -> List[int]:
+        '''
+        the ports that accept a connection, probed concurrently
+        '''
+        ports = list(range(*cls.port_range())) if ports == None else ports
+        return c.gather(cls.async_used_ports(ports=ports, ip=ip, concurrency=concurrency, timeout=timeout), timeout=timeout * (len(ports) // concurrency + 2))
+
+    @classmethod
+    async def async_used_ports(cls, ports:List[int], ip:str = '0.0.0.0', concurrency:int = 256, timeout:float = 1) -> List[int]:
+        semaphore = asyncio.Semaphore(concurrency)
+        async def used(port):
+            async with semaphore:
+                try:
+                    _, writer = await asyncio.wait_for(asyncio.open_connection(ip, int(port)), timeout=timeout)
+                except Exception as e:
+                    return False
+                writer.close()
+                return True
+        results = await asyncio.gather(*[used(port) for port in ports])
+        return [port for port, result in zip(ports, results) if result]
     
     @classmethod
     def free_address(cls, **kwargs):
@@ -1675,10 +1722,20 @@ class c:
 
         if path.endswith('module/module.py'):
             return 'commune.Module'
+
+        if search == None:
+            # the module index already knows the classes of unchanged files
+            entry = c.module_index_entry(path)
+            if entry != None and entry['is_module']:
+                return entry['object_path']
         
         python_classes = cls.find_python_classes(path, search=search)
-        
-            
+        return cls.classes2objectpath(path, python_classes)
+
+    @classmethod
+    def classes2objectpath(cls, path:str, python_classes:List[str]) -> str:
+        if path.endswith('module/module.py'):
+            return 'commune.Module'
         if len(python_classes) == 0:
             return None
         object_name = python_classes[-1]
@@ -1711,6 +1768,7 @@ class c:
         if cache:
             if path in c.module_cache:
                 return c.module_cache[path]
+        name = path
         t1 = c.time()
         # convert the simple to path
         path = c.simple2path(path)
@@ -1730,7 +1788,8 @@ class c:
         module = c.import_object(path)
         t2 = c.time()
         c.print(f'Imported {path} in {t2-t1} seconds', color='green', verbose=verbose)
-        c.module_cache[path] = module
+        # cache under the requested name so c.module('key') only resolves once per process
+        c.module_cache[name] = c.module_cache[path] = module
         return module
 
     @classmethod
@@ -1749,36 +1808,229 @@ class c:
     @classmethod
     def tree(cls, search=None, 
                 update:bool = False,
-                path = 'local_module_tree'
+                verbose:bool = False,
                 ) -> List[str]:
-        module_tree = {}
 
-        if not hasattr(cls, 'tree_cache'):
-            cls.tree_cache = {}
+        if update or c.tree_cache == None:
+            module_index = c.module_index(update=update, verbose=verbose)
+            module_tree = {v['simple']: k for k,v in module_index.items() if v['is_module']}
+            # to use functions like c. we need to replace it with module lol
+            if cls.root_module_class in module_tree:
+                module_tree[cls.root_module_class] = module_tree.pop(cls.root_module_class)
+            c.tree_cache = module_tree
+        module_tree = c.tree_cache
 
-        if not update:
-            if cls.tree_cache != {}:
-                module_tree = cls.tree_cache
-            else:
-                module_tree =  c.get(path, {})
-                cls.tree_cache = module_tree
-        
-        if len(module_tree) == 0:
-            for tree_path in cls.trees():
-                # get modules from each tree
-                python_paths = c.get_module_python_paths(path=tree_path)
-                # add the modules to the module tree
-                module_tree.update({c.path2simple(f): f for f in python_paths})
-                # to use functions like c. we need to replace it with module lol
-                if cls.root_module_class in module_tree:
-                    module_tree[cls.root_module_class] = module_tree.pop(cls.root_module_class)
-                
-                c.put(path, module_tree)
-
-        # cache the module tree
         if search != None:
             module_tree = {k:v for k,v in module_tree.items() if search in k}
         return module_tree
+
+    tree_cache = None
+    module_index_cache = None
+    module_index_dirs = None # the mtimes of the directories of the trees when the index was built
+    module_index_path = 'module_index'
+    module_index_save_delay = 1.0 # seconds the single entry changes are collected before the index is written
+    module_index_save_timer = None
+    module_index_save_at_exit = False
+
+    @classmethod
+    def module_index(cls, update:bool = False, verbose:bool = False) -> Dict[str, dict]:
+        '''
+        The module index maps every python file in the trees to 
+        {simple, object_path, classes, is_module, mtime, size, inode}
+        It is persisted with the mtimes of the directories, so a cold process only stats the directories 
+        (added or removed files) and the indexed files (changed files) instead of reading them,
+        and it is updated incrementally by only re-reading files whose stat changed.
+        '''
+        if c.module_index_cache == None:
+            c.module_index_cache = c.load_module_index(validate=not update, verbose=verbose)
+        if update or len(c.module_index_cache) == 0:
+            c.module_index_cache = c.update_module_index(c.module_index_cache, verbose=verbose)
+        return c.module_index_cache
+
+    @classmethod
+    def load_module_index(cls, validate:bool = True, verbose:bool = False) -> Dict[str, dict]:
+        '''
+        Loads the persisted index and validates it against the mtimes, 
+        a changed directory (a file added or removed) updates the whole index, a changed file only its entry
+        '''
+        data = c.get(c.module_index_path, {}) or {}
+        module_index, dirs = data.get('files', {}), data.get('dirs', None)
+        if not validate:
+            c.module_index_dirs = dirs
+            return module_index
+        if dirs == None or any(cls.dir_mtime(d) != mtime for d, mtime in dirs.items()):
+            return c.update_module_index(module_index, verbose=verbose)
+        c.module_index_dirs = dirs
+        changed = 0
+        for path, entry in list(module_index.items()):
+            try:
+                file_stat = cls.file_stat(path)
+            except FileNotFoundError:
+                module_index.pop(path)
+                changed += 1
+                continue
+            if any(entry[k] != v for k,v in file_stat.items()):
+                module_index[path] = cls.index_python_path(path, file_stat=file_stat)
+                changed += 1
+        if changed > 0:
+            c.module_index_cache = module_index
+            c.save_module_index()
+        c.print(f'Loaded module index ({changed} changed files)', color='green', verbose=verbose)
+        return module_index
+
+    @staticmethod
+    def dir_mtime(path:str) -> Optional[float]:
+        try:
+            return os.stat(path).st_mtime
+        except FileNotFoundError:
+            return None
+
+    @classmethod
+    def walk_tree(cls, tree_path:str) -> Tuple[List[str], Dict[str, float]]:
+        '''
+        The python files of a tree (like glob **/*.py, without hidden files and directories) 
+        and the mtimes of its directories
+        '''
+        files, dirs = [], {}
+        for root, dir_names, file_names in os.walk(tree_path, followlinks=True):
+            dir_names[:] = sorted(d for d in dir_names if not d.startswith('.'))
+            dirs[root] = cls.dir_mtime(root)
+            files += [os.path.join(root, f) for f in sorted(file_names) if f.endswith('.py') and not f.startswith('.')]
+        return files, dirs
+
+    @classmethod
+    def update_module_index(cls, module_index:Dict[str, dict] = None, verbose:bool = False) -> Dict[str, dict]:
+        '''
+        Diff the files in the trees against the index by mtime/size/inode, 
+        only reading the files that were added or changed
+        '''
+        t1 = c.time()
+        module_index = module_index or {}
+        new_index = {}
+        dirs = {}
+        stats = {'added': 0, 'changed': 0, 'removed': 0, 'unchanged': 0}
+        for tree_path in cls.trees():
+            files, tree_dirs = cls.walk_tree(tree_path)
+            dirs.update(tree_dirs)
+            for f in files:
+                if f in new_index:
+                    continue
+                try:
+                    file_stat = cls.file_stat(f)
+                except FileNotFoundError:
+                    continue
+                entry = module_index.get(f, None)
+                if entry != None and all(entry[k] == v for k,v in file_stat.items()):
+                    stats['unchanged'] += 1
+                else:
+                    stats['added' if entry == None else 'changed'] += 1
+                    entry = cls.index_python_path(f, file_stat=file_stat)
+                new_index[f] = entry
+        stats['removed'] = len([f for f in module_index if f not in new_index])
+        changed = stats['unchanged'] != len(new_index) or stats['removed'] > 0 or dirs != c.module_index_dirs
+        c.module_index_dirs = dirs
+        if changed:
+            c.module_index_cache = new_index
+            c.save_module_index(delay=0)
+        c.print(f'Updated module index {stats} in {c.time() - t1:.3f} seconds', color='green', verbose=verbose)
+        return new_index
+
+    @classmethod
+    def save_module_index(cls, delay:float = None):
+        '''
+        Persists the index with the directory mtimes, after delay seconds (module_index_save_delay by default)
+        so the entries that change in the meantime are written at once (and at exit)
+        '''
+        import threading
+        delay = c.module_index_save_delay if delay == None else delay
+        if delay <= 0:
+            if c.module_index_save_timer != None:
+                c.module_index_save_timer.cancel()
+                c.module_index_save_timer = None
+            if c.module_index_cache != None and c.module_index_dirs != None:
+                c.put(c.module_index_path, {'files': dict(c.module_index_cache), 'dirs': c.module_index_dirs})
+            return
+        if c.module_index_save_timer == None:
+            if not c.module_index_save_at_exit:
+                import atexit
+                atexit.register(lambda: c.module_index_save_timer != None and c.save_module_index(delay=0))
+                c.module_index_save_at_exit = True
+            c.module_index_save_timer = threading.Timer(delay, c.save_module_index, kwargs={'delay': 0})
+            c.module_index_save_timer.daemon = True
+            c.module_index_save_timer.start()
+
+    @classmethod
+    def file_stat(cls, path:str) -> Dict[str, Union[int, float]]:
+        stat = os.stat(path)
+        return {'mtime': stat.st_mtime, 'size': stat.st_size, 'inode': stat.st_ino}
+
+    @classmethod
+    def index_python_path(cls, path:str, file_stat:dict = None, end_line:int = 200) -> dict:
+        '''
+        Builds the module index entry of a python file
+        '''
+        entry = file_stat or cls.file_stat(path)
+        entry.update({'is_module': False, 'simple': None, 'object_path': None, 'classes': []})
+        try:
+            initial_text = c.readlines(path, end_line=end_line, resolve=False)
+        except Exception as e:
+            return entry
+        commune_in_file = 'import commune as c' in initial_text 
+        is_commune_root = 'class c:' in initial_text
+        if commune_in_file or is_commune_root:
+            classes = cls.find_python_classes(path)
+            entry.update({'is_module': True,
+                          'simple': cls.path2simple(path),
+                          'classes': classes,
+                          'object_path': cls.classes2objectpath(path, classes)})
+        return entry
+
+    @classmethod
+    def module_index_entry(cls, path:str) -> Optional[dict]:
+        '''
+        Returns the index entry of the path if it is still fresh, refreshing it otherwise
+        (the index is written with the other changes of the next module_index_save_delay seconds)
+        '''
+        module_index = c.module_index()
+        try:
+            file_stat = cls.file_stat(path)
+        except FileNotFoundError:
+            return None
+        entry = module_index.get(path, None)
+        if entry == None or any(entry[k] != v for k,v in file_stat.items()):
+            entry = cls.index_python_path(path, file_stat=file_stat)
+            module_index[path] = entry
+            c.save_module_index()
+        return entry
+
+    @classmethod
+    def benchmark_module_index(cls, search:str = None, update:bool = True) -> Dict[str, float]:
+        '''
+        Compares resolving every module in the tree (simple -> object path) 
+        from a cold index (every file is read), a warm index loaded from disk
+        (nothing is read) and the in memory index.
+        '''
+        def resolve_tree():
+            t1 = c.time()
+            tree = c.tree(search=search)
+            for path in tree.values():
+                c.path2objectpath(path, search=None)
+            return c.time() - t1, len(tree)
+
+        results = {}
+        if update:
+            c.rm(c.module_index_path)
+        c.tree_cache = c.module_index_cache = None
+        results['cold_seconds'], results['modules'] = resolve_tree()
+        c.tree_cache = c.module_index_cache = None
+        results['warm_seconds'], _ = resolve_tree()
+        results['memory_seconds'], _ = resolve_tree()
+        t1 = c.time()
+        c.update_module_index(c.module_index())
+        results['incremental_update_seconds'] = c.time() - t1
+        results['cold_ms_per_module'] = results['cold_seconds'] * 1000 / max(results['modules'], 1)
+        results['warm_ms_per_module'] = results['warm_seconds'] * 1000 / max(results['modules'], 1)
+        return results
     
     tree_folders_path = 'module_tree_folders'
 
@@ -1855,6 +2107,9 @@ class c:
     @classmethod
     def simple2path(cls, path:str, **kwargs) -> str:
         tree = c.tree(**kwargs)
+        if path not in tree:
+            # modules added since the index was built are picked up by an incremental update
+            tree = c.tree(update=True)
         if path not in tree:
             shortcuts = c.shortcuts()
             if path in shortcuts:
@@ -1905,29 +2160,16 @@ class c:
     def get_module_python_paths(cls, 
                                 path : str= None, 
                                 search:str=None,
-                                end_line=200, 
+                                update:bool = False,
                                 ) -> List[str]:
         '''
         Search for all of the modules with yaml files. Format of the file
         '''
-        search_glob = c.libpath+'/**/*.py' 
-        path = path if path else c.root_path
-        modules = []
-
-        # find all of the python files
-        for f in glob(search_glob, recursive=True):
-
-            initial_text = c.readlines(f, end_line=end_line)
-
-            commune_in_file = 'import commune as c' in initial_text 
-            is_commune_root = 'class c:' in initial_text
-            if not commune_in_file and not is_commune_root:
-                continue
-            if os.path.isdir(f):
-                continue
-
-            modules.append(f)
-        # we ar caching t
+        path = path if path else c.libpath
+        module_index = c.module_index(update=update)
+        modules = [f for f, v in module_index.items() if v['is_module'] and f.startswith(path)]
+        if search != None:
+            modules = [f for f in modules if search in f]
         return modules
 
 
@@ -2046,6 +2288,31 @@ class c:
             return result
         return response
 
+    @classmethod
+    def benchmark_import_time(cls, n:int = 5, cmd:str = 'import commune', python:str = None) -> Dict[str, float]:
+        '''
+        Times n fresh interpreters running cmd (ex: 'import commune as c; c.modules()'),
+        with the bare interpreter startup reported as the baseline
+        '''
+        import subprocess
+        python = python or sys.executable
+        def run(cmd):
+            latencies = []
+            for _ in range(n):
+                t1 = c.time()
+                subprocess.run([python, '-c', cmd], check=True, capture_output=True, cwd=c.libpath)
+                latencies.append(c.time() - t1)
+            return latencies
+        baseline = min(run('pass'))
+        latencies = run(cmd)
+        return {'cmd': cmd, 
+                'n': n,
+                'mean': sum(latencies) / n,
+                'min': min(latencies), 
+                'max': max(latencies),
+                'baseline': baseline, 
+                'overhead': min(latencies) - baseline}
+
     @staticmethod
     def remotewrap(fn, remote_key:str = 'remote'):
         '''
@@ -2136,23 +2403,35 @@ class c:
         return os.path.expanduser('~')
 
     @classmethod
-    def get_json(cls, *args, **kwargs):
-        loop = c.get_event_loop()
-        return loop.run_until_complete(cls.async_get_json(*args, **kwargs))
+    def storage_cache(cls, **kwargs) -> 'StorageCache':
+        """
+        the cache of the json files of this process (kwargs reconfigure it, see storage.cache)
+        with policy='write_behind' the files are written on the next flush (at the latest at exit),
+        exists, ls, glob and the key store flush first, other readers of the files themselves can miss the pending writes
+        """
+        # imported directly, resolving it with c.module would put the module index through this cache
+        from commune.storage.cache.cache import StorageCache
+        return StorageCache.instance(refresh=len(kwargs) > 0, **kwargs)
+
+    @classmethod
+    async def async_get_json(cls, *args, **kwargs):
+        return cls.get_json(*args, **kwargs)
+
     @classmethod
-    async def async_get_json(cls,
-                             path:str,
-                             default:Any=None,
-                             root: bool = False,
-                             verbose: bool = False,
-                             **kwargs):
-        from commune.utils.dict import async_get_json
+    def get_json(cls,
+                path:str,
+                default:Any=None,
+                root: bool = False,
+                verbose: bool = False,
+                **kwargs):
+        from commune.storage.cache.cache import StorageCache
         path = cls.resolve_path(path=path, extension='json', root=root)
 
         c.print(f'Loading json from {path}', color='green', verbose=verbose)
 
         try:
-            data = await async_get_json(path, default=default, **kwargs)
+            # the file is only read again if it changed
+            data = StorageCache.instance().read_json(path, default=default)
         except Exception as e:
             if verbose:
                 c.print(f'Failed to load json from {path} with error {e}')
@@ -2188,12 +2467,11 @@ class c:
         torch.nn.Module.__init__(self)
     
     @classmethod
-    def put_json(cls,*args,**kwargs) -> str:
-        loop = c.get_event_loop()
-        return loop.run_until_complete(cls.async_put_json(*args, **kwargs))
+    async def async_put_json(cls, *args, **kwargs) -> str:
+        return cls.put_json(*args, **kwargs)
     
     @classmethod
-    async def async_put_json(cls, 
+    def put_json(cls, 
                  path:str, 
                  data:Dict, 
                  meta = None,
@@ -2202,22 +2480,24 @@ class c:
 
                  **kwargs) -> str:
         
-        from commune.utils.dict import async_put_json
+        from commune.storage.cache.cache import StorageCache
         if meta != None:
             data = {'data':data, 'meta':meta}
         path = cls.resolve_path(path=path, extension='json', root=root)
-        # cls.lock_file(path)
         c.print(f'Putting json from {path}', color='green', verbose=verbose)
 
-        await async_put_json(path=path, data=data, **kwargs)
-        # cls.unlock_file(path)
+        # written through to the file (or behind it, see storage_cache)
+        StorageCache.instance().write_json(path, data)
         return path
     
     save_json = put_json
     
     @classmethod
     def file_exists(cls, path:str, root:bool = False)-> bool:
+        from commune.storage.cache.cache import StorageCache
         path = cls.resolve_path(path=path, root=root)
+        # the pending write behinds of the storage cache are flushed first
+        StorageCache.flush_path(path if path.endswith('.json') else path + '.json')
         exists =  os.path.exists(path)
         if not exists and not path.endswith('.json'):
             exists = os.path.exists(path + '.json')
@@ -2284,6 +2564,8 @@ class c:
         
         assert isinstance(path, str), f'path must be a string, got {type(path)}'
         path = cls.resolve_path(path=path, extension=extension, root=root)
+        from commune.storage.cache.cache import StorageCache
+        StorageCache.instance().invalidate(path)
 
         # incase we want to remove the json file
         mode_suffix = f'.{mode}'
@@ -2317,7 +2599,9 @@ class c:
     @classmethod
     def glob(cls,  path =None, files_only:bool = True, root:bool = False, recursive:bool=True):
         
+        from commune.storage.cache.cache import StorageCache
         path = cls.resolve_path(path, extension=None, root=root)
+        StorageCache.flush_path(path)
         
         if os.path.isdir(path):
             path = os.path.join(path, '**')
@@ -2352,7 +2636,9 @@ class c:
         this path is relative to the module path if you dont specifcy ./ or ~/ or /
         which means its based on the module path
         """
+        from commune.storage.cache.cache import StorageCache
         path = cls.resolve_path(path, extension=None, root=root)
+        StorageCache.flush_path(path)
         try:
             ls_files = cls.lsdir(path) if not recursive else cls.walk(path)
         except FileNotFoundError:
@@ -2607,9 +2893,13 @@ class c:
 
     @classmethod
     def dead_servers(cls, network=None):
-        module2connection = cls.module2connection(network=network)
-        dead_servers = [m for m, c in module2connection.items() if not c]
-        return dead_servers
+        # the health checker of the namespace keeps the liveness of every server in memory
+        return c.module('namespace.health').dead_servers(network=network or 'local')
+
+    @classmethod
+    def start_health_checker(cls, network=None, **kwargs):
+        # the dead servers and the healthy namespace are empty until a checker runs (here or in another process)
+        return c.module('namespace.health').checker(network=network or 'local', **kwargs)
 
 
         
@@ -2708,6 +2998,10 @@ class c:
             loop = asyncio.get_event_loop()
         except Exception as e:
             loop = c.new_event_loop(nest_asyncio=nest_asyncio)
+        if nest_asyncio and not getattr(loop, '_nest_patched', False):
+            # sync helpers (get_json, gather) call run_until_complete from inside running loops
+            import nest_asyncio
+            nest_asyncio.apply(loop)
         return loop
 
 
@@ -4498,7 +4792,8 @@ class c:
 
     @classmethod
     def resolve_console(cls, console = None, **kwargs):
-        if not hasattr(cls,'console'):
+        # kwargs are the options of the Console that is created on the first call
+        if cls.console is None:
             from rich.console import Console
             cls.console = Console(**kwargs)
         if console is not None:
@@ -4527,7 +4822,7 @@ class c:
     def print(cls, *text:str, 
               color:str=None, 
               verbose:bool = True,
-              console: Console = None,
+              console: 'Console' = None,
               flush:bool = False,
               **kwargs):
               
@@ -4536,7 +4831,8 @@ class c:
                 color = cls.random_color()
             if color:
                 kwargs['style'] = color
-            console = cls.resolve_console(console, **kwargs)
+            # kwargs are options of console.print (not of the console)
+            console = cls.resolve_console(console)
 
 
             try:
@@ -5308,6 +5604,7 @@ class c:
         if params != None:
             kwargs = {**kwargs, **params}
         
+        fn_path = fn
         fn = c.get_fn(fn)
         executor = c.executor(max_workers=max_workers, mode=mode) if executor == None else executor
         
@@ -5329,6 +5626,9 @@ class c:
         if method_type == 'self':
             module = module(*init_args, **init_kwargs)
 
+        if mode == 'process' and isinstance(fn_path, str):
+            # the workers resolve module/fn themselves and keep the module instance
+            fn = fn_path
         future = executor.submit(fn=fn, args=args, kwargs=kwargs, timeout=timeout)
 
         if not hasattr(cls, 'futures'):
@@ -0,0 +1,227 @@
+import commune as c
+import os
+import asyncio
+import threading
+from typing import *
+
+
+class HealthChecker(c.Module):
+    """
+    Background health checker of the servers of a namespace
+
+    every interval seconds all the servers are probed at once (server_name, at most concurrency in flight)
+    and every server keeps its liveness, failures and a latency EWMA (with its mean deviation),
+    the timeout of a server adapts to its latency (latency + 4 * deviation, within [min_timeout, timeout])
+    so a dead server costs its own timeout and not the slowest one of a chunk.
+    a server that fails max_failures checks in a row is deregistered, one row at a time.
+    the health is kept in memory and snapshotted to health/{network}.json for the other processes,
+    a checker only runs once it is started (checker(network) or c.start_health_checker), reading the health never starts one
+    """
+    network2checker = {} # the checker of each network that runs in this process
+    path2snapshot = {} # path -> (mtime, snapshot) of the snapshots of checkers in other processes
+    lock = threading.Lock()
+
+    def __init__(self,
+                 network:str = 'local',
+                 interval:float = 10, # seconds between checks
+                 concurrency:int = 64, # probes in flight
+                 timeout:float = 5, # the timeout of a server without a latency
+                 min_timeout:float = 0.5,
+                 alpha:float = 0.3, # the weight of a new latency in the EWMA
+                 max_failures:int = 3, # failed checks in a row before a server is deregistered
+                 evict:bool = True,
+                 background:bool = True):
+        self.network = network
+        self.interval = interval
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.min_timeout = min_timeout
+        self.alpha = alpha
+        self.max_failures = max_failures
+        self.evict = evict
+        self.name2health = {}
+        self.check_time = 0
+        self.stats = {'checks': 0, 'probes': 0, 'evicted': 0, 'check_seconds': 0}
+        self.stopped = False
+        self.loop = asyncio.new_event_loop()
+        self.client = c.module('client')(save_history=False, loop=self.loop)
+        if background:
+            c.thread(self.check_loop)
+
+    @classmethod
+    def checker(cls, network:str = 'local', **kwargs) -> 'HealthChecker':
+        """
+        the checker of the network in this process (started on the first call)
+        """
+        with cls.lock:
+            if network not in cls.network2checker:
+                cls.network2checker[network] = cls(network=network, **kwargs)
+        return cls.network2checker[network]
+
+    @property
+    def snapshot_path(self) -> str:
+        return self.resolve_path(f'health/{self.network}.json')
+
+    def check_loop(self):
+        while not self.stopped:
+            try:
+                self.check()
+            except Exception as e:
+                c.print(f'Failed to check the health of {self.network}: {e}', color='red')
+            c.sleep(self.interval)
+
+    def check(self) -> dict:
+        """
+        probes every server of the namespace once
+        """
+        return self.loop.run_until_complete(self.async_check())
+
+    def server_timeout(self, health:dict = None) -> float:
+        if health == None or health['latency'] == None:
+            return self.timeout
+        return min(self.timeout, max(self.min_timeout, health['latency'] + 4 * health['deviation']))
+
+    async def async_check(self) -> dict:
+        t0 = c.time()
+        namespace = c.module('namespace').get_namespace(network=self.network)
+        targets = []
+        for name, address in namespace.items():
+            health = self.name2health.get(name, None)
+            if health != None and health['address'] != address:
+                health = None # a new server on the name
+            targets.append({'address': address, 'fn': 'server_name', 'name': name, 'timeout': self.server_timeout(health)})
+        async for response in self.client.batch_forward(targets, concurrency=self.concurrency, timeout=self.timeout):
+            target = targets[response['index']]
+            self.observe(target['name'], target['address'], response)
+        # forget the servers that left the namespace
+        for name in [name for name in self.name2health if name not in namespace]:
+            del self.name2health[name]
+        self.check_time = c.time()
+        self.stats['checks'] += 1
+        self.stats['probes'] += len(targets)
+        self.stats['check_seconds'] = self.check_time - t0
+        self.put(self.snapshot_path, {'time': self.check_time, 'interval': self.interval, 'servers': self.name2health})
+        return {'success': True, 'servers': len(targets), 'dead': len(self.dead()), 'seconds': self.stats['check_seconds']}
+
+    def observe(self, name:str, address:str, response:dict) -> dict:
+        """
+        updates the health of the server from a probe, a server that answered (even with an error) is alive
+        """
+        health = self.name2health.get(name, None)
+        if health == None or health['address'] != address:
+            health = self.name2health[name] = {'address': address, 'alive': None, 'failures': 0, 'latency': None, 'deviation': 0, 'last_seen': None}
+        if response['code'] in ['ok', 'remote_error']:
+            latency = response['latency']
+            if health['latency'] == None:
+                health['latency'], health['deviation'] = latency, latency / 2
+            else:
+                health['deviation'] = (1 - self.alpha) * health['deviation'] + self.alpha * abs(latency - health['latency'])
+                health['latency'] = (1 - self.alpha) * health['latency'] + self.alpha * latency
+            health.update(alive=True, failures=0, last_seen=c.time())
+        else:
+            health.update(alive=False, failures=health['failures'] + 1)
+            if self.evict and health['failures'] >= self.max_failures:
+                self.deregister(name, address)
+        return health
+
+    def deregister(self, name:str, address:str):
+        # only if the name still has the address that failed (it could have been served again)
+        if c.module('namespace').get_namespace(network=self.network).get(name, None) == address:
+            c.module('namespace').deregister_server(name, network=self.network)
+            self.stats['evicted'] += 1
+        self.name2health.pop(name, None)
+
+    def dead(self) -> List[str]:
+        return [name for name, health in self.name2health.items() if health['alive'] == False]
+
+    def stop(self):
+        self.stopped = True
+        self.network2checker.pop(self.network, None)
+
+    @classmethod
+    def health(cls, network:str = 'local') -> Dict[str, dict]:
+        """
+        the health of the servers {name: {address, alive, failures, latency, deviation, last_seen}},
+        from the checker of this process or the snapshot of a checker in another process,
+        empty if there is neither (or the snapshot is stale)
+        """
+        checker = cls.network2checker.get(network, None)
+        if checker != None:
+            return checker.name2health
+        path = cls.resolve_path(f'health/{network}.json')
+        mtime = os.path.getmtime(path) if os.path.exists(path) else None
+        cached = cls.path2snapshot.get(path, None)
+        if mtime != None and (cached == None or cached[0] != mtime):
+            cached = cls.path2snapshot[path] = (mtime, cls.get(path, {}))
+        snapshot = cached[1] if cached != None else {}
+        if c.time() - snapshot.get('time', 0) < 3 * snapshot.get('interval', 0):
+            return snapshot['servers']
+        return {}
+
+    @classmethod
+    def healthy(cls, namespace:dict, network:str = 'local') -> dict:
+        """
+        the servers of the namespace that are not known to be dead (a server that was not checked yet counts as healthy)
+        """
+        health = cls.health(network=network)
+        return {name: address for name, address in namespace.items()
+                if name not in health or health[name]['address'] != address or health[name]['alive'] != False}
+
+    @classmethod
+    def dead_servers(cls, network:str = 'local') -> List[str]:
+        return [name for name, health in cls.health(network=network).items() if health['alive'] == False]
+
+    @classmethod
+    def scan(cls, addresses:List[str], concurrency:int = 64, timeout:float = 5) -> Dict[str, str]:
+        """
+        the names of the servers on the addresses {name: address}, probed at once
+        """
+        client = c.module('client')(save_history=False)
+        async def scan():
+            namespace = {}
+            async for response in client.batch_forward(addresses, fn='server_name', concurrency=concurrency, timeout=timeout):
+                if response['success'] and isinstance(response['result'], str):
+                    namespace[response['result']] = addresses[response['index']]
+            return namespace
+        return c.gather(scan(), timeout=timeout * (len(addresses) // concurrency + 2))
+
+    @classmethod
+    def test(cls, network:str = 'test_health', n:int = 3):
+        namespace = c.module('namespace')
+        namespace.rm_namespace(network)
+        cls.rm(f'health/{network}.json')
+        ports = c.free_ports(n + 1)
+        processes = [c.module('server').echo_process(port=port) for port in ports[:n]]
+        try:
+            addresses = [f'0.0.0.0:{port}' for port in ports[:n]]
+            dead_address = f'0.0.0.0:{ports[n]}'
+            scanned = cls.scan(addresses + [dead_address])
+            assert dead_address not in scanned.values() and len(scanned) > 0, scanned
+            for i, address in enumerate(addresses):
+                namespace.register_server(f'echo{i}', address, network=network)
+            namespace.register_server('dead', dead_address, network=network)
+            # reading the health without a checker or a snapshot has no side effects
+            assert cls.dead_servers(network=network) == [] and len(namespace.get_namespace(network=network, healthy=True)) == n + 1
+            assert network not in cls.network2checker and not os.path.exists(cls.resolve_path(f'health/{network}.json'))
+            self = cls(network=network, background=False, max_failures=3, timeout=2)
+            results = [self.check() for i in range(2)]
+            health = self.name2health
+            alive = sorted(name for name in health if health[name]['alive'])
+            assert alive == [f'echo{i}' for i in range(n)], health
+            assert self.server_timeout(health['echo0']) < self.timeout # adapted to the latency
+            assert self.dead() == ['dead'] and health['dead']['failures'] == 2
+            # the other processes read the snapshot
+            assert cls.dead_servers(network=network) == ['dead']
+            assert sorted(namespace.get_namespace(network=network, healthy=True)) == alive
+            t0 = c.time()
+            cls.dead_servers(network=network)
+            lookup_us = 1e6 * (c.time() - t0)
+            # the dead server failed max_failures checks in a row and is deregistered
+            self.check()
+            assert 'dead' not in namespace.get_namespace(network=network) and self.stats['evicted'] == 1
+            return {'success': True, 'msg': 'health checker test passed', 'check_seconds': results[-1]['seconds'], 'dead_servers_us': lookup_us}
+        finally:
+            for process in processes:
+                process.kill()
+            namespace.rm_namespace(network)
+            cls.rm(f'health/{network}.json')
@@ -21,26 +21,33 @@ class Namespace(c.Module):
 
     # the default
     network : str = 'local'
+    store_path : str = 'store/namespace.db'
+
+    @classmethod
+    def store(cls) -> 'NamespaceStore':
+        """
+        the sqlite store of the namespaces, the json namespace of a network is imported the first time it is used
+        """
+        return c.module('namespace.store').store(cls.resolve_path(cls.store_path))
+
+    @classmethod
+    def resolve_store(cls, network:str) -> 'NamespaceStore':
+        store = cls.store()
+        if store.version(network) == 0 and cls.exists(network):
+            # checked again in the transaction of the import, another server could be importing it
+            store.import_if_absent(network, cls.get(network, {}) or {})
+        return store
 
     @classmethod
     def register_server(cls, name:str, address:str, network=network) -> None:
-        namespace = cls.get_namespace(network=network)
-        namespace[name] = address
-        cls.put_namespace(network, namespace)
+        # a single row upsert, servers that register at the same time do not overwrite each other
+        cls.resolve_store(network).register(network, name, address)
         return {'success': True, 'msg': f'Block {name} registered to {network}.'}
     
     
     @classmethod
     def deregister_server(cls, name:str, network=network) -> Dict:
-
-        namespace = cls.get_namespace(network=network)
-        address2name = {v: k for k, v in namespace.items()}
-        if name in address2name:
-            name = address2name[name]
-        
-        if name in namespace:
-            del namespace[name]
-            cls.put_namespace(network, namespace)
+        if cls.resolve_store(network).deregister(network, name):
             return {'status': 'success', 'msg': f'Block {name} deregistered.'}
         else:
             return {'success': False, 'msg': f'Block {name} not found.'}
@@ -70,7 +77,7 @@ class Namespace(c.Module):
         return address
 
     @classmethod
-    def get_namespace(cls, search=None, network:str = 'local', update:bool = False, public:bool = False, subnet=None, **kwargs) -> dict:
+    def get_namespace(cls, search=None, network:str = 'local', update:bool = False, public:bool = False, subnet=None, healthy:bool = False, **kwargs) -> dict:
         if network == None: 
             network = cls.network
 
@@ -85,7 +92,10 @@ class Namespace(c.Module):
         else:
             if update:
                 cls.update_namespace(network=network, full_scan=bool(network=='local'))
-            namespace = cls.get(network, {})
+            namespace = dict(cls.resolve_store(network).namespace(network))
+            if healthy:
+                # without the servers the health checker found dead
+                namespace = c.module('namespace.health').healthy(namespace, network=network)
         if search != None:
             namespace = {k:v for k,v in namespace.items() if search in k}
 
@@ -102,18 +112,17 @@ class Namespace(c.Module):
     def put_namespace(cls, network:str, namespace:dict = None) -> None:
         if namespace == None:
             namespace = cls.get_namespace(network=network)
-        address2name = {v: k for k, v in namespace.items()}
-        namespace = {v:k for k,v in address2name.items()}
         assert isinstance(namespace, dict), 'Namespace must be a dict.'
-        cls.put(network, namespace)
-        return {'success': False, 'msg': f'Namespace {network} updated.'}
+        cls.store().put(network, namespace)
+        return {'success': True, 'msg': f'Namespace {network} updated.'}
     
     add_namespace = put_namespace
     
 
     @classmethod
     def rm_namespace(cls,network:str) -> None:
-        if cls.exists(network):
+        if cls.namespace_exists(network):
+            cls.store().rm(network)
             cls.rm(network)
             return {'success': True, 'msg': f'Namespace {network} removed.'}
         else:
@@ -136,11 +145,12 @@ class Namespace(c.Module):
     
     @classmethod
     def networks(cls) -> dict:
-        return [p.split('/')[-1].split('.')[0] for p in cls.ls()]
+        networks = [p.split('/')[-1].split('.')[0] for p in cls.ls() if p.endswith('.json')]
+        return sorted(set(networks + cls.store().networks()))
     
     @classmethod
     def namespace_exists(cls, network:str) -> bool:
-        return cls.exists(network)
+        return cls.store().exists(network) or cls.exists(network)
 
 
     @classmethod
@@ -159,7 +169,7 @@ class Namespace(c.Module):
 
     @classmethod
     def update_namespace(cls,
-                        chunk_size:int=50, 
+                        chunk_size:int=64, 
                         timeout:int = 10,
                         full_scan:bool = True,
                         network:str = network)-> dict:
@@ -167,33 +177,27 @@ class Namespace(c.Module):
         The module port is where modules can connect with each othe.
         When a module is served "module.serve())"
         it will register itself with the namespace_local dictionary.
+        every address is probed at once (at most chunk_size in flight), so a dead address only costs its own timeout,
+        the scan is applied as a diff (found servers registered, dead addresses deregistered),
+        so the servers that register during the scan are kept
         '''
-
+        t0 = c.time()
         namespace = cls.get_namespace(network=network, update=False) # get local namespace from redis
 
-        addresses = c.copy(list(namespace.values()))
-        namespace = {}
+        registered = c.copy(list(namespace.values()))
+        addresses = registered
 
         if network == 'local':
             if full_scan == True or len(addresses) == 0 and network == 'local':
                 addresses = [c.default_ip+':'+str(p) for p in c.used_ports()]
-        import asyncio
-
-        for i in range(0, len(addresses), chunk_size):
-            addresses_chunk = addresses[i:i+chunk_size]
-            futures = []
 
-            for address in addresses_chunk:
-
-                futures += [c.async_call(module=address, fn='server_name')]
-
-            names_chunk = c.gather(futures, timeout=timeout)
-            
-            for i in range(len(names_chunk)):
-                if isinstance(names_chunk[i], str):
-                    namespace[names_chunk[i]] = addresses_chunk[i]
-
-        cls.put_namespace(network, namespace)
+        namespace = c.module('namespace.health').scan(addresses, concurrency=chunk_size, timeout=timeout)
+        found = set(namespace.values())
+        found_ports = set(str(address).split(':')[-1] for address in found)
+        # the registered addresses that were not found are dead too (a crashed server leaves its port unused)
+        dead = [address for address in set(registered) | set(addresses)
+                if address not in found and not (network == 'local' and str(address).split(':')[-1] in found_ports)]
+        cls.resolve_store(network).apply(network, register=namespace, deregister=dead, before=t0)
             
         return namespace
     
@@ -241,8 +245,7 @@ class Namespace(c.Module):
         addresses = list(namespace.values())
         if address not in addresses:
             return {'success': False, 'msg': f'{address} not in {addresses}'}
-        namespace[name] = address
-        c.put_namespace(network, namespace)
+        cls.register_server(name, address, network=network)
 
         return {'success': True, 'msg': f'Added {address} to {network} modules', 'remote_modules': cls.servers(network=network), 'network': network}
     
@@ -385,6 +388,15 @@ class Namespace(c.Module):
         assert cls.get_namespace(network=network) == {'test': 'test'}, f'Namespace not restored. {cls.get_namespace(network=network)}'
         cls.deregister_server('test', network=network2)
         assert cls.get_namespace(network2) == {}
+        # a scan deregisters the dead addresses without replacing the namespace
+        cls.register_server('dead', c.default_ip + ':' + str(c.free_port()), network=network)
+        cls.update_namespace(network=network, full_scan=False, timeout=1)
+        assert cls.get_namespace(network=network) == {}, cls.get_namespace(network=network)
+        # a full scan of the local network drops a server whose port is no longer in use
+        ghost = 'ghost.test.' + str(c.random_int(10**6))
+        cls.register_server(ghost, c.default_ip + ':' + str(c.free_port()), network='local')
+        cls.update_namespace(network='local', full_scan=True, timeout=1)
+        assert ghost not in cls.get_namespace(network='local'), f'{ghost} was not removed by the full scan'
         cls.rm_namespace(network)
         assert cls.namespace_exists(network) == False
         cls.rm_namespace(network2)
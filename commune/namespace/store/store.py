@@ -0,0 +1,267 @@
+import commune as c
+import os
+import sqlite3
+import contextlib
+import threading
+from typing import *
+
+
+class NamespaceStore(c.Module):
+    """
+    SQLite (WAL) store of the namespaces, shared by every process of the host
+
+    every server is one row (network, name, address), registering and deregistering are single row
+    transactions so concurrent servers never lose each other's entries, and an address belongs to one name.
+    every write bumps the version of its network in the same transaction,
+    readers keep the namespace in memory and only read it again when the version changed,
+    wait()/watch() poll the version to notify changes across processes
+    """
+    path2store = {} # one store per path per process
+
+    def __init__(self, path:str = 'namespace.db', timeout:float = 30):
+        self.path = path if path.startswith('/') else self.resolve_path(path)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.timeout = timeout
+        self.local = threading.local()
+        self.cache = {} # network -> (version, namespace)
+        self.cache_lock = threading.Lock()
+        with self.transaction() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS servers (network TEXT, name TEXT, address TEXT, time REAL, PRIMARY KEY (network, name))')
+            conn.execute('CREATE INDEX IF NOT EXISTS servers_address ON servers (network, address)')
+            conn.execute('CREATE TABLE IF NOT EXISTS versions (network TEXT PRIMARY KEY, version INTEGER)')
+
+    @classmethod
+    def store(cls, path:str = 'namespace.db', **kwargs) -> 'NamespaceStore':
+        """
+        the shared store of a path
+        """
+        if path not in cls.path2store:
+            cls.path2store[path] = cls(path=path, **kwargs)
+        return cls.path2store[path]
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """
+        the connection of this thread (a forked process opens its own)
+        """
+        conn = getattr(self.local, 'conn', None)
+        if conn == None or self.local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.local.conn, self.local.pid = conn, os.getpid()
+        return conn
+
+    @contextlib.contextmanager
+    def transaction(self, write:bool = True):
+        """
+        a transaction that takes the write lock up front (IMMEDIATE), or a read snapshot
+        """
+        conn = self.conn
+        conn.execute('BEGIN IMMEDIATE' if write else 'BEGIN')
+        try:
+            yield conn
+        except Exception as e:
+            conn.execute('ROLLBACK')
+            raise e
+        conn.execute('COMMIT')
+
+    @staticmethod
+    def bump(conn, network:str):
+        conn.execute('INSERT INTO versions VALUES (?, 1) ON CONFLICT (network) DO UPDATE SET version = abs(version) + 1', (network,))
+
+    def register(self, network:str, name:str, address:str) -> dict:
+        """
+        sets the address of the name (the address is taken from any other name)
+        """
+        with self.transaction() as conn:
+            conn.execute('DELETE FROM servers WHERE network = ? AND address = ? AND name != ?', (network, address, name))
+            conn.execute('INSERT INTO servers VALUES (?, ?, ?, ?) ON CONFLICT (network, name) DO UPDATE SET address = excluded.address, time = excluded.time',
+                         (network, name, address, c.time()))
+            self.bump(conn, network)
+        return {'success': True, 'name': name, 'address': address}
+
+    def deregister(self, network:str, name:str) -> bool:
+        """
+        removes the server by its name or its address
+        """
+        with self.transaction() as conn:
+            removed = conn.execute('DELETE FROM servers WHERE network = ? AND (name = ? OR address = ?)', (network, name, name)).rowcount
+            if removed > 0:
+                self.bump(conn, network)
+        return removed > 0
+
+    def put(self, network:str, namespace:dict) -> dict:
+        """
+        replaces the namespace of the network (the last name of an address wins)
+        """
+        address2name = {v: k for k, v in namespace.items()}
+        with self.transaction() as conn:
+            conn.execute('DELETE FROM servers WHERE network = ?', (network,))
+            conn.executemany('INSERT INTO servers VALUES (?, ?, ?, ?)', [(network, k, v, c.time()) for v, k in address2name.items()])
+            self.bump(conn, network)
+        return {'success': True, 'n': len(address2name)}
+
+    def import_if_absent(self, network:str, namespace:dict) -> bool:
+        """
+        puts the namespace only if the network never existed, checked in the same transaction,
+        so servers that start at once import the json namespace once and never delete each other's rows
+        """
+        address2name = {v: k for k, v in namespace.items()}
+        with self.transaction() as conn:
+            if conn.execute('SELECT 1 FROM versions WHERE network = ?', (network,)).fetchone() != None:
+                return False
+            conn.executemany('INSERT OR REPLACE INTO servers VALUES (?, ?, ?, ?)', [(network, k, v, c.time()) for v, k in address2name.items()])
+            self.bump(conn, network)
+        return True
+
+    def apply(self, network:str, register:dict = None, deregister:List[str] = None, before:float = None) -> dict:
+        """
+        registers {name: address} and deregisters the addresses in one transaction (like a scan found them),
+        the rows written after before (a server that registered during the scan) are left as they are
+        """
+        register, deregister = register or {}, deregister or []
+        before = c.time() if before == None else before
+        with self.transaction() as conn:
+            removed = 0
+            for address in deregister:
+                removed += conn.execute('DELETE FROM servers WHERE network = ? AND address = ? AND time <= ?', (network, address, before)).rowcount
+            for name, address in register.items():
+                conn.execute('DELETE FROM servers WHERE network = ? AND address = ? AND name != ? AND time <= ?', (network, address, name, before))
+                conn.execute('INSERT INTO servers VALUES (?, ?, ?, ?) ON CONFLICT (network, name) DO UPDATE SET address = excluded.address, time = excluded.time WHERE servers.time <= ?',
+                             (network, name, address, c.time(), before))
+            self.bump(conn, network)
+        return {'success': True, 'registered': len(register), 'deregistered': removed}
+
+    def rm(self, network:str) -> bool:
+        with self.transaction() as conn:
+            # the version stays monotonic (negative while removed), so no reader keeps a removed namespace
+            existed = conn.execute('UPDATE versions SET version = -(version + 1) WHERE network = ? AND version > 0', (network,)).rowcount > 0
+            conn.execute('DELETE FROM servers WHERE network = ?', (network,))
+        return existed
+
+    def version(self, network:str) -> int:
+        """
+        the version of the namespace (0 if it never existed, negative if it was removed)
+        """
+        row = self.conn.execute('SELECT version FROM versions WHERE network = ?', (network,)).fetchone()
+        return row[0] if row != None else 0
+
+    def exists(self, network:str) -> bool:
+        return self.version(network) > 0
+
+    def networks(self) -> List[str]:
+        return [row[0] for row in self.conn.execute('SELECT network FROM versions WHERE version > 0 ORDER BY network')]
+
+    def namespace(self, network:str) -> dict:
+        """
+        the namespace of the network {name: address}, read again only if it changed (do not mutate it)
+        """
+        version = self.version(network)
+        cached = self.cache.get(network, None)
+        if cached != None and cached[0] == version:
+            return cached[1]
+        with self.transaction(write=False) as conn:
+            version = self.version(network)
+            namespace = dict(conn.execute('SELECT name, address FROM servers WHERE network = ? ORDER BY name', (network,)).fetchall())
+        with self.cache_lock:
+            self.cache[network] = (version, namespace)
+        return namespace
+
+    def wait(self, network:str, version:int = None, timeout:float = 10, interval:float = 0.05) -> int:
+        """
+        waits until the version of the network is not version (the current one if None), returns the new version
+        """
+        version = self.version(network) if version == None else version
+        t0 = c.time()
+        while c.time() - t0 < timeout:
+            new_version = self.version(network)
+            if new_version != version:
+                return new_version
+            c.sleep(interval)
+        raise TimeoutError(f'The namespace {network} did not change within {timeout}s')
+
+    def watch(self, network:str, fn:Callable, interval:float = 0.5):
+        """
+        calls fn(namespace) in a background thread whenever the namespace of the network changes
+        """
+        def loop():
+            version = self.version(network)
+            while True:
+                try:
+                    version = self.wait(network, version=version, timeout=3600, interval=interval)
+                    fn(self.namespace(network))
+                except TimeoutError:
+                    continue
+                except Exception as e:
+                    c.print(f'Failed to notify a change of {network}: {e}', color='red')
+        return c.thread(loop)
+
+    @classmethod
+    def test(cls, n:int = 500, n_procs:int = 10, n_threads:int = 10, n_lookups:int = 10000, network:str = 'test_store'):
+        import multiprocessing
+        path = cls.resolve_path('test_namespace.db')
+        for suffix in ['', '-wal', '-shm']:
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+        cls.path2store.pop(path, None)
+        self = cls.store(path)
+        self.put(network, {})
+        version = self.version(network)
+        def register(start:int):
+            # n_procs processes (like servers started at once) with n_threads threads each
+            store = cls.store(path)
+            uids = list(range(start, n, n_procs))
+            threads = [threading.Thread(target=lambda uids=uids[i::n_threads]: [store.register(network, f'server{uid}', f'0.0.0.0:{uid}') for uid in uids])
+                       for i in range(n_threads)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        t0 = c.time()
+        procs = [multiprocessing.get_context('fork').Process(target=register, args=(i,)) for i in range(n_procs)]
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join()
+        register_seconds = c.time() - t0
+        namespace = self.namespace(network)
+        assert len(namespace) == n, f'lost {n - len(namespace)} entries'
+        assert self.version(network) == version + n
+        # an address belongs to one name
+        self.register(network, 'server0.new', '0.0.0.0:0')
+        assert 'server0' not in self.namespace(network) and self.namespace(network)['server0.new'] == '0.0.0.0:0'
+        assert self.deregister(network, '0.0.0.0:1') and 'server1' not in self.namespace(network)
+        # a change in another process is noticed
+        version = self.version(network)
+        p = multiprocessing.get_context('fork').Process(target=lambda: cls.store(path).register(network, 'late', '0.0.0.0:9999'))
+        p.start()
+        assert self.wait(network, version=version) > version
+        p.join()
+        assert self.namespace(network)['late'] == '0.0.0.0:9999'
+        # a scan is applied as a diff, a server that registered during the scan is kept
+        t0 = c.time()
+        self.register(network, 'during', '0.0.0.0:2')
+        self.apply(network, register={'found': '0.0.0.0:3'}, deregister=['0.0.0.0:2', '0.0.0.0:4'], before=t0)
+        namespace = self.namespace(network)
+        assert namespace['during'] == '0.0.0.0:2' and namespace['found'] == '0.0.0.0:3' and 'server4' not in namespace
+        assert 'server5' in namespace # not in the scan, left as it is
+        # the json namespace is imported once, the second import does not touch the registered rows
+        assert self.import_if_absent(network + '.import', {'a': '0.0.0.0:1'})
+        self.register(network + '.import', 'b', '0.0.0.0:2')
+        assert not self.import_if_absent(network + '.import', {'a': '0.0.0.0:1'})
+        assert self.namespace(network + '.import') == {'a': '0.0.0.0:1', 'b': '0.0.0.0:2'}
+        self.rm(network + '.import')
+        t0 = c.time()
+        for i in range(n_lookups):
+            self.namespace(network)
+        lookup_us = 1e6 * (c.time() - t0) / n_lookups
+        assert self.rm(network) and self.namespace(network) == {} and not self.exists(network)
+        self.put(network, {'again': '0.0.0.0:1'})
+        assert self.namespace(network) == {'again': '0.0.0.0:1'}
+        self.rm(network)
+        cls.path2store.pop(path, None)
+        for suffix in ['', '-wal', '-shm']:
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+        return {'success': True, 'msg': 'namespace store test passed', 'registered': n, 'register_seconds': register_seconds, 'lookup_us': lookup_us}
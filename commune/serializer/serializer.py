@@ -4,9 +4,11 @@
 # Do whatever you want with this code
 # Dont pull up with your homies if it dont work.
 import numpy as np
-import torch
 import msgpack
 import msgpack_numpy
+import struct
+import hashlib
+import warnings
 from typing import Tuple, List, Union, Optional
 from copy import deepcopy
 from munch import Munch
@@ -17,23 +19,25 @@ import json
 
 class Serializer(c.Module):
 
-
+    # binary frames: prefix | header length (uint32) | msgpack header | aligned raw buffers
+    binary_content_type = 'application/x-commune-binary'
+    binary_prefix = b'CMNB'
+    buffer_alignment = 64
+    # the signature of a binary frame travels in the headers, signing the frame hash
+    binary_headers = {'signature': 'x-commune-signature', 
+                      'address': 'x-commune-address', 
+                      'crypto_type': 'x-commune-crypto-type'}
     
     def serialize(self,x:dict, mode = 'str'):
-        x = c.copy(x)
+        if mode == 'binary':
+            return self.serialize_binary(x)
+        # build new containers instead of deep copying the payload (and its tensors)
         x_type = type(x)
-        if x_type in [dict, list, set, tuple]:
-            k_list = []
-            if isinstance(x, dict):
-                k_list = list(x.keys())
-            elif isinstance(x, list):
-                k_list = list(range(len(x)))
-            elif type(x) in [tuple, set]: 
-                # convert to list, to format as json
-                x = list(x) 
-                k_list = list(range(len(x)))
-            for k in k_list:
-                x[k] = self.resolve_value(v=x[k])
+        if x_type in [dict]:
+            x = {k: self.resolve_value(v=v) for k,v in x.items()}
+        elif x_type in [list, set, tuple]:
+            # convert to list, to format as json
+            x = [self.resolve_value(v=v) for v in x]
         else:
             x = self.resolve_value(v=x)
 
@@ -80,6 +84,8 @@ class Serializer(c.Module):
     def deserialize(self, x) -> object:
         """Serializes a torch object to DataBlock wire format.
         """
+        if self.is_binary(x):
+            return self.deserialize_binary(x)
         if isinstance(x, dict) and isinstance(x.get('data', None), str):
             x = x['data']
         if isinstance(x, str):
@@ -124,6 +130,7 @@ class Serializer(c.Module):
         return data
     
     def deserialize_pandas(self, data: bytes) -> 'pd.DataFrame':
+        import pandas as pd
         data = self.bytes2dict(data=data)
         data = pd.DataFrame.from_dict(data)
         return data
@@ -200,6 +207,7 @@ class Serializer(c.Module):
         return output
     
     def bytes2torch(self, data:bytes, ) -> 'torch.Tensor':
+        import torch
         numpy_object = self.bytes2numpy(data)
         
         int64_workaround = bool(numpy_object.dtype == np.int64)
@@ -215,7 +223,7 @@ class Serializer(c.Module):
         return output
 
     
-    def deserialize_torch(self, data: dict) -> torch.Tensor:
+    def deserialize_torch(self, data: dict) -> 'torch.Tensor':
         from safetensors.torch import load
         if isinstance(data, str):
             data = self.str2bytes(data)
@@ -224,7 +232,7 @@ class Serializer(c.Module):
 
 
 
-    def serialize_torch(self, data: torch.Tensor) -> 'DataBlock':     
+    def serialize_torch(self, data: 'torch.Tensor') -> 'DataBlock':     
         from safetensors.torch import save
         output = save({'data':data})  
         return self.bytes2str(output)
@@ -241,6 +249,123 @@ class Serializer(c.Module):
 
 
 
+    """
+    ################ BINARY LAND ############################
+    """
+
+    def is_binary(self, data) -> bool:
+        return isinstance(data, (bytes, bytearray, memoryview)) and bytes(data[:len(self.binary_prefix)]) == self.binary_prefix
+
+    def serialize_binary(self, x) -> bytes:
+        """
+        Serializes x into a binary frame, where tensors, arrays and bytes are 
+        written once as raw buffers next to a msgpack header instead of being 
+        hex encoded inside of json
+        """
+        buffers = []
+        header = {'meta': self.extract_buffers(x, buffers=buffers), 'buffers': []}
+        offset = 0
+        for buffer in buffers:
+            header['buffers'].append([offset, buffer.nbytes])
+            offset += self.aligned(buffer.nbytes)
+        header = msgpack.packb(header, use_bin_type=True)
+        start = len(self.binary_prefix) + 4 + len(header)
+        frame = [self.binary_prefix, struct.pack('<I', len(header)), header, bytes(self.aligned(start) - start)]
+        for buffer in buffers:
+            frame += [buffer, bytes(self.aligned(buffer.nbytes) - buffer.nbytes)]
+        return b''.join(frame)
+
+    def deserialize_binary(self, data:Union[bytes, bytearray, memoryview]) -> object:
+        """
+        Deserializes a binary frame, arrays and tensors are views over the frame (no copies),
+        so they are read only when the frame is immutable bytes
+        """
+        data = memoryview(data)
+        start = len(self.binary_prefix) + 4
+        header_size = struct.unpack('<I', data[len(self.binary_prefix):start])[0]
+        header = msgpack.unpackb(data[start:start + header_size], raw=False, strict_map_key=False)
+        base = self.aligned(start + header_size)
+        buffers = [(base + offset, size) for offset, size in header['buffers']]
+        return self.insert_buffers(header['meta'], data=data, buffers=buffers)
+
+    def binary_hash(self, data:Union[bytes, memoryview]) -> str:
+        return hashlib.sha256(data).hexdigest()
+
+    def sign_binary(self, data:bytes, key:'Key') -> dict:
+        '''
+        Signs the hash of a binary frame, returning the headers to send with it
+        '''
+        signature = key.sign(self.binary_hash(data), return_json=True)
+        headers = {header: str(signature[k]) for k, header in self.binary_headers.items()}
+        headers['Content-Type'] = self.binary_content_type
+        return headers
+
+    def binary_signature(self, data:bytes, headers:dict) -> dict:
+        '''
+        Rebuilds the signed json of a binary frame from its headers, for key.verify
+        '''
+        signature = {k: headers.get(header, None) for k, header in self.binary_headers.items()}
+        signature['data'] = self.binary_hash(data)
+        return signature
+
+    def aligned(self, size:int) -> int:
+        return -(-size // self.buffer_alignment) * self.buffer_alignment
+
+    def extract_buffers(self, x, buffers:list):
+        x_type = type(x)
+        if x_type in [dict]:
+            return {k: self.extract_buffers(v, buffers=buffers) for k,v in x.items()}
+        elif x_type in [list, tuple, set]:
+            return [self.extract_buffers(v, buffers=buffers) for v in x]
+        data_type = self.get_type_str(data=x)
+        if data_type == 'numpy' and not x.dtype.hasobject:
+            x = np.ascontiguousarray(x)
+            meta = {'dtype': x.dtype.str, 'shape': list(x.shape)}
+            buffer = memoryview(x.reshape(-1).view(np.uint8))
+        elif data_type == 'torch':
+            import torch
+            x = x.detach().cpu().contiguous()
+            meta = {'dtype': str(x.dtype).split('.')[-1], 'shape': list(x.shape)}
+            buffer = memoryview(x.reshape(-1).view(torch.uint8).numpy())
+        elif x_type in [bytes, bytearray]:
+            meta = {}
+            buffer = memoryview(x)
+        else:
+            return self.resolve_value(v=x)
+        buffers.append(buffer)
+        return {'binary_buffer': len(buffers) - 1, 'data_type': data_type, **meta}
+
+    def insert_buffers(self, x, data:memoryview, buffers:list):
+        x_type = type(x)
+        if x_type in [list]:
+            return [self.insert_buffers(v, data=data, buffers=buffers) for v in x]
+        elif x_type in [dict]:
+            if 'binary_buffer' in x and 'data_type' in x:
+                offset, size = buffers[x['binary_buffer']]
+                return self.buffer2value(x, data=data, offset=offset, size=size)
+            if self.is_serialized(x) and hasattr(self, f"deserialize_{x['data_type']}"):
+                return getattr(self, f"deserialize_{x['data_type']}")(data=x['data'])
+            return {k: self.insert_buffers(v, data=data, buffers=buffers) for k,v in x.items()}
+        return x
+
+    def buffer2value(self, meta:dict, data:memoryview, offset:int, size:int):
+        data_type = meta['data_type']
+        if data_type == 'numpy':
+            dtype = np.dtype(meta['dtype'])
+            return np.frombuffer(data, dtype=dtype, count=size // dtype.itemsize, offset=offset).reshape(meta['shape'])
+        elif data_type == 'torch':
+            import torch
+            dtype = getattr(torch, meta['dtype'])
+            if size == 0:
+                return torch.empty(meta['shape'], dtype=dtype)
+            with warnings.catch_warnings():
+                # torch warns about views over immutable bytes, which is what makes this zero copy
+                warnings.simplefilter('ignore')
+                tensor = torch.frombuffer(data, dtype=dtype, count=size // dtype.itemsize, offset=offset)
+            return tensor.reshape(meta['shape'])
+        else:
+            return bytes(data[offset:offset + size])
+
     def get_type_str(self, data):
         '''
         ## Documentation for get_type_str function
@@ -283,6 +408,7 @@ class Serializer(c.Module):
 
     @classmethod
     def test_serialize(cls):
+        import torch
         module = Serializer()
         data = {'bro': {'fam': torch.ones(2,2), 'bro': [torch.ones(1,1)]}}
         proto = module.serialize(data)
@@ -290,6 +416,7 @@ class Serializer(c.Module):
 
     @classmethod
     def test_deserialize(cls):
+        import torch
         module = Serializer()
         
         t = c.time()
@@ -299,54 +426,59 @@ class Serializer(c.Module):
         c.print(t - c.time())
         
         # return True
-    
+
     @classmethod
-    def test(cls, size=1):
+    def test_binary(cls):
+        import torch
         self = cls()
-        stats = {}
-        data = {'bro': {'fam': torch.randn(size,size), 'bro': [torch.ones(1000,500)] , 'bro2': [np.ones((100,1000))]}}
-
-        t = c.time()
-        serialized_data = self.serialize(data)
-        assert isinstance(serialized_data, str), f"serialized_data must be a str, not {type(serialized_data)}"
+        data = {'bro': {'fam': torch.randn(3,5), 'half': torch.ones(4, dtype=torch.bfloat16), 'empty': torch.ones(0,2)},
+                'numpy': [np.arange(10).reshape(2,5), np.ones(0)],
+                'bytes': b'hey', 
+                'tuple': (1, 'fam'), 
+                'x': 1}
+        serialized_data = self.serialize(data, mode='binary')
+        assert isinstance(serialized_data, bytes), f"serialized_data must be bytes, not {type(serialized_data)}"
         deserialized_data = self.deserialize(serialized_data)
+        assert torch.equal(deserialized_data['bro']['fam'], data['bro']['fam'])
+        assert torch.equal(deserialized_data['bro']['half'], data['bro']['half'])
+        assert deserialized_data['bro']['empty'].shape == data['bro']['empty'].shape
+        assert np.array_equal(deserialized_data['numpy'][0], data['numpy'][0])
+        assert deserialized_data['bytes'] == data['bytes']
+        assert deserialized_data['tuple'] == list(data['tuple'])
+        assert deserialized_data['x'] == data['x']
+        # the arrays are views over the frame rather than copies
+        assert deserialized_data['numpy'][0].base is not None
+        return {'success': True, 'msg': 'test_binary passed'}
     
-        assert deserialized_data['bro']['fam'].shape == data['bro']['fam'].shape
-        assert deserialized_data['bro']['bro'][0].shape == data['bro']['bro'][0].shape
-
-        stats['elapsed_time'] = c.time() - t
-        stats['size_bytes'] = c.sizeof(data)
-        stats['size_bytes_compressed'] = c.sizeof(serialized_data)
-        stats['size_deserialized_data'] = c.sizeof(deserialized_data)
-        stats['compression_ratio'] = stats['size_bytes'] / stats['size_bytes_compressed']
-        stats['mb_per_second'] = c.round((stats['size_bytes'] / stats['elapsed_time']) / 1e6, 3)
-
-        data =  torch.randn(size,size)
-        t = c.time()
-        serialized_data = self.serialize(data)
-        assert isinstance(serialized_data, str), f"serialized_data must be a str, not {type(serialized_data)}"
-        deserialized_data = self.deserialize(serialized_data)
-        assert deserialized_data.shape == data.shape
-
-        stats['elapsed_time'] = c.time() - t
-        stats['size_bytes'] = c.sizeof(data)
-        stats['size_bytes_compressed'] = c.sizeof(serialized_data)
-        stats['size_deserialized_data'] = c.sizeof(deserialized_data)
-        stats['compression_ratio'] = stats['size_bytes'] / stats['size_bytes_compressed']
-        stats['mb_per_second'] = c.round((stats['size_bytes'] / stats['elapsed_time']) / 1e6, 3)
-        
-        data =  np.random.randn(size,size)
-        t = c.time()
-        serialized_data = self.serialize(data, mode='str')
-        assert isinstance(serialized_data, str), f"serialized_data must be a str, not {type(serialized_data)}"
-        deserialized_data = self.deserialize(serialized_data)
-        assert deserialized_data.shape == data.shape
-
-        stats['elapsed_time'] = c.time() - t
-        stats['size_bytes'] = c.sizeof(data)
-        stats['size_bytes_compressed'] = c.sizeof(serialized_data)
-        stats['size_deserialized_data'] = c.sizeof(deserialized_data)
-        stats['compression_ratio'] = stats['size_bytes'] / stats['size_bytes_compressed']
-        stats['mb_per_second'] = c.round((stats['size_bytes'] / stats['elapsed_time']) / 1e6, 3)
-
-        return stats
\ No newline at end of file
+    @classmethod
+    def test(cls, sizes:List[int]=[1, 100, 1000], modes:List[str]=['str', 'binary'], n:int=3):
+        """
+        Round trips tensor/array payloads of sizes x sizes through each mode,
+        reporting the throughput (MB/s) and the bytes on the wire
+        """
+        import torch
+        self = cls()
+        stats = {}
+        for mode in modes:
+            stats[mode] = {}
+            for size in sizes:
+                data = {'bro': {'fam': torch.randn(size,size), 'bro': [torch.ones(size,size)] , 'bro2': [np.ones((size,size))]}}
+                t = c.time()
+                for _ in range(n):
+                    serialized_data = self.serialize(data, mode=mode)
+                    deserialized_data = self.deserialize(serialized_data)
+                elapsed_time = (c.time() - t) / n
+                assert deserialized_data['bro']['fam'].shape == data['bro']['fam'].shape
+                assert deserialized_data['bro']['bro'][0].shape == data['bro']['bro'][0].shape
+                assert deserialized_data['bro']['bro2'][0].shape == data['bro']['bro2'][0].shape
+
+                size_bytes = c.sizeof(data)
+                bytes_on_wire = len(serialized_data)
+                stats[mode][size] = {
+                    'elapsed_time': elapsed_time,
+                    'size_bytes': size_bytes,
+                    'bytes_on_wire': bytes_on_wire,
+                    'wire_ratio': bytes_on_wire / size_bytes,
+                    'mb_per_second': c.round((size_bytes / elapsed_time) / 1e6, 3),
+                }
+        return stats
@@ -1,4 +1,5 @@
 import commune as c
+import threading
 from typing import *
 
 
@@ -18,6 +19,8 @@ class Access(c.Module):
                 state_path = f'state_path', # the path to the state
                 refresh: bool = False,
                 max_age = 1000, # max age of the state in seconds
+                snapshot_interval: int = 10, # seconds between snapshots of the state to disk
+                background: bool = True, # sync the network and snapshot the state in a background thread
                 **kwargs):
         
         config = self.set_config(kwargs=locals())
@@ -33,10 +36,15 @@ class Access(c.Module):
         self.state_path = state_path
         if refresh:
             self.rm_state()
+        self.lock = threading.Lock()
+        self.buckets = {} # (address, fn) -> [tokens, last refill time]
+        self.rate_cache = {} # (address, fn) -> rate info, cleared on every sync
+        self.load_state()
         self.last_time_synced = c.time()
-        self.state = {}
+        self.last_time_snapshot = c.time()
         
-        c.thread(self.sync_loop_thread)
+        if background:
+            c.thread(self.sync_loop_thread)
 
     def default_state(self):
         state = {
@@ -55,6 +63,16 @@ class Access(c.Module):
 
         return state
 
+    def load_state(self):
+        """
+        loads the last snapshot, so the stakes are known before the first sync
+        """
+        state = self.default_state()
+        state.update(self.get(self.state_path, {}) or {})
+        self.state = state
+        self.stakes = state.get('stakes', {})
+        self.users = self.user_module.users()
+        return state
     
     def rm_state(self):
         self.put(self.state_path, {})
@@ -67,51 +85,93 @@ class Access(c.Module):
 
     def sync_loop_thread(self):
         while True:
-            self.sync_network()
-            c.sleep(self.config.sync_interval)
+            try:
+                self.sync_network()
+            except Exception as e:
+                c.print(f'Failed to sync {self.state_path}: {e}', color='red')
+            if c.time() - self.last_time_snapshot > self.config.snapshot_interval:
+                # a failed snapshot is tried again on the next round, it does not stop the loop
+                try:
+                    self.save_state()
+                    self.last_time_snapshot = c.time()
+                except Exception as e:
+                    c.print(f'Failed to save {self.state_path}: {e}', color='red')
+            c.sleep(min(self.config.sync_interval, self.config.snapshot_interval))
 
 
     def sync_network(self, update=False):
-        state = self.get(self.state_path, {})
-        if len(self.state) == 0:
-            self.get
-            update=True
-
+        """
+        refreshes the stakes and the users, this only runs in the background thread
+        """
+        state = self.state
         time_since_sync = c.time() - state.get('sync_time', 0)
 
         if time_since_sync > self.config.sync_interval or update:
-            self.subspace = c.module('subspace')(network=self.config.chain)
-            self.stakes = self.subspace.stakes(fmt='j', netuid=self.config.netuid, update=False)
-            state['stake_from'] = self.subspace.my_stake_from(netuid=self.config.netuid, update=False, max_age=self.config.max_age)
+            # the indexer of the host answers from memory, the chain is only queried without it
+            indexer = c.module('subspace.indexer').connect(network=self.config.chain)
+            if indexer != None:
+                stakes = indexer.stakes(netuid=self.config.netuid, fmt='j')
+                stake_from = indexer.my_stake_from(keys=list(self.address2key.keys()), netuid=self.config.netuid, fmt='j')
+            else:
+                self.subspace = c.module('subspace')(network=self.config.chain)
+                stakes = self.subspace.stakes(fmt='j', netuid=self.config.netuid, update=False)
+                stake_from = self.subspace.my_stake_from(netuid=self.config.netuid, update=False, max_age=self.config.max_age)
+            self.users = self.user_module.users()
+            self.stakes = state['stakes'] = stakes
+            state['stake_from'] = stake_from
             state['sync_time'] = c.time()
+            # the rates are derived from the stakes, so they are recomputed on the next call
+            self.rate_cache = {}
+            self.last_time_synced = c.time()
+            c.print(f'🔄 Synced {self.state_path} at {state["sync_time"]}... 🔄\033', color='yellow')
+        self.evict_idle()
 
-
-        self.state = state
-        self.save_state()
-
-        response = {  
-
-                    }
-        c.print(f'🔄 Synced {self.state_path} at {state["sync_time"]}... 🔄\033', color='yellow')
         response = {'success': True, 'msg': f'synced {self.state_path}', 
                     'until_sync': int(self.config.sync_interval - time_since_sync),
                     'time_since_sync': int(time_since_sync)}
-        c.print(response)
         return response
 
+    def get_rate(self, address:str, fn:str) -> dict:
+        """
+        the calls per period an address can make to a function, from its role or its stake
+        """
+        key = (address, fn)
+        rate = self.rate_cache.get(key, None)
+        if rate != None:
+            return rate
+        state = self.state
+        role = self.users.get(address, {}).get('role', None) or 'public'
+        stake = self.stakes.get(address, 0)
+        # we want to also know if the user has been staked from
+        stake_from = state.get('stake_from', {}).get(address, 0)
+        fn2info = state['fn_info'].get(fn, {'stake2rate': self.config.stake2rate, 'max_rate': self.config.max_rate})
+        role2rate = state.get('role2rate', {})
+        if role in role2rate:
+            rate_limit = role2rate[role]
+        else:
+            # convert the stake to a rate, capped at the max rate
+            rate_limit = (stake + stake_from) / fn2info.get('stake2rate', self.config.stake2rate)
+            rate_limit = min(rate_limit, fn2info.get('max_rate', self.config.max_rate))
+        rate = self.rate_cache[key] = {'rate_limit': rate_limit, 
+                                       'role': role, 
+                                       'stake': stake, 
+                                       'stake_from': stake_from}
+        return rate
+
     def verify(self, input:dict) -> dict:
         """
         input : dict 
-            address:
+            address: the caller
+            fn: the function that is called
 
-        
+        every (address, fn) has a token bucket that holds up to rate_limit calls (at least one)
+        and refills at that many calls per period, there is no disk or network io here
         """
         fn = input['fn']
         address = input['address']
-        if c.is_admin(address):
+        if self.users.get(address, {}).get('role', None) == 'admin':
             return {'success': True, 'msg': f'is verified admin'}
         
-
         whitelist =  list(set(self.module.whitelist + c.helper_functions))
         blacklist =  self.module.blacklist
 
@@ -120,72 +180,57 @@ class Access(c.Module):
 
         if address in self.address2key:
             return {'success': True, 'msg': f'address {address} is in the whitelist'}
-        
-
 
+        rate = self.get_rate(address, fn)
+        rate_limit = rate['rate_limit']
+        # a caller below one call per period still gets one call per period
+        capacity = max(rate_limit, 1)
+        period = self.timescale_map[self.config.timescale]
         current_time = c.time()
+        key = (address, fn)
+        with self.lock:
+            bucket = self.buckets.get(key, None)
+            if bucket == None:
+                bucket = self.buckets[key] = [capacity, current_time]
+            # refill the bucket for the time since the last call
+            bucket[0] = min(capacity, bucket[0] + (current_time - bucket[1]) * capacity / period)
+            bucket[1] = current_time
+            success = bucket[0] >= 1
+            if success:
+                bucket[0] -= 1
+            tokens = bucket[0]
+            # the counters are kept in memory and snapshotted in the background
+            address_info = self.state['user_info'].setdefault(address, {'fn2requests': {}})
+            address_info['fn2requests'][fn] = address_info['fn2requests'].get(fn, 0) + 1
+            address_info['timestamp'] = current_time
+
+        user_info = {'success': success, 
+                     'rate_limit': rate_limit, 
+                     'tokens': tokens, 
+                     'period': period, 
+                     'timescale': self.config.timescale, 
+                     'timestamp': current_time,
+                     **rate}
+        if not success:
+            user_info['error'] = f'Rate limit exceeded for {fn}, {capacity} calls per {self.config.timescale}'
+        return user_info
 
-        # sync of the state is not up to date 
-        self.sync_network()
-
-        # get the rate limit for the user
-        role2rate = self.state.get('role2rate', {})
-
-        # get the role of the user
-        role = self.user_module.get_role(address) or 'public'
-        rate_limit = role2rate.get(role, 0)
-
-        # stake rate limit
-        stake = self.stakes.get(address, 0)
-        # we want to also know if the user has been staked from
-        stake_from = self.state.get('stake_from', {}).get(address, 0)
-
-        # STEP 1:  FIRST CHECK THE WHITELIST AND BLACKLIST
-
-  
-
-        # STEP 2: CHECK THE STAKE AND CONVERT TO A RATE LIMIT
-        fn2info = self.state['fn_info'].get(fn,{'stake2rate': self.config.stake2rate, 'max_rate': self.config.max_rate})
-        stake2rate = fn2info.get('stake2rate', self.config.stake2rate)
-        total_stake_score = stake + stake_from
-        rate_limit = (total_stake_score / stake2rate) # convert the stake to a rate
-
-
-        # STEP 3: CHECK THE MAX RATE
-        max_rate = fn2info.get('max_rate', self.config.max_rate)
-        rate_limit = min(rate_limit, max_rate) # cap the rate limit at the max rate
-        
-        # NOW LETS CHECK THE RATE LIMIT
-        user_info = self.state.get('user_info', {}).get(address, {})
-        # check if the user has exceeded the rate limit
-        time_since_called = current_time - user_info.get('timestamp', 0)
+    def evict_idle(self) -> dict:
+        """
+        drops the buckets that are full again (idle for a period, like a new bucket)
+        and the counters of the addresses that did not call for max_age seconds
+        """
         period = self.timescale_map[self.config.timescale]
-        # if the time since the last call is greater than the seconds in the period, reset the requests
-        if time_since_called > period:
-            user_info['rate'] = 0
-
-        try:
-            assert user_info['rate'] <= rate_limit
-            user_info['success'] = True
-        except Exception as e:
-            user_info['error'] = c.detailed_error(e)
-            user_info['success'] = False
-       
-        # update the user info
-        user_info['rate_limit'] = rate_limit
-        user_info['period'] = period
-        user_info['role'] = role
-        user_info['fn2requests'] = user_info.get('fn2requests', {})
-        user_info['fn2requests'][fn] = user_info['fn2requests'].get(fn, 0) + 1
-        user_info['timestamp'] = current_time
-        user_info['stake'] = stake
-        user_info['stake_from'] = stake_from
-        user_info['rate'] = user_info.get('rate', 0) + 1
-        user_info['timescale'] = self.config.timescale
-        # store the user info into the state
-        self.state['user_info'][address] = user_info
-        # check the rate limit
-        return user_info
+        now = c.time()
+        with self.lock:
+            buckets = [key for key, bucket in self.buckets.items() if now - bucket[1] >= period]
+            for key in buckets:
+                del self.buckets[key]
+            user_info = self.state['user_info']
+            addresses = [a for a, info in user_info.items() if now - info.get('timestamp', 0) > self.config.max_age]
+            for address in addresses:
+                del user_info[address]
+        return {'buckets': len(buckets), 'addresses': len(addresses)}
 
     @classmethod
     def get_access_state(cls, module):
@@ -194,14 +239,46 @@ class Access(c.Module):
 
     @classmethod
     def test(cls, key='vali::fam', base_rate=2):
-        module = cls(module=c.module('module')(),  base_rate=base_rate)
+        module = cls(module=c.module('module')(), role2rate={'public': base_rate}, background=False, state_path='test_state')
         key = c.get_key(key)
+        module.address2key = {}
+        results = [module.verify(input={'address': key.ss58_address, 'fn': 'info'})['success'] for i in range(base_rate*3)]
+        assert results == [True]*base_rate + [False]*base_rate*2, results
+        # a caller below one call per period (little or no stake) gets one call per period
+        module.state['role2rate'] = {}
+        module.rate_cache = {}
+        module.stakes = {'5lowstake': 50, '5nostake': 0}
+        for address in ['5lowstake', '5nostake']:
+            results = [module.verify(input={'address': address, 'fn': 'info'})['success'] for i in range(3)]
+            assert results == [True, False, False], (address, results)
+        module.buckets['5lowstake', 'info'][1] -= module.timescale_map[module.config.timescale]
+        assert module.verify(input={'address': '5lowstake', 'fn': 'info'})['success'] # refilled after a period
+        # idle buckets and counters are dropped
+        module.buckets[key.ss58_address, 'info'][1] -= module.timescale_map[module.config.timescale]
+        module.state['user_info'][key.ss58_address]['timestamp'] -= module.config.max_age + 1
+        assert module.evict_idle() == {'buckets': 1, 'addresses': 1}
+        assert (key.ss58_address, 'info') not in module.buckets and key.ss58_address not in module.state['user_info']
+        module.rm_state()
+        return {'success': True, 'msg': 'access test passed'}
 
-        for i in range(base_rate*3):    
-            t1 = c.time()
-            c.print(module.verify(input={'address': key.ss58_address, 'fn': 'info'}))
-            t2 = c.time()
-            c.print(f'🚨 {t2-t1} seconds... 🚨\033', color='yellow')
+    @classmethod
+    def benchmark(cls, n:int = 10000, n_addresses:int = 1000, fn:str = 'info') -> dict:
+        """
+        the cost of verify() for n requests from n_addresses distinct addresses
+        """
+        self = cls(module=c.module('module')(), background=False, state_path='benchmark_state')
+        addresses = [f'5benchmark{i}' for i in range(n_addresses)]
+        self.stakes = {a: c.random_int(0, 100000) for a in addresses}
+        t0 = c.time()
+        successes = sum(self.verify({'address': addresses[i % n_addresses], 'fn': fn})['success'] for i in range(n))
+        seconds = c.time() - t0
+        self.rm_state()
+        return {'n': n, 
+                'n_addresses': n_addresses, 
+                'successes': successes, 
+                'seconds': seconds, 
+                'verify_us': 1e6 * seconds / n, 
+                'max_rps': n / seconds}
     
 
 
@@ -1,7 +1,13 @@
 import commune as c
 import pandas as pd
+import asyncio
+import inspect
+import contextlib
+import json
+import base64
 from typing import *
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.responses import Response, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
 
@@ -21,12 +27,18 @@ class Server(c.Module):
         verbose: bool = False,
         timeout: int = 256,
         access_module: str = 'server.access',
+        verifier: str = 'server.verifier',
         public: bool = False,
         serializer: str = 'serializer',
         save_history:bool= True,
         history_path:str = None , 
         nest_asyncio = True,
         new_loop = True,
+        max_workers: int = None, # the number of workers for sync functions
+        executor_mode: str = 'thread', # only thread, the request path uses the state of this process
+        max_queue: int = 256, # the max number of inflight requests before returning 429
+        fn_concurrency: Union[int, Dict[str, int]] = None, # max concurrent calls per function
+        keep_alive: int = 60, # seconds to keep idle connections open (longer than the client pool keeps them)
         **kwargs
         ) -> 'Server':
 
@@ -67,6 +79,12 @@ class Server(c.Module):
         self.access_module = c.module(access_module)(module=self.module)  
         self.set_history_path(history_path)
         self.set_key(key)
+        self.verifier = c.module(verifier)(key=self.key, max_request_staleness=max_request_staleness)
+        self.set_executor(max_workers=max_workers, 
+                          mode=executor_mode, 
+                          max_queue=max_queue, 
+                          fn_concurrency=fn_concurrency)
+        self.keep_alive = keep_alive
 
         self.set_api(ip=self.ip, port=self.port)
 
@@ -91,6 +109,240 @@ class Server(c.Module):
         while c.port_used(self.port):
             self.port = c.free_port()
         self.address = f"http://{self.ip}:{self.port}"
+    def set_executor(self, 
+                     max_workers:int = None, 
+                     mode:str = 'thread', 
+                     max_queue:int = 256, 
+                     fn_concurrency: Union[int, Dict[str, int]] = None):
+        """
+        sync functions are offloaded to a bounded pool, coroutine functions are awaited on the loop
+        max_queue: the max number of inflight requests, past this we return 429 
+        fn_concurrency: the max number of concurrent calls per function (int applies to all functions)
+        """
+        # the pool runs the bound methods of the server (the verifier, the access state and the history of this process),
+        # so a process pool would have to pickle the server and split its state
+        assert mode == 'thread', f"executor mode must be thread, not {mode} (use c.submit(mode='process') inside the functions)"
+        # the queue is never fuller than the inflight requests, so submit never blocks the loop
+        self.executor = c.module('executor.thread')(max_workers=max_workers, maxsize=max_queue)
+        self.executor_mode = mode
+        self.max_queue = max_queue
+        self.fn_concurrency = fn_concurrency or {}
+        self.fn2semaphore = {}
+        self.stats = {'requests': 0, 
+                      'rejected': 0, 
+                      'errors': 0, 
+                      'queue_depth': 0, 
+                      'max_queue_depth': 0, 
+                      'fn2inflight': {}}
+        return {'success': True, 'mode': mode, 'max_workers': self.executor.max_workers, 'max_queue': max_queue}
+
+    def is_fn(self, fn:str) -> bool:
+        """
+        whether the function can be called (the entries per function are only kept for these)
+        """
+        return isinstance(fn, str) and (fn in getattr(self.module, 'whitelist', []) or fn in c.helper_functions) and fn not in getattr(self.module, 'blacklist', [])
+
+    def fn_semaphore(self, fn:str) -> Optional[asyncio.Semaphore]:
+        if not self.is_fn(fn):
+            return None
+        if isinstance(self.fn_concurrency, int):
+            limit = self.fn_concurrency
+        else:
+            limit = self.fn_concurrency.get(fn, None)
+        if limit == None:
+            return None
+        if fn not in self.fn2semaphore:
+            self.fn2semaphore[fn] = asyncio.Semaphore(limit)
+        return self.fn2semaphore[fn]
+
+    async def run_sync(self, fn:Callable, args:list = None, kwargs:dict = None):
+        """
+        runs a sync function on the server's pool without blocking the event loop
+        """
+        args = args or []
+        kwargs = kwargs or {}
+        future = self.executor.submit(fn=fn, args=args, kwargs=kwargs, timeout=self.timeout)
+        return await asyncio.wrap_future(future)
+
+    def metrics(self) -> dict:
+        return {'name': self.name, 
+                'executor_mode': self.executor_mode,
+                'max_workers': self.executor.max_workers, 
+                'max_queue': self.max_queue,
+                **self.stats, 
+                'verify': self.verifier.metrics()}
+
+    def admit(self, n:int = 1) -> Optional[JSONResponse]:
+        """
+        admits n calls, or returns a 429 response if they would push the queue past max_queue
+        """
+        stats = self.stats
+        if stats['queue_depth'] + n > self.max_queue:
+            stats['rejected'] += 1
+            return JSONResponse(status_code=429, 
+                                content={'error': f'Server is busy, queue_depth={stats["queue_depth"]} + {n} > max_queue={self.max_queue}', 
+                                         'queue_depth': stats['queue_depth']}, 
+                                headers={'Retry-After': '1'})
+        stats['requests'] += n
+        stats['queue_depth'] += n
+        stats['max_queue_depth'] = max(stats['max_queue_depth'], stats['queue_depth'])
+        return None
+
+    @contextlib.asynccontextmanager
+    async def fn_limit(self, fn:str):
+        """
+        holds a slot of the function's concurrency limit (if it has one), 
+        the functions that cannot be called are not counted (they are rejected by the access check)
+        """
+        if not self.is_fn(fn):
+            yield
+            return
+        fn2inflight = self.stats['fn2inflight']
+        fn2inflight[fn] = fn2inflight.get(fn, 0) + 1
+        semaphore = self.fn_semaphore(fn)
+        try:
+            if semaphore != None:
+                async with semaphore:
+                    yield
+            else:
+                yield
+        finally:
+            fn2inflight[fn] -= 1
+
+    async def async_forward(self, fn:str, input:dict):
+        """
+        the async request path, which applies backpressure and dispatches the function call
+        - coroutine functions are awaited directly on the event loop
+        - sync functions (and the verification of every request) run on the server's pool
+        """
+        rejection = self.admit()
+        if rejection != None:
+            return rejection
+        try:
+            async with self.fn_limit(fn):
+                if inspect.iscoroutinefunction(getattr(self.module, fn, None)):
+                    request = await self.run_sync(self.process_input, kwargs={'fn': fn, 'input': input})
+                    if request['success']:
+                        try:
+                            request['result'] = await getattr(self.module, fn)(*request['args'], **request['kwargs'])
+                        except Exception as e:
+                            request['result'] = c.detailed_error(e)
+                    return await self.run_sync(self.process_output, args=[request])
+                return await self.run_sync(self.forward, kwargs={'fn': fn, 'input': input})
+        finally:
+            self.stats['queue_depth'] -= 1
+
+    async def async_batch(self, input:dict):
+        """
+        runs the calls of a signed envelope concurrently, the envelope's signature is verified once
+        input: a request (see forward) with kwargs
+            calls: a list of {'fn', 'args', 'kwargs'} (or [fn, args, kwargs])
+            stream: stream signed {'index', 'result'} events as the calls complete (default False)
+        returns the results in the order of the calls, failed calls return their error
+
+        the envelope is admitted before it is verified and the rest of its calls once they are known,
+        so a busy server does not spend cpu on the batches it rejects
+        """
+        rejection = self.admit(1)
+        if rejection != None:
+            return rejection
+        admitted = 1
+        streaming = False
+        try:
+            request = await self.run_sync(self.process_input, kwargs={'fn': 'batch', 'input': input, 'verify_access': False})
+            if not request['success']:
+                return await self.run_sync(self.process_output, args=[request])
+            calls = request['kwargs'].get('calls', [])
+            calls = [dict(zip(['fn', 'args', 'kwargs'], call)) if isinstance(call, (list, tuple)) else call for call in calls]
+            stream = request['kwargs'].get('stream', False)
+            if len(calls) > 1:
+                rejection = self.admit(len(calls) - 1)
+                if rejection != None:
+                    return rejection
+                admitted = len(calls)
+
+            async def run(index, call):
+                fn = call.get('fn', None)
+                try:
+                    async with self.fn_limit(fn):
+                        if inspect.iscoroutinefunction(getattr(self.module, fn, None)):
+                            call = await self.run_sync(self.process_call, args=[call, input])
+                            if 'result' not in call:
+                                call['result'] = await getattr(self.module, fn)(*call['args'], **call['kwargs'])
+                            result = call['result']
+                        else:
+                            result = await self.run_sync(self.batch_call, args=[call, input])
+                except Exception as e:
+                    result = c.detailed_error(e)
+                if isinstance(result, dict) and 'error' in result:
+                    self.stats['errors'] += 1
+                return index, result
+
+            tasks = [asyncio.ensure_future(run(i, call)) for i, call in enumerate(calls)]
+            if stream:
+                async def generator():
+                    try:
+                        for task in asyncio.as_completed(tasks):
+                            index, result = await task
+                            yield self.process_event({'index': index, 'result': result}, binary=request['binary'])
+                    finally:
+                        self.stats['queue_depth'] -= admitted
+                from sse_starlette.sse import EventSourceResponse
+                streaming = True # the generator releases the slots
+                return EventSourceResponse(generator())
+            results = [result for index, result in await asyncio.gather(*tasks)]
+            request['result'] = results
+            request['args'], request['kwargs'] = [], {'calls': [call.get('fn') for call in calls]}
+            return await self.run_sync(self.process_output, args=[request])
+        finally:
+            if not streaming:
+                self.stats['queue_depth'] -= admitted
+
+    def process_event(self, data, binary:bool = False) -> str:
+        """
+        serializes and signs one streamed event in the format of the request
+        (a binary frame is base64 encoded in the event, with its signature headers)
+        """
+        if binary:
+            frame = self.serializer.serialize({'data': data}, mode='binary')
+            headers = self.serializer.sign_binary(frame, key=self.key)
+            return json.dumps({'binary': base64.b64encode(frame).decode(), 'headers': headers})
+        return json.dumps(self.key.sign(self.serializer.serialize({'data': data}), return_json=True))
+
+    def process_call(self, call:dict, input:dict) -> dict:
+        """
+        checks the access of one call of a batch, access failures are returned as the result
+        """
+        call = {'fn': call['fn'], 'args': call.get('args', None) or [], 'kwargs': call.get('kwargs', None) or {}}
+        try:
+            user_info = self.access_module.verify({**input, 'fn': call['fn']})
+            if not user_info['success']:
+                call['result'] = user_info
+        except Exception as e:
+            call['result'] = c.detailed_error(e)
+        return call
+
+    def batch_call(self, call:dict, input:dict):
+        call = self.process_call(call, input)
+        if 'result' in call:
+            return call['result']
+        try:
+            return self.call(call['fn'], args=call['args'], kwargs=call['kwargs'])
+        except Exception as e:
+            return c.detailed_error(e)
+
+    def call(self, fn:str, args:list = None, kwargs:dict = None):
+        args = args or []
+        kwargs = kwargs or {}
+        fn_obj = getattr(self.module, fn)
+        if callable(fn_obj):
+            result = fn_obj(*args, **kwargs)
+        else:
+            result = fn_obj
+        if inspect.iscoroutine(result):
+            result = c.gather(result, timeout=self.timeout)
+        return result
+
     def forward(self, fn:str, input:dict):
         """
         fn (str): the function to call
@@ -104,13 +356,40 @@ class Server(c.Module):
             signature: the signature of the request
    
         """
-        user_info = None
+        request = self.process_input(fn=fn, input=input)
+        if request['success']:
+            try:
+                request['result'] = self.call(fn, args=request['args'], kwargs=request['kwargs'])
+            except Exception as e:
+                request['result'] = c.detailed_error(e)
+        return self.process_output(request)
+
+    def process_input(self, fn:str, input:dict, verify_access:bool = True) -> dict:
+        """
+        verifies the signature, the staleness and the access of the request, 
+        and returns the request with the deserialized args and kwargs
+        verify_access: False for batches, where every call is checked on its own
+        """
+        request = {'fn': fn, 
+                   'input': input, 
+                   'success': False, 
+                   'user': None, 
+                   'args': [], 
+                   'kwargs': {}, 
+                   'timestamp': c.timestamp(),
+                   'result': None}
+        # binary requests get binary responses
+        request['binary'] = binary = self.serializer.is_binary(input.get('data', None))
+        headers = input.pop('headers', {})
         try:
             input['fn'] = fn
             # you can verify the input with the server key class
             if not self.public:
-                assert self.key.verify(input), f"Data not signed with correct key"
-
+                signed_input = input
+                if binary:
+                    signed_input = self.serializer.binary_signature(input['data'], headers=headers)
+                assert self.verifier.verify(signed_input), f"Data not signed with correct key"
+                assert not self.verifier.is_replay(signed_input), f"Request was already received (replay)"
 
             if 'args' in input and 'kwargs' in input:
                 input['data'] = {'args': input['args'], 
@@ -124,54 +403,49 @@ class Server(c.Module):
             assert request_staleness < self.max_request_staleness, f"Request is too old, {request_staleness} > MAX_STALENESS ({self.max_request_staleness})  seconds old"
             
             # verify the access module
-            user_info = self.access_module.verify(input)
-            if not user_info['success']:
-                return user_info
+            if verify_access:
+                user_info = self.access_module.verify(input)
+                request['user'] = user_info
+                if not user_info['success']:
+                    # access failures are returned as they are
+                    request['response'] = user_info
+                    return request
             assert 'args' in input['data'], f"args not in input data"
 
             data = input['data']
-            args = data.get('args',[])
-            kwargs = data.get('kwargs', {})
-
-            fn_name = f"{self.name}::{fn}"
-
-            info = {
-                'fn': fn_name,
-                'address': input['address'],
-            }
-            
-            fn_obj = getattr(self.module, fn)
-            
-            if callable(fn_obj):
-                result = fn_obj(*args, **kwargs)
-            else:
-                result = fn_obj
-
-            success = True
-
-            # if the result is a future, we need to wait for it to finish
+            request['args'] = data.get('args',[])
+            request['kwargs'] = data.get('kwargs', {})
+            request['timestamp'] = data.get('timestamp', request['timestamp'])
+            request['success'] = True
         except Exception as e:
-            result = c.detailed_error(e)
-        if isinstance(result, dict) and 'error' in result:
-            success = False 
-        
+            request['result'] = c.detailed_error(e)
+        return request
+
+    def process_output(self, request:dict):
+        """
+        signs the result of the request and saves it to the history
+        """
+        if 'response' in request:
+            return request['response']
+        fn = request['fn']
+        input = request['input']
+        result = request['result']
+        success = request['success'] and not (isinstance(result, dict) and 'error' in result)
 
         if success:
-            c.print(f'✅ Success: {self.name}::{fn} --> {input["address"]}... ✅\033 ', color='green')
+            c.print(f'✅ Success: {self.name}::{fn} --> {input.get("address")}... ✅\033 ', color='green')
         else:
-            c.print(f'🚨 Error: {self.name}::{fn} --> {input["address"]}... 🚨\033', color='red')
-        
+            self.stats['errors'] += 1
+            c.print(f'🚨 Error: {self.name}::{fn} --> {input.get("address")}... 🚨\033', color='red')
 
-        result = self.process_result(result)
+        result = self.process_result(result, binary=request['binary'])
     
         output = {
         'module': self.name,
         'fn': fn,
-        'address': input['address'],
-        'args': input['data']['args'],
-        'kwargs': input['data']['kwargs'],
-        
-
+        'address': input.get('address'),
+        'args': request['args'],
+        'kwargs': request['kwargs'],
         }
 
         c.print(output)
@@ -180,17 +454,21 @@ class Server(c.Module):
             output.update(
                 {
                     'success': success,
-                    'user': user_info,
-                    'timestamp': input['data']['timestamp'],
+                    'user': request['user'],
+                    'timestamp': request['timestamp'],
                     'result': result,
                 }
             )
 
-            output.update(output.pop('data', {}))
             output['latency'] = c.time() - output['timestamp']
-            self.add_history(output)
+            try:
+                self.add_history(output)
+            except Exception as e:
+                # a payload that cannot be stored should not fail the request
+                c.print(f'Failed to save history: {e}', color='red')
 
         return result
+
     def set_api(self, ip:str = '0.0.0.0', port:int = 8888):
         ip = self.ip if ip == None else ip
         port = self.port if port == None else port
@@ -204,15 +482,25 @@ class Server(c.Module):
                 allow_headers=["*"],
             )
        
+        @self.app.get("/metrics")
+        async def metrics_api():
+            return self.metrics()
+
+        @self.app.post("/batch")
+        async def batch_api(request: Request):
+            input = await self.read_request(request)
+            return await self.async_batch(input=input)
+
         @self.app.post("/{fn}")
-        def forward_api(fn:str, input:dict):
-            return self.forward(fn=fn, input=input)
+        async def forward_api(fn:str, request: Request):
+            input = await self.read_request(request)
+            return await self.async_forward(fn=fn, input=input)
         
         try:
             c.print(f'\033🚀 Serving {self.name} on {self.address} 🚀\033')
             c.register_server(name=self.name, address = self.address, network=self.network)
             c.print(f'\033🚀 Registered {self.name} --> {self.ip}:{self.port} 🚀\033')
-            uvicorn.run(self.app, host=c.default_ip, port=self.port, loop="asyncio")
+            uvicorn.run(self.app, host=c.default_ip, port=self.port, loop="asyncio", timeout_keep_alive=self.keep_alive)
         except Exception as e:
             c.print(e, color='red')
             c.deregister_server(self.name, network=self.network)
@@ -220,16 +508,14 @@ class Server(c.Module):
             c.deregister_server(self.name, network=self.network)
         
     @classmethod
-    def history_paths(cls, server=None, history_path='history', n=100, key=None):
-        if server == None:
-            dirpath  = f'{history_path}'
-            paths =  cls.glob(dirpath)
-        else:
-            
-            dirpath  = f'{history_path}/{server}'
-            paths =  cls.ls(dirpath)
-        paths = sorted(paths, reverse=True)[:n]
-        return paths
+    def history_paths(cls, server=None, history_path='server', n=100, key=None):
+        """
+        the history segments that hold the records of the server (or of every server)
+        """
+        store = c.module('history').store(history_path)
+        key = c.get_key(key).ss58_address if key != None else None
+        segments = store.segments(module=server, key=key)[:n]
+        return [store.segment_path(segment) for segment in segments]
 
 
     def state_dict(self) -> Dict:
@@ -243,12 +529,26 @@ class Server(c.Module):
     
 
 
-    def process_result(self,  result):
+    async def read_request(self, request: Request) -> dict:
+        '''
+        Reads the json request, or the binary frame with its signature headers
+        '''
+        if request.headers.get('content-type', None) == self.serializer.binary_content_type:
+            return {'data': await request.body(), 
+                    'address': request.headers.get(self.serializer.binary_headers['address']),
+                    'headers': dict(request.headers)}
+        return await request.json()
+
+    def process_result(self,  result, binary:bool = False):
         if c.is_generator(result):
             from sse_starlette.sse import EventSourceResponse
             # for sse we want to wrap the generator in an eventsource response
             result = self.generator_wrapper(result)
             return EventSourceResponse(result)
+        elif binary:
+            result = self.serializer.serialize({'data': result}, mode='binary')
+            headers = self.serializer.sign_binary(result, key=self.key)
+            return Response(content=result, media_type=headers.pop('Content-Type'), headers=headers)
         else:
             # if we are not using sse, then we can do this with json
             result = self.serializer.serialize(result)
@@ -296,37 +596,192 @@ class Server(c.Module):
 
 
 
+    @classmethod
+    def serve_echo(cls, port:int = None, name:str = 'echo::load_test', **kwargs):
+        """
+        serves a trivial module that echoes its input, for load testing the request path
+        """
+        module = c.module('module')()
+        module.whitelist = ['echo']
+        # serve a precomputed info so info calls measure the request path and not the schema
+        info = module.info()
+        module.info = lambda *args, **kwargs: info
+        return cls(module=module, name=name, port=port, save_history=False, **kwargs)
+
+    @classmethod
+    def echo_process(cls, port:int = None, timeout:int = 60, **server_kwargs):
+        """
+        starts the echo server in a subprocess and waits for its port, the caller kills the process
+        """
+        import subprocess
+        import sys
+        port = port or c.free_port()
+        server_kwargs = {'port': port, **server_kwargs}
+        cmd = f"import commune as c; c.module('server').serve_echo(**{server_kwargs})"
+        process = subprocess.Popen([sys.executable, '-c', cmd], 
+                                   stdout=subprocess.DEVNULL, 
+                                   stderr=subprocess.DEVNULL, 
+                                   cwd=c.libpath)
+        t0 = c.time()
+        while not c.port_used(port):
+            if c.time() - t0 > timeout:
+                process.kill()
+                raise TimeoutError(f'Echo server did not start on port {port} within {timeout}s')
+            c.sleep(0.1)
+        return process
+
+    @classmethod
+    def test_batch(cls, n:int = 5, max_queue:int = 8) -> dict:
+        """
+        batches, streamed batches (json and binary, signed events) and the admission of a batch by its size
+        """
+        import aiohttp
+        port = c.free_port()
+        process = cls.echo_process(port=port, max_queue=max_queue)
+        try:
+            client = c.module('client')(ip='0.0.0.0', port=port, save_history=False)
+            calls = [('echo', [i]) for i in range(n)]
+            assert client.batch(calls) == list(range(n))
+            # identical calls within the same second are not replays, their signed payloads differ by the nonce
+            assert [client.forward(fn='echo', args=['same'], timeout=10) for _ in range(3)] == ['same'] * 3
+            payloads = [client.get_request(args=['same'])['request_kwargs']['data'] for _ in range(2)]
+            assert json.loads(payloads[0])['data'] != json.loads(payloads[1])['data']
+            async def stream(binary):
+                return [event async for event in client.batch_stream(calls, binary=binary)]
+            for binary in [False, True]:
+                events = client.loop.run_until_complete(stream(binary))
+                assert sorted((e['index'], e['result']) for e in events) == [(i, i) for i in range(n)], events
+            # the events are signed by the server
+            async def raw_event():
+                request = client.get_request(kwargs={'calls': calls, 'stream': True})
+                async with aiohttp.ClientSession() as session:
+                    async with session.post(f'http://0.0.0.0:{port}/batch', **request['request_kwargs']) as response:
+                        async for line in response.content:
+                            line = line.decode().strip()
+                            if line.startswith('data: '):
+                                return json.loads(line[len('data: '):])
+            event = client.loop.run_until_complete(raw_event())
+            assert c.module('key').gen().verify(event), event
+            # a batch larger than the queue is rejected as a whole, and its slot is released
+            rejected = client.batch([('echo', [i]) for i in range(max_queue + 1)])
+            assert 'Server is busy' in str(rejected), rejected
+            assert client.batch(calls) == list(range(n))
+            c.sleep(0.1)
+            import requests
+            assert requests.get(f'http://0.0.0.0:{port}/metrics').json()['queue_depth'] == 0
+        finally:
+            process.kill()
+        return {'success': True, 'msg': 'batch test passed'}
+
+    @classmethod
+    def test_unknown_fns(cls, n:int = 20) -> dict:
+        """
+        calls to functions the server does not have are rejected without a per function entry
+        """
+        import requests
+        port = c.free_port()
+        process = cls.echo_process(port=port, fn_concurrency=1)
+        try:
+            client = c.module('client')(ip='0.0.0.0', port=port, save_history=False)
+            for i in range(n):
+                assert 'error' in str(client.forward(fn=f'unknown{i}', args=['x'], timeout=10))
+            assert client.forward(fn='echo', args=['x'], timeout=10) == 'x'
+            metrics = requests.get(f'http://0.0.0.0:{port}/metrics').json()
+            assert set(metrics['fn2inflight']) == {'echo'}, metrics['fn2inflight']
+        finally:
+            process.kill()
+        # the request path runs the state of this process, a process pool is rejected
+        import types
+        try:
+            cls.set_executor(types.SimpleNamespace(), mode='process')
+            raise AssertionError('the process mode was not rejected')
+        except AssertionError as e:
+            assert 'executor mode must be thread' in str(e), e
+        return {'success': True, 'msg': 'unknown functions are not counted'}
+
+    @classmethod
+    def load_test(cls, 
+                  n:int = 1000, 
+                  concurrency:int = 64, 
+                  port:int = None, 
+                  fn:str = 'echo', 
+                  payload = 'hey', 
+                  timeout:int = 60,
+                  server_kwargs:dict = None) -> dict:
+        """
+        starts an echo server in a subprocess and fires n requests at it with the given concurrency
+        returns the p50/p99 latency (seconds) and requests per second
+        """
+        port = port or c.free_port()
+        process = cls.echo_process(port=port, timeout=timeout, **(server_kwargs or {}))
+        try:
+            client = c.module('client')(ip='0.0.0.0', port=port, save_history=False)
+            latencies = []
+            errors = []
+            semaphore = asyncio.Semaphore(concurrency)
+            async def call():
+                async with semaphore:
+                    t1 = c.time()
+                    try:
+                        result = await client.async_forward(fn=fn, args=[payload], timeout=timeout)
+                        assert result == payload, f'Unexpected result {result}'
+                        latencies.append(c.time() - t1)
+                    except Exception as e:
+                        errors.append(c.detailed_error(e))
+            async def run():
+                t0 = c.time()
+                await asyncio.gather(*[call() for _ in range(n)])
+                return c.time() - t0
+            duration = c.get_event_loop().run_until_complete(run())
+        finally:
+            process.kill()
+        latencies = sorted(latencies)
+        percentile = lambda p: latencies[min(len(latencies) - 1, int(p * len(latencies)))] if latencies else None
+        return {'n': n, 
+                'concurrency': concurrency, 
+                'successes': len(latencies), 
+                'errors': len(errors), 
+                'p50': percentile(0.5), 
+                'p99': percentile(0.99), 
+                'rps': len(latencies) / duration, 
+                'duration': duration, 
+                'error_sample': errors[:1]}
+
     # HISTORY 
     def add_history(self, item:dict):    
-        path = self.history_path + '/' + item['address'] + '/'+  str(item['timestamp']) 
-        self.put(path, item)
+        # the caller is the key of the record
+        item['key'] = item['address']
+        self.history_store.add(item)
 
     def set_history_path(self, history_path):
-        self.history_path = history_path or f'history/{self.name}'
+        self.history_path = history_path or 'server'
+        self.history_store = c.module('history').store(self.history_path)
         return {'history_path': self.history_path}
 
     @classmethod
-    def rm_history(cls, server=None, history_path='history'):
-        dirpath  = f'{history_path}/{server}'
-        return cls.rm(dirpath)
+    def rm_history(cls, server=None, history_path='server'):
+        return c.module('history').store(history_path).rm_records(module=server)
     
     @classmethod
-    def rm_all_history(cls, server=None, history_path='history'):
-        dirpath  = f'{history_path}'
-        return cls.rm(dirpath)
+    def rm_all_history(cls, server=None, history_path='server'):
+        return c.module('history').rm_history(history_path)
 
 
     @classmethod
     def history(cls, 
                 key=None, 
-                history_path='history',
+                history_path='server',
                 features=[ 'module', 'fn', 'seconds_ago', 'latency', 'address'], 
                 to_list=False,
+                server=None,
+                n=1000,
                 **kwargs
                 ):
-        key = c.get_key(key)
-        history_path = cls.history_paths(key=key, history_path=history_path)
-        df =  c.df([cls.get(path) for path in history_path])
+        key = c.get_key(key).ss58_address if key != None else None
+        records = c.module('history').store(history_path).query(module=server, key=key, n=n, **kwargs)
+        df =  c.df(records)
+        if len(df) == 0:
+            return [] if to_list else df
         now = c.timestamp()
         df['seconds_ago'] = df['timestamp'].apply(lambda x: now - x)
         df = df[features]
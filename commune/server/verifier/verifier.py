@@ -0,0 +1,177 @@
+import commune as c
+import hashlib
+import threading
+from collections import OrderedDict, deque
+from typing import *
+
+
+class Verifier(c.Module):
+    """
+    Verifies the signatures of requests for the server
+    - verified (payload hash, signature) pairs are cached in a bounded lru
+    - the requests seen within max_request_staleness are indexed to reject replays in O(1)
+    - the cache and the replay index are shared by the server threads, so they sit behind a lock
+    """
+    def __init__(self,
+                 key = None,
+                 max_request_staleness: int = 60, # seconds a request is indexed for replays
+                 cache_size: int = 10000, # the max number of verified signatures to cache
+                 replay_protection: bool = True,
+                 ):
+        self.key = c.get_key(key) if not hasattr(key, 'verify') else key
+        self.max_request_staleness = max_request_staleness
+        self.cache_size = cache_size
+        self.replay_protection = replay_protection
+        self.cache = OrderedDict() # payload hash -> verified
+        self.seen = {} # request hash -> expiration
+        self.expirations = deque() # (expiration, request hash) in the order they were seen
+        self.lock = threading.Lock()
+        self.stats = {'verified': 0,
+                      'failed': 0,
+                      'cache_hits': 0,
+                      'replays': 0,
+                      'verify_seconds': 0}
+
+    @staticmethod
+    def payload_hash(signed_input:dict) -> str:
+        """
+        the hash of everything the signature covers (the data, the signer and the signature)
+        """
+        data = signed_input['data']
+        if not isinstance(data, (str, bytes)):
+            data = c.python2str(data)
+        if isinstance(data, str):
+            data = data.encode()
+        hasher = hashlib.sha256(data)
+        for k in ['address', 'crypto_type', 'signature']:
+            hasher.update(f'|{signed_input.get(k)}'.encode())
+        return hasher.hexdigest()
+
+    def verify(self, signed_input:dict) -> bool:
+        """
+        verifies the signed input {'data', 'signature', 'address', 'crypto_type'},
+        previously verified payloads are served from the cache
+        """
+        t0 = c.time()
+        payload_hash = self.payload_hash(signed_input)
+        with self.lock:
+            verified = self.cache.get(payload_hash, None)
+            if verified != None:
+                self.cache.move_to_end(payload_hash)
+                self.stats['cache_hits'] += 1
+        if verified == None:
+            # verify outside of the lock, the other threads keep hitting the cache meanwhile
+            try:
+                verified = bool(self.key.verify(signed_input))
+            except Exception as e:
+                verified = False
+            with self.lock:
+                self.cache[payload_hash] = verified
+                while len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+        with self.lock:
+            self.stats['verified' if verified else 'failed'] += 1
+            self.stats['verify_seconds'] += c.time() - t0
+        return verified
+
+    def verify_batch(self, signed_inputs:List[dict], workers:int = None) -> List[bool]:
+        """
+        verifies many signed inputs (like a burst of requests), the ones that are not cached are verified in one key.verify_batch
+        """
+        t0 = c.time()
+        results = [None] * len(signed_inputs)
+        payload_hashes = []
+        misses = []
+        for i, signed_input in enumerate(signed_inputs):
+            try:
+                payload_hash = self.payload_hash(signed_input)
+            except Exception as e:
+                payload_hash = None
+                results[i] = False
+            payload_hashes.append(payload_hash)
+        with self.lock:
+            for i, payload_hash in enumerate(payload_hashes):
+                if payload_hash == None:
+                    continue
+                verified = self.cache.get(payload_hash, None)
+                if verified != None:
+                    self.cache.move_to_end(payload_hash)
+                    self.stats['cache_hits'] += 1
+                    results[i] = verified
+                else:
+                    misses.append(i)
+        if len(misses) > 0:
+            verified = self.key.verify_batch([signed_inputs[i] for i in misses], workers=workers)
+            with self.lock:
+                for i, v in zip(misses, verified):
+                    results[i] = self.cache[payload_hashes[i]] = v
+                while len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+        with self.lock:
+            for verified in results:
+                self.stats['verified' if verified else 'failed'] += 1
+            self.stats['verify_seconds'] += c.time() - t0
+        return results
+
+    def is_replay(self, signed_input:dict) -> bool:
+        """
+        indexes the request (the signature of the address, whatever function it calls, 
+        the function is not signed), returns True if it was already seen within max_request_staleness
+        """
+        if not self.replay_protection:
+            return False
+        request_hash = (signed_input.get('address'), signed_input.get('signature'))
+        # the check and the insert are one step, so only one of two concurrent replays passes
+        with self.lock:
+            now = c.time()
+            # expire the requests that are too old to pass the staleness check anyway
+            expirations = self.expirations
+            while len(expirations) > 0 and expirations[0][0] <= now:
+                _, expired_hash = expirations.popleft()
+                if self.seen.get(expired_hash, now) <= now:
+                    self.seen.pop(expired_hash, None)
+            if request_hash in self.seen:
+                self.stats['replays'] += 1
+                return True
+            expiration = now + self.max_request_staleness
+            self.seen[request_hash] = expiration
+            expirations.append((expiration, request_hash))
+            return False
+
+    def metrics(self) -> dict:
+        stats = self.stats
+        n = stats['verified'] + stats['failed']
+        return {**stats,
+                'cache_size': len(self.cache),
+                'seen': len(self.seen),
+                'hit_rate': stats['cache_hits'] / n if n > 0 else 0,
+                'verify_us': 1e6 * stats['verify_seconds'] / n if n > 0 else 0}
+
+    @classmethod
+    def test(cls, n:int = 100) -> dict:
+        key = c.get_key('verifier::test')
+        self = cls(key=key)
+        signed_inputs = [key.sign({'args': [i], 'timestamp': c.timestamp()}, return_json=True) for i in range(n)]
+        t0 = c.time()
+        assert all(self.verify(s) for s in signed_inputs)
+        cold = c.time() - t0
+        t0 = c.time()
+        assert all(self.verify(s) for s in signed_inputs)
+        warm = c.time() - t0
+        assert self.stats['cache_hits'] == n
+        forged = {**signed_inputs[0], 'data': signed_inputs[1]['data']}
+        assert not self.verify(forged)
+        batch = self.verify_batch(signed_inputs[:10] + [forged, {'data': 'not signed'}] + [key.sign({'args': ['new']}, return_json=True)])
+        assert batch == [True] * 10 + [False, False, True], batch
+        assert not self.is_replay(signed_inputs[0])
+        assert self.is_replay(signed_inputs[0])
+        assert self.is_replay(signed_inputs[0]) # against any other function too
+        assert not self.is_replay(signed_inputs[1])
+        # the same replay sent from many threads at once passes only once
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(16) as executor:
+            replays = list(executor.map(self.is_replay, [signed_inputs[2]] * 64))
+        assert replays.count(False) == 1, replays.count(False)
+        with ThreadPoolExecutor(16) as executor:
+            assert all(executor.map(self.verify, signed_inputs * 4))
+        return {'success': True, 'cold_us': 1e6 * cold / n, 'warm_us': 1e6 * warm / n, **self.metrics()}
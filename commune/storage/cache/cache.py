@@ -0,0 +1,305 @@
+import commune as c
+import os
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import *
+
+
+class StorageCache(c.Module):
+    """
+    Cache of the json files behind Module.get/put (get_json/put_json), keyed by the resolved path
+
+    tier 1: an lru of the json text in this process, bounded by max_bytes and max_items, an entry is served while
+            the file still has the (mtime, size) it was read or written with and it is younger than ttl,
+            so a file written by another process is read again. the text is parsed on every get,
+            so the callers can mutate what they get like before
+    tier 2 (shared=True): a SQLite (WAL) table shared by the processes of the host with the write behinds
+            that are not flushed yet, a row that is newer than its file is served before the file
+    policy: write_through writes the file on put, write_behind only writes the tiers and a background thread
+            flushes the files every flush_interval seconds (the other processes only see the writes with shared=True),
+            the pending writes are flushed at exit and before the readers of the files themselves
+            (exists, ls, glob and the key store call flush_path), any other direct reader of a file sees it
+            only after the next flush
+    """
+    shared_cache = None
+    lock = threading.Lock()
+
+    def __init__(self,
+                 max_bytes:int = 64 * 2**20, # the max size of the json text in memory
+                 max_items:int = 10000,
+                 ttl:float = 300, # seconds an entry is served without checking its file
+                 policy:str = 'write_through', # write_through or write_behind
+                 flush_interval:float = 1.0,
+                 shared:bool = False, # the second tier in sqlite
+                 shared_path:str = None):
+        assert policy in ['write_through', 'write_behind'], f'policy must be write_through or write_behind, not {policy}'
+        self.max_bytes = max_bytes
+        self.max_items = max_items
+        self.ttl = ttl
+        self.policy = policy
+        self.flush_interval = flush_interval
+        self.entries = OrderedDict() # path -> {'signature', 'text', 'time'}
+        self.nbytes = 0
+        self.dirty = {} # path -> text that is not flushed to its file yet (write_behind)
+        self.entries_lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.stats = {'hits': 0, 'shared_hits': 0, 'misses': 0, 'puts': 0, 'flushes': 0, 'evictions': 0}
+        self.shared = shared
+        if shared:
+            self.shared_path = shared_path or self.resolve_path('storage_cache.db')
+            os.makedirs(os.path.dirname(self.shared_path), exist_ok=True)
+            self.local = threading.local()
+            self.conn.execute('CREATE TABLE IF NOT EXISTS entries (path TEXT PRIMARY KEY, text TEXT, time REAL)')
+        self.stopped = False
+        if policy == 'write_behind':
+            c.thread(self.flush_loop)
+            # the flush thread is a daemon, so the pending writes are flushed at exit
+            import atexit
+            atexit.register(self.flush)
+
+    @classmethod
+    def instance(cls, refresh:bool = False, **kwargs) -> 'StorageCache':
+        """
+        the cache of this process (configured on the first call, or again with refresh=True)
+        """
+        with cls.lock:
+            if cls.shared_cache == None or refresh:
+                if cls.shared_cache != None:
+                    cls.shared_cache.stop()
+                cls.shared_cache = cls(**kwargs)
+        return cls.shared_cache
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        conn = getattr(self.local, 'conn', None)
+        if conn == None or self.local.pid != os.getpid():
+            conn = sqlite3.connect(self.shared_path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.local.conn, self.local.pid = conn, os.getpid()
+        return conn
+
+    @staticmethod
+    def signature(path:str) -> Optional[tuple]:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def read_text(self, path:str) -> Optional[str]:
+        """
+        the json text of the path from the tiers or the file (None if there is none)
+        """
+        now = c.time()
+        text = self.dirty.get(path, None)
+        if text != None:
+            self.stats['hits'] += 1
+            return text
+        signature = self.signature(path)
+        if self.shared:
+            row = self.conn.execute('SELECT text, time FROM entries WHERE path = ?', (path,)).fetchone()
+            if row != None and (signature == None or row[1] > signature[0] / 1e9):
+                self.stats['shared_hits'] += 1
+                return row[0]
+        if signature == None:
+            self.stats['misses'] += 1
+            return None
+        with self.entries_lock:
+            entry = self.entries.get(path, None)
+            if entry != None and entry['signature'] == signature and now - entry['time'] < self.ttl:
+                self.entries.move_to_end(path)
+                self.stats['hits'] += 1
+                return entry['text']
+        self.stats['misses'] += 1
+        try:
+            with open(path) as f:
+                text = f.read()
+        except FileNotFoundError:
+            return None
+        # the file could have changed while it was read, then it is not cached
+        if self.signature(path) == signature:
+            self.set_entry(path, text, signature)
+        return text
+
+    def read_json(self, path:str, default:Any = None) -> Any:
+        text = self.read_text(path)
+        if text == None:
+            return default
+        return json.loads(text)
+
+    def write_json(self, path:str, data:Any) -> str:
+        from commune.utils.dict import json_dumps
+        return self.write_text(path, json_dumps(data))
+
+    def write_text(self, path:str, text:str) -> str:
+        self.stats['puts'] += 1
+        if self.policy == 'write_behind':
+            if self.shared:
+                self.conn.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?)', (path, text, c.time()))
+            self.dirty[path] = text
+            with self.entries_lock:
+                self.drop_entry(path)
+        else:
+            self.write_file(path, text)
+        return path
+
+    def write_file(self, path:str, text:str):
+        # the file is replaced at once, so a reader in another process never reads half of it
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+        self.set_entry(path, text, self.signature(path))
+        if self.shared:
+            # the file has it now
+            self.conn.execute('DELETE FROM entries WHERE path = ? AND text = ?', (path, text))
+
+    def set_entry(self, path:str, text:str, signature:tuple):
+        size = len(text)
+        with self.entries_lock:
+            self.drop_entry(path)
+            if size > self.max_bytes or signature == None:
+                return
+            self.entries[path] = {'signature': signature, 'text': text, 'time': c.time()}
+            self.nbytes += size
+            while self.nbytes > self.max_bytes or len(self.entries) > self.max_items:
+                _, entry = self.entries.popitem(last=False)
+                self.nbytes -= len(entry['text'])
+                self.stats['evictions'] += 1
+
+    def drop_entry(self, path:str):
+        entry = self.entries.pop(path, None)
+        if entry != None:
+            self.nbytes -= len(entry['text'])
+
+    def invalidate(self, path:str):
+        """
+        forgets the path (and the paths under it), a pending write behind is dropped
+        """
+        prefix = path.rstrip('/') + '/'
+        with self.flush_lock:
+            for dirty_path in [p for p in self.dirty if p == path or p.startswith(prefix)]:
+                self.dirty.pop(dirty_path, None)
+        with self.entries_lock:
+            for entry_path in [p for p in self.entries if p == path or p.startswith(prefix)]:
+                self.drop_entry(entry_path)
+        if self.shared:
+            self.conn.execute('DELETE FROM entries WHERE path = ? OR substr(path, 1, ?) = ?', (path, len(prefix), prefix))
+
+    @classmethod
+    def flush_path(cls, path:str) -> int:
+        """
+        flushes the pending writes under the path, for the callers that read the files directly
+        """
+        cache = cls.shared_cache
+        if cache == None or len(cache.dirty) == 0:
+            return 0
+        return cache.flush(path=path)
+
+    def flush(self, path:str = None) -> int:
+        """
+        writes the pending write behinds (under the path) to their files
+        """
+        prefix = path.rstrip('/') + '/' if path != None else None
+        with self.flush_lock:
+            paths = [p for p in self.dirty if prefix == None or p == path or p.startswith(prefix)]
+            for path in paths:
+                text = self.dirty.get(path, None)
+                if text == None:
+                    continue
+                self.write_file(path, text)
+                # unless it was put again while it was written
+                if self.dirty.get(path, None) is text:
+                    self.dirty.pop(path, None)
+            self.stats['flushes'] += 1
+        return len(paths)
+
+    def flush_loop(self):
+        while not self.stopped:
+            c.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                c.print(f'Failed to flush the storage cache: {e}', color='red')
+
+    def stop(self):
+        self.stopped = True
+        self.flush()
+
+    def metrics(self) -> dict:
+        stats = self.stats
+        n = stats['hits'] + stats['shared_hits'] + stats['misses']
+        return {**stats,
+                'policy': self.policy,
+                'shared': self.shared,
+                'entries': len(self.entries),
+                'bytes': self.nbytes,
+                'dirty': len(self.dirty),
+                'hit_rate': (stats['hits'] + stats['shared_hits']) / n if n > 0 else 0}
+
+    @classmethod
+    def test(cls, n:int = 1000) -> dict:
+        import multiprocessing
+        import shutil
+        root = cls.resolve_path('test_cache')
+        shutil.rmtree(root, ignore_errors=True)
+        path = f'{root}/item.json'
+        self = cls(max_bytes=10000, ttl=60)
+        try:
+            self.write_json(path, {'a': 1})
+            value = self.read_json(path)
+            assert value == {'a': 1} and self.stats['misses'] == 0 # written through, so already cached
+            value['a'] = 2 # the caller can mutate what it gets
+            assert self.read_json(path) == {'a': 1}
+            # a write from another process is seen
+            p = multiprocessing.get_context('fork').Process(target=lambda: cls(shared=False).write_json(path, {'a': 'other', 'pad': 'x' * 10}))
+            p.start(); p.join()
+            assert self.read_json(path)['a'] == 'other'
+            assert self.read_json(f'{root}/missing.json', default='default') == 'default'
+            # the lru is bounded by bytes
+            for i in range(20):
+                self.write_json(f'{root}/big{i}.json', 'x' * 1000)
+            assert self.nbytes <= self.max_bytes and self.stats['evictions'] > 0
+            self.invalidate(root)
+            assert len(self.entries) == 0
+            # write behind: the tiers have it before the file
+            behind = cls(policy='write_behind', flush_interval=3600, shared=True, shared_path=f'{root}/cache.db')
+            behind.write_json(path, {'behind': True})
+            assert behind.read_json(path) == {'behind': True} and json.loads(open(path).read())['a'] == 'other'
+            # another process sees it through the shared tier
+            reader = cls(shared=True, shared_path=f'{root}/cache.db')
+            assert reader.read_json(path) == {'behind': True} and reader.stats['shared_hits'] == 1
+            behind.flush()
+            assert json.loads(open(path).read()) == {'behind': True} and len(behind.dirty) == 0
+            assert reader.read_json(path) == {'behind': True}
+            behind.stop()
+            # the readers of the files see the pending writes of the cache of the process
+            cache = cls.instance(refresh=True, policy='write_behind', flush_interval=3600)
+            try:
+                c.put_json(f'{root}/pending/item.json', {'pending': True})
+                assert len(cache.dirty) == 1 and not os.path.exists(f'{root}/pending/item.json')
+                assert c.exists(f'{root}/pending/item.json') and c.ls(f'{root}/pending') == [f'{root}/pending/item.json']
+                assert len(cache.dirty) == 0
+            finally:
+                cls.instance(refresh=True)
+            # a warm get against a cold get through the file
+            t0 = c.time()
+            for i in range(n):
+                self.read_json(path)
+            cached_us = 1e6 * (c.time() - t0) / n
+            t0 = c.time()
+            for i in range(n):
+                c.get_json(path)
+            module_us = 1e6 * (c.time() - t0) / n
+            t0 = c.time()
+            for i in range(n):
+                with open(path) as f:
+                    json.loads(f.read())
+            file_us = 1e6 * (c.time() - t0) / n
+            return {'success': True, 'msg': 'storage cache test passed', 'cached_get_us': cached_us, 'file_get_us': file_us, 'module_get_json_us': module_us, **self.metrics()}
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
@@ -0,0 +1,251 @@
+import commune as c
+import os
+import json
+import zlib
+import msgpack
+import threading
+from typing import *
+
+
+class Archive(c.Module):
+    """
+    Snapshots of the chain state (state_dict) of a network
+
+    a full base is written every base_interval snapshots, the snapshots in between are compressed deltas
+    against the previous snapshot (the paths of the values that were set or deleted)
+        {path}/{network}/B{block}.base     zlib compressed msgpack of the state
+        {path}/{network}/B{block}.delta    zlib compressed msgpack of the delta ops
+        {path}/{network}/index.json        [{block, time, kind, file}] in block order
+    a block is rebuilt from its base and the deltas after it, without reading any other snapshot
+    """
+    def __init__(self,
+                 network:str = 'main',
+                 path:str = 'archive',
+                 base_interval:int = 100, # snapshots between full bases
+                 max_delta_ratio:float = 0.5, # write a base instead if the delta is larger than this ratio of the last base
+                 compression:int = 6):
+        self.network = network
+        self.dirpath = os.path.join(self.resolve_path(path), network)
+        os.makedirs(self.dirpath, exist_ok=True)
+        self.base_interval = base_interval
+        self.max_delta_ratio = max_delta_ratio
+        self.compression = compression
+        self.lock = threading.Lock()
+        self.index = self.load_index()
+        self.last_state = None # the state of the last snapshot, the next delta is against it
+
+    @property
+    def index_path(self) -> str:
+        return os.path.join(self.dirpath, 'index.json')
+
+    def load_index(self) -> List[dict]:
+        if not os.path.exists(self.index_path):
+            return []
+        with open(self.index_path) as f:
+            return json.load(f)
+
+    def write_index(self):
+        with open(self.index_path + '.tmp', 'w') as f:
+            json.dump(self.index, f)
+        os.replace(self.index_path + '.tmp', self.index_path)
+
+    def encode(self, obj) -> bytes:
+        return zlib.compress(msgpack.packb(obj, use_bin_type=True), self.compression)
+
+    def decode(self, data:bytes):
+        return msgpack.unpackb(zlib.decompress(data), strict_map_key=False)
+
+    def read(self, entry:dict):
+        with open(os.path.join(self.dirpath, entry['file']), 'rb') as f:
+            return self.decode(f.read())
+
+    def write(self, file:str, obj) -> int:
+        data = self.encode(obj)
+        with open(os.path.join(self.dirpath, file) + '.tmp', 'wb') as f:
+            f.write(data)
+        os.replace(os.path.join(self.dirpath, file) + '.tmp', os.path.join(self.dirpath, file))
+        return len(data)
+
+    @classmethod
+    def diff(cls, old, new, path:list = None) -> List[list]:
+        """
+        the ops that turn old into new: [set, path, value], [del, path] and [trunc, path, length]
+        """
+        path = path or []
+        if type(old) != type(new):
+            return [['set', path, new]]
+        if isinstance(new, dict):
+            ops = []
+            for k, v in new.items():
+                if k in old:
+                    ops += cls.diff(old[k], v, path + [k])
+                else:
+                    ops += [['set', path + [k], v]]
+            ops += [['del', path + [k]] for k in old if k not in new]
+            return ops
+        if isinstance(new, list):
+            ops = []
+            for i in range(min(len(old), len(new))):
+                ops += cls.diff(old[i], new[i], path + [i])
+            if len(new) > len(old):
+                ops += [['set', path + [i], new[i]] for i in range(len(old), len(new))]
+            elif len(new) < len(old):
+                ops += [['trunc', path, len(new)]]
+            return ops
+        return [] if old == new else [['set', path, new]]
+
+    @staticmethod
+    def apply(state, ops:List[list]):
+        """
+        applies the ops in place and returns the state
+        """
+        for op in ops:
+            kind, path = op[0], op[1]
+            if len(path) == 0:
+                state = op[2]
+                continue
+            parent = state
+            for k in path[:-1]:
+                parent = parent[k]
+            k = path[-1]
+            if kind == 'set':
+                if isinstance(parent, list) and k == len(parent):
+                    parent.append(op[2])
+                else:
+                    parent[k] = op[2]
+            elif kind == 'del':
+                del parent[k]
+            elif kind == 'trunc':
+                del parent[k][op[2]:]
+        return state
+
+    def save(self, state:dict, block:int = None, timestamp:float = None) -> dict:
+        """
+        saves the state as a base or as a delta against the last snapshot
+        """
+        block = block if block != None else state['block']
+        timestamp = timestamp or c.time()
+        # a copy with lists for tuples, so the next diff compares like with like
+        state = msgpack.unpackb(msgpack.packb(state, use_bin_type=True), strict_map_key=False)
+        with self.lock:
+            assert len(self.index) == 0 or block > self.index[-1]['block'], f'block {block} is not after the last snapshot'
+            if self.last_state == None and len(self.index) > 0:
+                self.last_state = self.load(block=self.index[-1]['block'])
+            bases = [e for e in self.index if e['kind'] == 'base']
+            since_base = len(self.index) - self.index.index(bases[-1]) if len(bases) > 0 else None
+            entry = None
+            if since_base != None and since_base < self.base_interval:
+                ops = self.diff(self.last_state, state)
+                file = f'B{block}.delta'
+                data = self.encode(ops)
+                if len(data) <= self.max_delta_ratio * bases[-1]['size']:
+                    self.write(file, ops)
+                    entry = {'block': block, 'time': timestamp, 'kind': 'delta', 'file': file, 'size': len(data), 'ops': len(ops)}
+            if entry == None:
+                file = f'B{block}.base'
+                size = self.write(file, state)
+                entry = {'block': block, 'time': timestamp, 'kind': 'base', 'file': file, 'size': size}
+            self.index.append(entry)
+            self.write_index()
+            self.last_state = state
+        return {'success': True, **entry}
+
+    def entries(self, start_block:int = None, end_block:int = None, start_time:float = None, end_time:float = None) -> List[dict]:
+        return [e for e in self.index
+                if (start_block == None or e['block'] >= start_block)
+                and (end_block == None or e['block'] <= end_block)
+                and (start_time == None or e['time'] >= start_time)
+                and (end_time == None or e['time'] <= end_time)]
+
+    def resolve_block(self, block:int = None, time:float = None) -> Optional[int]:
+        """
+        the block of the last snapshot at or before the block (or the time)
+        """
+        entries = self.entries(end_block=block, end_time=time)
+        return entries[-1]['block'] if len(entries) > 0 else None
+
+    def iter_states(self, blocks:List[int] = None) -> Iterator[Tuple[int, dict]]:
+        """
+        streams (block, state) for the snapshots of the blocks (all if None) in one pass over the index,
+        the state is updated in place between the yields (copy it to keep it)
+        """
+        blocks = sorted(set(blocks)) if blocks != None else [e['block'] for e in self.index]
+        if len(blocks) == 0:
+            return
+        wanted = set(blocks)
+        positions = [i for i, e in enumerate(self.index) if e['block'] <= blocks[0] and e['kind'] == 'base']
+        assert len(positions) > 0, f'no base before block {blocks[0]}'
+        state = None
+        for entry in self.index[positions[-1]:]:
+            if entry['block'] > blocks[-1]:
+                break
+            if entry['kind'] == 'base':
+                state = self.read(entry)
+            else:
+                state = self.apply(state, self.read(entry))
+            if entry['block'] in wanted:
+                yield entry['block'], state
+
+    def load(self, block:int = None, time:float = None) -> Optional[dict]:
+        """
+        the state of the last snapshot at or before the block (or the time), the latest if neither is given
+        """
+        block = self.resolve_block(block=block, time=time)
+        if block == None:
+            return None
+        for _, state in self.iter_states([block]):
+            return state
+
+    def import_json(self, paths:List[str]) -> dict:
+        """
+        imports the json state dicts of older versions (in block order)
+        """
+        n = 0
+        for path in sorted(paths, key=lambda p: int(p.split('block-')[-1].split('-time')[0])):
+            state = c.get_json(path)
+            if not isinstance(state, dict) or 'block' not in state:
+                continue
+            if len(self.index) > 0 and state['block'] <= self.index[-1]['block']:
+                continue
+            timestamp = int(path.split('time-')[-1].split('.json')[0]) if 'time-' in path else None
+            self.save(state, timestamp=timestamp)
+            n += 1
+        return {'success': True, 'imported': n}
+
+    def size(self) -> dict:
+        sizes = {'base': 0, 'delta': 0}
+        for e in self.index:
+            sizes[e['kind']] += e['size']
+        return sizes
+
+    @classmethod
+    def test(cls, n:int = 50, n_modules:int = 1000, network:str = 'test_archive'):
+        cls.rm(f'archive/{network}')
+        self = cls(network=network, base_interval=20)
+        state = {'block': 0,
+                 'balances': {f'key{i}': 10**12 for i in range(n_modules)},
+                 'subnets': [{'name': 'commune', 'tempo': 100}],
+                 'modules': [[{'key': f'key{i}', 'name': f'module{i}', 'stake_from': [[f'key{i}', 10**9]]} for i in range(n_modules)]]}
+        states = {}
+        for block in range(1, n + 1):
+            state = msgpack.unpackb(msgpack.packb(state), strict_map_key=False)
+            state['block'] = block
+            state['balances'][f'key{block}'] += block
+            state['modules'][0][block]['stake_from'].append([f'key{block + 1}', block])
+            if block % 10 == 0:
+                state['modules'][0].pop() # deregistered
+            states[block] = state
+            self.save(state, timestamp=1000 + block)
+        sizes = self.size()
+        full = len(self.encode(state))
+        assert [e['kind'] for e in self.index].count('base') == -(-n // 20), self.index
+        assert self.load(block=37) == states[37]
+        assert self.load() == states[n]
+        assert self.load(time=1000 + 12.5) == states[12]
+        blocks = [5, 25, 45]
+        assert [s == states[b] for b, s in self.iter_states(blocks)] == [True] * len(blocks)
+        reloaded = cls(network=network, base_interval=20)
+        reloaded.save({**states[n], 'block': n + 1})
+        assert reloaded.index[-1]['kind'] == 'delta' and reloaded.load()['block'] == n + 1
+        cls.rm(f'archive/{network}')
+        return {'success': True, 'msg': 'archive test passed', 'stored_bytes': sizes, 'full_snapshots_bytes': full * n}
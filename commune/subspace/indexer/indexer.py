@@ -0,0 +1,344 @@
+import commune as c
+import threading
+from typing import *
+
+
+class StandInChain:
+    """
+    a chain for tests that serves the maps of a dict ({name: {netuid: map}}) at a settable block
+    """
+    def __init__(self, maps:dict):
+        self.maps = maps
+        self.block = 0
+        self.queries = 0
+
+    def query_map(self, name:str, network:str = 'main', update:bool = False, **kwargs) -> dict:
+        self.queries += 1
+        return self.maps.get(name, {})
+
+
+class IndexerClient:
+    """
+    the cached client of a served indexer, a failed call drops it from the cache so the next connect probes again
+    """
+    def __init__(self, client, forget:Callable):
+        self.client = client
+        self.forget = forget
+
+    def __getattr__(self, name:str):
+        def call(*args, **kwargs):
+            try:
+                result = getattr(self.client, name)(*args, **kwargs)
+            except Exception as e:
+                self.forget()
+                raise e
+            if isinstance(result, dict) and result.get('success', True) == False and 'error' in result:
+                self.forget()
+            return result
+        return call
+
+
+class Indexer(c.Module):
+    """
+    Background chain indexer that answers stake, weight and key lookups from memory
+
+    a thread follows the chain head and on every new block rebuilds the indexes of every subnet
+        key2uid / uid2key        the registered keys
+        name2key / key2name      the module names
+        stake_from               module key -> {staker: stake}   (module -> stakers)
+        stake_to                 staker -> {module key: stake}   (staker -> stake)
+        stake                    module key -> total stake
+        weights                  uid -> [[uid, weight]]
+    the maps come from Subspace.query_map, which only decodes the pairs that changed since the last block,
+    the new indexes are swapped in at once so a lookup never sees a partial block.
+    serve it once per host (c.serve('subspace.indexer')) and connect with Indexer.connect(network),
+    the stake and key helpers of Subspace (and the syncs of Access and Vali) answer from it and fall back to the chain without it
+    """
+    indexer_name = 'subspace.indexer'
+    network2client = {} # (network, name) -> (client or None, probe time), shared by the callers of connect
+    whitelist = ['key2uid',
+                 'uid2key',
+                 'name2key',
+                 'key2name',
+                 'stake',
+                 'stakes',
+                 'stake_from',
+                 'stake_to',
+                 'my_stake_from',
+                 'weights',
+                 'netuids',
+                 'info',
+                 'metrics']
+
+    def __init__(self,
+                 network:str = 'main',
+                 sync_interval:float = 4, # seconds between polls of the chain head
+                 weights:bool = True, # index the weights (the largest map)
+                 background:bool = True, # follow the chain in a background thread
+                 subspace = None, # the chain to index (a Subspace of the network if None)
+                 ):
+        self.network = network
+        self.sync_interval = sync_interval
+        self.index_weights = weights
+        self.subspace = subspace if subspace != None else c.module('subspace')(network=network)
+        self.sync_lock = threading.Lock()
+        self.index = self.build({})
+        self.block_number = None
+        self.sync_time = 0
+        self.stats = {'syncs': 0, 'failures': 0, 'sync_seconds': 0, 'lookups': 0}
+        self.stopped = False
+        if background:
+            c.thread(self.sync_loop)
+
+    @classmethod
+    def client(cls, network:str = 'local', name:str = None):
+        """
+        a client of the served indexer, None if it is not served on the network
+        """
+        name = name or cls.indexer_name
+        if not c.server_exists(name, network=network):
+            return None
+        return c.connect(name, network=network)
+
+    @classmethod
+    def connect(cls, network:str = 'main', name:str = None, ttl:float = 30, update:bool = False):
+        """
+        the client of the served indexer if it indexes the chain network, None otherwise (the caller queries the chain),
+        the result is cached for ttl seconds and probed again sooner if a call of the client fails
+        """
+        cache_key = (network, name or cls.indexer_name)
+        indexer, probe_time = cls.network2client.get(cache_key, (None, 0))
+        if not update and c.time() - probe_time < ttl:
+            return indexer
+        indexer = None
+        try:
+            client = cls.client(name=name)
+            if client != None and client.info().get('network', None) == network:
+                indexer = IndexerClient(client, forget=lambda: cls.network2client.pop(cache_key, None))
+        except Exception as e:
+            c.print(f'Failed to connect to the indexer: {e}', color='red')
+        cls.network2client[cache_key] = (indexer, c.time())
+        return indexer
+
+    def sync_loop(self):
+        while not self.stopped:
+            try:
+                self.sync()
+            except Exception as e:
+                self.stats['failures'] += 1
+                c.print(f'Failed to index {self.network}: {e}', color='red')
+            c.sleep(self.sync_interval)
+
+    def sync(self, update:bool = False) -> dict:
+        """
+        rebuilds the indexes if there is a new block
+        """
+        with self.sync_lock:
+            block = self.subspace.block
+            if block == self.block_number and not update:
+                return {'success': True, 'block': block, 'synced': False}
+            t0 = c.time()
+            names = ['Keys', 'Name', 'StakeFrom'] + (['Weights'] if self.index_weights else [])
+            maps = {name: self.subspace.query_map(name, network=self.network, update=True) for name in names}
+            self.index = self.build(maps)
+            self.block_number = block
+            self.sync_time = c.time()
+            self.stats['syncs'] += 1
+            self.stats['sync_seconds'] = self.sync_time - t0
+        return {'success': True, 'block': block, 'synced': True, 'seconds': self.stats['sync_seconds']}
+
+    @staticmethod
+    def build(maps:dict) -> dict:
+        """
+        the indexes of every subnet from the maps ({name: {netuid: map}})
+        """
+        index = {}
+        for netuid, uid2key in maps.get('Keys', {}).items():
+            uid2name = maps.get('Name', {}).get(netuid, {})
+            key2stakers = maps.get('StakeFrom', {}).get(netuid, {})
+            subnet = index[int(netuid)] = {
+                'uid2key': dict(uid2key),
+                'key2uid': {key: uid for uid, key in uid2key.items()},
+                'name2key': {uid2name[uid]: key for uid, key in uid2key.items() if uid in uid2name},
+                'key2name': {key: uid2name[uid] for uid, key in uid2key.items() if uid in uid2name},
+                'stake_from': {},
+                'stake_to': {},
+                'stake': {},
+                'weights': maps.get('Weights', {}).get(netuid, {}),
+            }
+            stake_from, stake_to, stake = subnet['stake_from'], subnet['stake_to'], subnet['stake']
+            for key, stakers in key2stakers.items():
+                stake_from[key] = dict(stakers)
+                stake[key] = sum(stake_from[key].values())
+                for staker, amount in stakers:
+                    stake_to.setdefault(staker, {})[key] = amount
+        return index
+
+    @staticmethod
+    def format_amount(x, fmt:str = 'j'):
+        if fmt in ['token', 'unit', 'j', 'J']:
+            x = x / 10**9
+        return x
+
+    def subnet(self, netuid:int = 0) -> dict:
+        self.stats['lookups'] += 1
+        return self.index.get(int(netuid or 0), {})
+
+    def netuids(self) -> List[int]:
+        return sorted(self.index.keys())
+
+    def key2uid(self, key:str = None, netuid:int = 0):
+        key2uid = self.subnet(netuid).get('key2uid', {})
+        return key2uid.get(key, None) if key != None else key2uid
+
+    def uid2key(self, uid:int = None, netuid:int = 0):
+        uid2key = self.subnet(netuid).get('uid2key', {})
+        return uid2key.get(int(uid), None) if uid != None else uid2key
+
+    def name2key(self, name:str = None, netuid:int = 0):
+        name2key = self.subnet(netuid).get('name2key', {})
+        return name2key.get(name, None) if name != None else name2key
+
+    def key2name(self, key:str = None, netuid:int = 0):
+        key2name = self.subnet(netuid).get('key2name', {})
+        return key2name.get(key, None) if key != None else key2name
+
+    def stake(self, key:str, netuid:int = 0, fmt:str = 'j') -> float:
+        """
+        the total stake of the module of the key
+        """
+        return self.format_amount(self.subnet(netuid).get('stake', {}).get(key, 0), fmt=fmt)
+
+    def stakes(self, netuid:int = 0, fmt:str = 'j') -> Dict[str, float]:
+        return {k: self.format_amount(v, fmt=fmt) for k, v in self.subnet(netuid).get('stake', {}).items()}
+
+    def stake_from(self, key:str = None, netuid:int = 0, fmt:str = 'j') -> Dict[str, float]:
+        """
+        the stakers of the module of the key {staker: stake}, of every module {key: {staker: stake}} if key is None
+        """
+        stake_from = self.subnet(netuid).get('stake_from', {})
+        if key == None:
+            return {key: {k: self.format_amount(v, fmt=fmt) for k, v in stakers.items()} for key, stakers in stake_from.items()}
+        return {k: self.format_amount(v, fmt=fmt) for k, v in stake_from.get(key, {}).items()}
+
+    def stake_to(self, key:str = None, netuid:int = 0, fmt:str = 'j') -> Dict[str, float]:
+        """
+        the modules the key stakes to {module key: stake}, of every staker {staker: {module key: stake}} if key is None
+        """
+        stake_to = self.subnet(netuid).get('stake_to', {})
+        if key == None:
+            return {key: {k: self.format_amount(v, fmt=fmt) for k, v in modules.items()} for key, modules in stake_to.items()}
+        return {k: self.format_amount(v, fmt=fmt) for k, v in stake_to.get(key, {}).items()}
+
+    def my_stake_from(self, keys:List[str], netuid:int = 0, fmt:str = 'j') -> Dict[str, float]:
+        """
+        the total stake of every staker over the modules of the keys (the keys of a host)
+        """
+        stake_from = self.subnet(netuid).get('stake_from', {})
+        total = {}
+        for key in keys:
+            for staker, amount in stake_from.get(key, {}).items():
+                total[staker] = total.get(staker, 0) + amount
+        return {k: self.format_amount(v, fmt=fmt) for k, v in total.items()}
+
+    def weights(self, key:str = None, uid:int = None, netuid:int = 0) -> list:
+        """
+        the weights [[uid, weight]] that the module (by key or uid) has set
+        """
+        subnet = self.subnet(netuid)
+        if uid == None:
+            uid = subnet.get('key2uid', {}).get(key, None)
+        return subnet.get('weights', {}).get(uid, [])
+
+    def info(self) -> dict:
+        return {'network': self.network,
+                'block': self.block_number,
+                'sync_time': self.sync_time,
+                'netuids': self.netuids(),
+                'modules': {netuid: len(subnet['key2uid']) for netuid, subnet in self.index.items()}}
+
+    def metrics(self) -> dict:
+        return {**self.stats, 'block': self.block_number, 'staleness': c.time() - self.sync_time}
+
+    def stop(self):
+        self.stopped = True
+
+    @classmethod
+    def test(cls, n:int = 10000, n_lookups:int = 100000):
+        keys = [f'key{i}' for i in range(n)]
+        maps = {'Keys': {0: {i: k for i, k in enumerate(keys)}},
+                'Name': {0: {i: f'module{i}' for i in range(n)}},
+                'StakeFrom': {0: {k: [[k, 10**9], ['whale', i * 10**9]] for i, k in enumerate(keys)}},
+                'Weights': {0: {0: [[1, 10], [2, 20]]}}}
+        chain = StandInChain(maps)
+        self = cls(subspace=chain, background=False)
+        assert self.sync()['synced'] and not self.sync()['synced'] # nothing new at the same block
+        assert self.key2uid('key7') == 7 and self.uid2key(7) == 'key7'
+        assert self.name2key('module7') == 'key7' and self.key2name('key7') == 'module7'
+        assert self.stake('key7') == 8 and self.stake_from('key7') == {'key7': 1, 'whale': 7}
+        assert self.stake_to('whale')['key9'] == 9 and len(self.stake_to('whale')) == n
+        assert self.stake_from()['key7'] == {'key7': 1, 'whale': 7} and len(self.stake_to()) == n + 1
+        assert self.my_stake_from(['key1', 'key2']) == {'key1': 1, 'key2': 1, 'whale': 3}
+        assert self.weights(key='key0') == [[1, 10], [2, 20]]
+        t0 = c.time()
+        for i in range(n_lookups):
+            self.key2uid(keys[i % n])
+        lookup_us = 1e6 * (c.time() - t0) / n_lookups
+        # a new block swaps in the new indexes
+        chain.maps = {**maps, 'StakeFrom': {0: {'key7': [['whale', 10**9]]}}}
+        chain.block += 1
+        assert self.sync()['synced'] and self.stake('key7') == 1 and self.stake('key8') == 0
+        return {'success': True, 'msg': 'indexer test passed', 'lookup_us': lookup_us, 'sync_seconds': self.stats['sync_seconds']}
+
+    @classmethod
+    def test_subspace_helpers(cls, n:int = 4):
+        """
+        the stake and key helpers of Subspace answer from the indexer (here in this process instead of served)
+        """
+        keys = [c.module('key').gen().ss58_address for i in range(n)]
+        maps = {'Keys': {0: {i: k for i, k in enumerate(keys)}},
+                'Name': {0: {i: f'module{i}' for i in range(n)}},
+                'StakeFrom': {0: {k: [[keys[0], (i + 1) * 10**9]] for i, k in enumerate(keys)}}}
+        self = cls(subspace=StandInChain(maps), background=False)
+        self.sync()
+        subspace = c.module('subspace')()
+        subspace.indexer = lambda network=None, block=None: self if block == None else None
+        assert subspace.uid2key() == {i: k for i, k in enumerate(keys)} and subspace.key2uid(keys[2]) == 2
+        assert subspace.name2key('module1') == keys[1] and subspace.key2name()[keys[3]] == 'module3'
+        assert subspace.get_stake(keys[2]) == 3 and subspace.stakes(fmt='j')[keys[1]] == 2
+        assert subspace.get_stake_from(keys[1]) == [(keys[0], 2)]
+        assert subspace.get_stake_to(keys[0]) == {k: i + 1 for i, k in enumerate(keys)}
+        assert subspace.stake_from(fmt='j')[keys[3]] == [[keys[0], 4]]
+        assert subspace.stake_to(fmt='j')[keys[0]] == [[k, i + 1] for i, k in enumerate(keys)]
+        assert isinstance(subspace.my_stake_from(), dict)
+        return {'success': True, 'msg': 'the subspace helpers answer from the indexer'}
+
+    @classmethod
+    def test_connect(cls, n:int = 10) -> dict:
+        """
+        connect probes the served indexer once per ttl and again after a failed call
+        """
+        probes = []
+        class StandInClient:
+            failing = False
+            def info(self):
+                probes.append(c.time())
+                return {'network': 'test'}
+            def stake(self, key:str):
+                return {'success': False, 'error': 'indexer is gone'} if self.failing else 1
+        stand_in = StandInClient()
+        client = cls.__dict__['client']
+        cls.client = classmethod(lambda cls, network='local', name=None: stand_in)
+        try:
+            cls.network2client.pop(('test', cls.indexer_name), None)
+            assert all(cls.connect(network='test').stake('key') == 1 for i in range(n))
+            assert len(probes) == 1, probes
+            stand_in.failing = True
+            assert 'error' in cls.connect(network='test').stake('key')
+            stand_in.failing = False
+            assert cls.connect(network='test').stake('key') == 1 and len(probes) == 2, probes
+            assert cls.connect(network='test', ttl=0) != None and len(probes) == 3, probes
+        finally:
+            cls.client = client
+            cls.network2client.pop(('test', cls.indexer_name), None)
+        return {'success': True, 'msg': 'the indexer client is cached', 'probes': len(probes)}
@@ -0,0 +1,331 @@
+import commune as c
+import json
+import threading
+import itertools
+import contextlib
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import *
+
+
+class MockNode:
+    """
+    a json-rpc node for tests that records its requests,
+    it answers system_health, the calls that SubstrateInterface needs to start
+    and echoes the method and params of every other call
+    """
+    def __init__(self, port:int = None):
+        self.port = port or c.free_port()
+        self.url = f'http://127.0.0.1:{self.port}'
+        self.requests = 0 # http requests
+        self.calls = {} # method -> number of calls
+        self.lock = threading.Lock()
+        node = self
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                with node.lock:
+                    node.requests += 1
+                response = [node.respond(r) for r in body] if isinstance(body, list) else node.respond(body)
+                data = json.dumps(response).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+            def log_message(self, *args):
+                pass
+        self.server = ThreadingHTTPServer(('127.0.0.1', self.port), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def respond(self, request:dict) -> dict:
+        method = request['method']
+        with self.lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+        results = {'system_health': {'peers': 1, 'isSyncing': False, 'shouldHavePeers': True},
+                   'system_chain': 'Development',
+                   'system_properties': {'ss58Format': 42, 'tokenDecimals': 9}}
+        result = results.get(method, {'method': method, 'params': request.get('params', [])})
+        return {'jsonrpc': '2.0', 'id': request.get('id'), 'result': result}
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+class PooledSubstrate:
+    """
+    a substrate interface whose calls each check a connection out of the pool and back in,
+    so no thread holds a connection between its calls
+    """
+    def __init__(self, pool:'SubstratePool'):
+        self.pool = pool
+
+    def __getattr__(self, name:str):
+        from substrateinterface import SubstrateInterface
+        if not callable(getattr(SubstrateInterface, name, None)):
+            with self.pool.connection() as connection:
+                return getattr(connection, name)
+        def call(*args, **kwargs):
+            with self.pool.connection() as connection:
+                return getattr(connection, name)(*args, **kwargs)
+        return call
+
+
+class SubstratePool(c.Module):
+    """
+    Thread-safe pool of substrate connections over a list of endpoints
+
+    - connections are checked out round robin across the endpoints, at most max_connections per endpoint
+    - idle connections are health checked (system_health) before reuse, a failing endpoint is skipped for cooldown seconds
+    - a connection is only dropped on a transport error, when every endpoint is down the connects back off
+    - connection() checks a connection out for a block of calls, get() returns an interface that checks one out per call
+    - batch() sends many json-rpc calls in one request
+    """
+    def __init__(self,
+                 urls:Union[str, List[str]],
+                 max_connections:int = 8, # per endpoint
+                 health_interval:float = 30, # seconds a connection can idle before it is health checked
+                 cooldown:float = 30, # seconds a failing endpoint is skipped
+                 timeout:float = 30, # seconds to wait for a free connection
+                 max_backoff:float = 2, # max seconds between the connects while every endpoint is down
+                 **substrate_kwargs):
+        self.urls = [urls] if isinstance(urls, str) else list(urls)
+        assert len(self.urls) > 0, 'the pool needs at least one url'
+        self.max_connections = max_connections
+        self.health_interval = health_interval
+        self.cooldown = cooldown
+        self.timeout = timeout
+        self.max_backoff = max_backoff
+        self.substrate_kwargs = substrate_kwargs
+        self.url2idle = {url: [] for url in self.urls} # url -> [(connection, last used)]
+        self.url2count = {url: 0 for url in self.urls} # url -> open connections
+        self.url2down = {url: 0 for url in self.urls} # url -> time until which it is skipped
+        self.cursor = itertools.count()
+        self.condition = threading.Condition()
+        self.substrate = PooledSubstrate(self)
+        self.stats = {'connections': 0,
+                      'checkouts': 0,
+                      'waits': 0,
+                      'health_checks': 0,
+                      'failures': 0,
+                      'batches': 0,
+                      'batched_calls': 0}
+
+    def connect(self, url:str) -> 'SubstrateInterface':
+        from substrateinterface import SubstrateInterface
+        return SubstrateInterface(url=url, **self.substrate_kwargs)
+
+    def healthy(self, connection) -> bool:
+        self.stats['health_checks'] += 1
+        try:
+            return 'error' not in connection.rpc_request('system_health', [])
+        except Exception as e:
+            return False
+
+    @staticmethod
+    def is_transport_error(e:Exception) -> bool:
+        """
+        whether the error comes from the connection (socket, http or websocket) and not from the call
+        """
+        transport_errors = (OSError,) # socket errors, timeouts and the requests errors
+        try:
+            import websocket
+            transport_errors += (websocket.WebSocketException,)
+        except ImportError:
+            pass
+        return isinstance(e, transport_errors)
+
+    def next_urls(self) -> List[str]:
+        """
+        the endpoints in round robin order, the ones that are down last
+        """
+        start = next(self.cursor) % len(self.urls)
+        urls = self.urls[start:] + self.urls[:start]
+        now = c.time()
+        return sorted(urls, key=lambda url: self.url2down[url] > now)
+
+    def checkout(self) -> Tuple[str, 'SubstrateInterface']:
+        t0 = c.time()
+        backoff = 0.1
+        while True:
+            url, connection, last_used = None, None, None
+            with self.condition:
+                for _url in self.next_urls():
+                    if len(self.url2idle[_url]) > 0:
+                        url = _url
+                        connection, last_used = self.url2idle[_url].pop()
+                        break
+                    if self.url2count[_url] < self.max_connections:
+                        url = _url
+                        self.url2count[_url] += 1
+                        break
+                if url == None:
+                    remaining = self.timeout - (c.time() - t0)
+                    if remaining <= 0:
+                        raise TimeoutError(f'No free connection to {self.urls} within {self.timeout}s')
+                    self.stats['waits'] += 1
+                    self.condition.wait(timeout=remaining)
+                    continue
+            if connection != None and c.time() - last_used > self.health_interval and not self.healthy(connection):
+                self.discard(url, connection)
+                continue
+            if connection == None:
+                try:
+                    connection = self.connect(url)
+                    self.stats['connections'] += 1
+                except Exception as e:
+                    self.discard(url)
+                    remaining = self.timeout - (c.time() - t0)
+                    if remaining <= 0:
+                        raise e
+                    if all(self.url2down[_url] > c.time() for _url in self.urls):
+                        # every endpoint is down, wait before connecting again
+                        c.sleep(min(backoff, remaining))
+                        backoff = min(2 * backoff, self.max_backoff)
+                    continue
+            self.stats['checkouts'] += 1
+            return url, connection
+
+    def checkin(self, url:str, connection):
+        with self.condition:
+            self.url2idle[url].append((connection, c.time()))
+            self.condition.notify()
+
+    def discard(self, url:str, connection = None):
+        """
+        drops the connection and skips the endpoint for cooldown seconds
+        """
+        self.stats['failures'] += 1
+        if connection != None:
+            try:
+                connection.close()
+            except Exception as e:
+                pass
+        with self.condition:
+            self.url2count[url] -= 1
+            self.url2down[url] = c.time() + self.cooldown
+            self.condition.notify()
+
+    @contextlib.contextmanager
+    def connection(self):
+        url, connection = self.checkout()
+        try:
+            yield connection
+        except Exception as e:
+            # an error of the call (or of the caller) leaves the connection healthy
+            if self.is_transport_error(e):
+                self.discard(url, connection)
+            else:
+                self.checkin(url, connection)
+            raise e
+        else:
+            self.checkin(url, connection)
+
+    def get(self) -> PooledSubstrate:
+        """
+        the substrate interface of the pool, every call checks a connection out and back in
+        (use connection() for calls that need the same connection)
+        """
+        return self.substrate
+
+    def rpc_request(self, method:str, params:list = None) -> dict:
+        with self.connection() as connection:
+            return connection.rpc_request(method, params or [])
+
+    def batch(self, calls:List[Tuple[str, list]], connection = None) -> List[dict]:
+        """
+        sends the (method, params) calls as one json-rpc batch and returns the responses in order,
+        over the given connection (one that is already checked out) or one checked out for the batch
+        """
+        if len(calls) == 0:
+            return []
+        if connection == None:
+            with self.connection() as connection:
+                return self.batch(calls, connection=connection)
+        payload = [{'jsonrpc': '2.0', 'id': i, 'method': method, 'params': params} for i, (method, params) in enumerate(calls)]
+        if connection.websocket != None:
+            connection.websocket.send(json.dumps(payload))
+            responses = json.loads(connection.websocket.recv())
+        else:
+            transport = connection.transport
+            response = transport.session.post(connection.url, data=json.dumps(payload), headers=transport.headers)
+            assert response.status_code == 200, f'Batch request failed with status {response.status_code}'
+            responses = response.json()
+        self.stats['batches'] += 1
+        self.stats['batched_calls'] += len(calls)
+        id2response = {r.get('id'): r for r in responses}
+        return [id2response.get(i, {'error': f'no response for {calls[i][0]}'}) for i in range(len(calls))]
+
+    def metrics(self) -> dict:
+        with self.condition:
+            return {**self.stats,
+                    'open': dict(self.url2count),
+                    'idle': {url: len(idle) for url, idle in self.url2idle.items()},
+                    'down': [url for url, t in self.url2down.items() if t > c.time()]}
+
+    @classmethod
+    def test(cls, n_threads:int = 16, n_calls:int = 20):
+        nodes = [MockNode(), MockNode()]
+        try:
+            self = cls(urls=[node.url for node in nodes], max_connections=2, health_interval=0, timeout=10, auto_discover=False)
+            def worker():
+                for i in range(n_calls):
+                    assert self.rpc_request('state_getStorage', [i])['result']['params'] == [i]
+            futures = [c.submit(worker) for _ in range(n_threads)]
+            c.wait(futures, timeout=30)
+            metrics = self.metrics()
+            assert all(n <= 2 for n in metrics['open'].values()), metrics
+            assert metrics['connections'] <= 4, metrics
+            # round robin: both endpoints serve the calls
+            calls = [node.calls.get('state_getStorage', 0) for node in nodes]
+            assert sum(calls) == n_threads * n_calls and min(calls) > 0, calls
+            # get() holds no connection between calls, so long lived threads do not drain the pool
+            substrate = self.get()
+            def caller():
+                for i in range(n_calls):
+                    assert substrate.rpc_request('state_getStorage', [i])['result']['params'] == [i]
+                return True
+            executor = c.module('executor.thread')(max_workers=n_threads)
+            futures = [executor.submit(caller, timeout=30) for _ in range(n_threads)]
+            assert c.wait(futures, timeout=30) == [True] * n_threads
+            assert sum(self.metrics()['idle'].values()) == sum(self.metrics()['open'].values()) # all checked in
+            # a batch is one http request
+            self.health_interval = 30
+            requests = sum(node.requests for node in nodes)
+            responses = self.batch([('state_getStorage', [i]) for i in range(100)])
+            assert [r['result']['params'] for r in responses] == [[i] for i in range(100)]
+            assert sum(node.requests for node in nodes) == requests + 1
+            # a dead endpoint is skipped
+            nodes[0].stop()
+            self.health_interval = 0
+            for i in range(10):
+                assert self.rpc_request('state_getStorage', [i])['result']['params'] == [i]
+            assert nodes[0].url in self.metrics()['down']
+            # an error of the caller checks the connection back in
+            failures = self.stats['failures']
+            try:
+                with self.connection() as connection:
+                    raise ValueError('not a transport error')
+            except ValueError:
+                pass
+            assert self.stats['failures'] == failures and sum(self.metrics()['idle'].values()) == sum(self.metrics()['open'].values())
+            # the connects back off while every endpoint is down
+            dead = cls(urls=[nodes[0].url], timeout=1, max_backoff=0.5)
+            attempts = []
+            def connect(url):
+                attempts.append(url)
+                raise ConnectionError(f'{url} is down')
+            dead.connect = connect
+            try:
+                dead.rpc_request('system_health')
+                raise AssertionError('the dead pool did not time out')
+            except ConnectionError:
+                pass
+            assert 2 <= len(attempts) <= 6, len(attempts)
+            return {'success': True, 'msg': 'pool test passed', 'calls': calls, **self.metrics()}
+        finally:
+            for node in nodes:
+                try:
+                    node.stop()
+                except Exception as e:
+                    pass
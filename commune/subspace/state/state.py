@@ -0,0 +1,427 @@
+import commune as c
+import os
+import json
+import hashlib
+import threading
+import msgpack
+from typing import *
+
+
+class StandInStorageFunction:
+    """
+    the metadata of a storage function (its hashers and types), like the one of the runtime metadata
+    """
+    def __init__(self, name:str, hashers:List[str], param_types:List[str], value_type:str):
+        self.value = {'name': name}
+        self.hashers = hashers
+        self.param_types = param_types
+        self.value_type = value_type
+
+    def get_param_hashers(self) -> List[str]:
+        return self.hashers
+
+    def get_params_type_string(self) -> List[str]:
+        return self.param_types
+
+    def get_value_type_string(self) -> str:
+        return self.value_type
+
+
+class StandInPallet:
+    def __init__(self, name:str, functions:Dict[str, StandInStorageFunction]):
+        self.value = {'name': name, 'storage': {'prefix': name}}
+        self.functions = functions
+
+    def get_storage_function(self, name:str) -> Optional[StandInStorageFunction]:
+        return self.functions.get(name, None)
+
+
+class StandInNode:
+    """
+    a node that serves a storage dict of scale encoded keys and values for tests,
+    with the parts of the runtime metadata the chain state reads (the hashers and types of the storage functions)
+        functions : {module: {name: {'hashers': [...], 'params': [type, ...], 'value': type}}}
+    """
+    def __init__(self, functions:dict):
+        from scalecodec.base import RuntimeConfigurationObject
+        from scalecodec.type_registry import load_type_registry_preset
+        self.functions = functions
+        self.runtime_config = RuntimeConfigurationObject(ss58_format=42)
+        self.runtime_config.update_type_registry(load_type_registry_preset('legacy'))
+        self.metadata = self
+        self.storage = {}
+        self.block = 0
+        self.requests = 0
+
+    def get_metadata_pallet(self, module:str) -> Optional[StandInPallet]:
+        if module not in self.functions:
+            return None
+        return StandInPallet(module, {name: StandInStorageFunction(name, f['hashers'], f['params'], f['value'])
+                                      for name, f in self.functions[module].items()})
+
+    def init_runtime(self, block_hash:str = None):
+        pass
+
+    def encode(self, type_string:str, value) -> bytes:
+        return bytes(self.runtime_config.create_scale_object(type_string).encode(value).data)
+
+    def decode_scale(self, type_string:str, scale_bytes:str, block_hash:str = None):
+        from scalecodec.base import ScaleBytes
+        obj = self.runtime_config.create_scale_object(type_string=type_string, data=ScaleBytes(scale_bytes))
+        obj.decode()
+        return obj.value
+
+    def storage_key(self, module:str, name:str, params:list) -> str:
+        """
+        twox128(pallet) + twox128(name) + the hashed scale encoding of every param, the key layout of a substrate node
+        """
+        from substrateinterface.utils.hasher import xxh128, blake2_128_concat, two_x64_concat, identity
+        hashers = {'Blake2_128Concat': blake2_128_concat, 'Twox64Concat': two_x64_concat, 'Identity': identity}
+        f = self.functions[module][name]
+        key = bytes(xxh128(module.encode())) + bytes(xxh128(name.encode()))
+        for hasher, type_string, param in zip(f['hashers'], f['params'], params):
+            key += bytes(hashers[hasher](self.encode(type_string, param)))
+        return '0x' + key.hex()
+
+    def put(self, module:str, name:str, params:list, value):
+        self.storage[self.storage_key(module, name, params)] = '0x' + self.encode(self.functions[module][name]['value'], value).hex()
+
+    def remove(self, module:str, name:str, params:list):
+        self.storage.pop(self.storage_key(module, name, params))
+
+    def get_chain_head(self):
+        return f'0x{self.block:064x}'
+
+    def rpc_request(self, method:str, params:list):
+        self.requests += 1
+        return self.respond(method, params)
+
+    def batch(self, calls:List[Tuple[str, list]]) -> List[dict]:
+        self.requests += 1
+        return [self.respond(method, params) for method, params in calls]
+
+    def respond(self, method:str, params:list) -> dict:
+        if method == 'state_getKeysPaged':
+            prefix, count, start_key, block_hash = params
+            keys = sorted(k for k in self.storage if k.startswith(prefix) and k > start_key)
+            return {'result': keys[:count]}
+        if method == 'state_queryStorageAt':
+            keys, block_hash = params
+            return {'result': [{'block': block_hash, 'changes': [[k, self.storage.get(k)] for k in keys]}]}
+        raise ValueError(f'Unknown method {method}')
+
+
+class ChainState(c.Module):
+    """
+    Local cache of chain storage, versioned by block hash
+
+    every storage item (module, name, params) of a network is kept as
+        the block hash it was synced at
+        the raw keys under its storage prefix, each with its decoded params and a digest of its raw value
+        the decoded value
+    refreshing at a new block fetches the raw pairs and only decodes the pairs whose digest changed (key prefix diffing),
+    the values of the unchanged pairs are taken from the synced value. refreshing at the synced block is free.
+    entries are persisted as msgpack files (unless save=False), streamed from disk when they are loaded
+    """
+    path2store = {} # one store per path per process
+
+    def __init__(self,
+                 path:str = 'chain_state',
+                 page_size:int = 1000, # keys per state_getKeysPaged request
+                 ):
+        self.path = path
+        self.dirpath = self.resolve_path(path)
+        self.page_size = page_size
+        self.entries = {} # (network, item) -> entry
+        self.lock = threading.Lock()
+        self.item2lock = {}
+        self.stats = {'hits': 0, 'refreshes': 0, 'decoded': 0, 'unchanged': 0, 'removed': 0}
+
+    @classmethod
+    def store(cls, path:str = 'chain_state', **kwargs) -> 'ChainState':
+        """
+        the shared store of a path
+        """
+        if path not in cls.path2store:
+            cls.path2store[path] = cls(path=path, **kwargs)
+        return cls.path2store[path]
+
+    @staticmethod
+    def item_name(module:str, name:str, params:list = None) -> str:
+        item = f'{module}.{name}'
+        if params:
+            item = item + '::params::' + '-'.join([str(p) for p in params])
+        return item
+
+    def item_lock(self, key:tuple) -> threading.Lock:
+        with self.lock:
+            if key not in self.item2lock:
+                self.item2lock[key] = threading.Lock()
+            return self.item2lock[key]
+
+    def entry_path(self, network:str, item:str) -> str:
+        return os.path.join(self.dirpath, network, f'{item}.msgpack')
+
+    def load_entry(self, network:str, item:str) -> Optional[dict]:
+        """
+        the entry in memory, else the one on disk
+        """
+        key = (network, item)
+        if key in self.entries:
+            return self.entries[key]
+        path = self.entry_path(network, item)
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            return None
+        try:
+            with open(path, 'rb') as f:
+                entry = msgpack.unpack(f, strict_map_key=False)
+        except Exception as e:
+            c.print(f'Failed to load {path}: {e}', color='red')
+            return None
+        self.entries[key] = entry
+        return entry
+
+    def save_entry(self, network:str, item:str, entry:dict, save:bool = True):
+        self.entries[(network, item)] = entry
+        if not save:
+            return
+        path = self.entry_path(network, item)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(msgpack.packb(entry, use_bin_type=True))
+        os.replace(path + '.tmp', path)
+
+    def get(self, network:str, module:str, name:str, params:list = None, max_age:float = None, default=None):
+        """
+        the last synced value of the storage item, if it is younger than max_age (seconds)
+        """
+        entry = self.load_entry(network, self.item_name(module, name, params))
+        if entry == None or (max_age != None and c.time() - entry['timestamp'] > max_age):
+            return default
+        self.stats['hits'] += 1
+        return entry['value']
+
+    def storage_info(self, substrate, module:str, name:str, params:list, block_hash:str) -> dict:
+        """
+        the storage prefix of the item and the types to decode its keys and values
+        """
+        from substrateinterface.storage import StorageKey
+        substrate.init_runtime(block_hash=block_hash)
+        pallet = substrate.metadata.get_metadata_pallet(module)
+        assert pallet != None, f'Pallet {module} not found'
+        storage_item = pallet.get_storage_function(name)
+        assert storage_item != None, f'Storage function {module}.{name} not found'
+        param_types = storage_item.get_params_type_string()
+        hashers = storage_item.get_param_hashers()
+        hash_len = {'Blake2_128Concat': 16, 'Twox64Concat': 8, 'Identity': 0}
+        key_types = []
+        for i in range(len(params), len(param_types)):
+            key_types += [f'[u8; {hash_len.get(hashers[i], 0)}]', param_types[i]]
+        storage_key = StorageKey.create_from_storage_function(module, storage_item.value['name'], params,
+                                                              runtime_config=substrate.runtime_config,
+                                                              metadata=substrate.metadata)
+        return {'prefix': storage_key.to_hex(),
+                'value_type': storage_item.get_value_type_string(),
+                'key_type': f"({', '.join(key_types)})" if len(key_types) > 0 else None}
+
+    def decode(self, substrate, type_string:str, data:str, block_hash:str = None):
+        return substrate.decode_scale(type_string=type_string, scale_bytes=data, block_hash=block_hash)
+
+    def decode_key(self, substrate, info:dict, raw_key:str, block_hash:str = None) -> list:
+        """
+        the params of a map key (without their hashes)
+        """
+        key = self.decode(substrate, info['key_type'], '0x' + raw_key[len(info['prefix']):], block_hash=block_hash)
+        return list(key)[1::2]
+
+    @staticmethod
+    def digest(raw_value:str) -> bytes:
+        return hashlib.blake2b(raw_value.encode(), digest_size=16).digest()
+
+    def raw_pairs(self, substrate, prefix:str, block_hash:str, page_size:int = None, batch:Callable = None, max_results:int = None) -> Dict[str, str]:
+        """
+        the raw key/value pairs under the prefix (the first max_results keys if it is given),
+        the values of all the key pages are read in one json-rpc batch if batch (calls -> responses) is given
+        """
+        page_size = page_size or self.page_size
+        pages = []
+        start_key = prefix
+        n = 0
+        while max_results == None or n < max_results:
+            count = page_size if max_results == None else min(page_size, max_results - n)
+            keys = substrate.rpc_request(method='state_getKeysPaged',
+                                         params=[prefix, count, start_key, block_hash])['result']
+            if len(keys) > 0:
+                pages.append(keys)
+                n += len(keys)
+            if len(keys) < count:
+                break
+            start_key = keys[-1]
+        calls = [('state_queryStorageAt', [keys, block_hash]) for keys in pages]
+        if batch != None and len(calls) > 1:
+            responses = batch(calls)
+        else:
+            responses = [substrate.rpc_request(method=method, params=params) for method, params in calls]
+        pairs = {}
+        for response in responses:
+            assert 'error' not in response, f'Failed to query storage {response["error"]}'
+            for group in response['result']:
+                for k, v in group['changes']:
+                    if v != None:
+                        pairs[k] = v
+        return pairs
+
+    def query_map(self,
+                  substrate,
+                  module:str,
+                  name:str,
+                  params:list = None,
+                  block_hash:str = None,
+                  network:str = 'main',
+                  page_size:int = None,
+                  batch:Callable = None,
+                  max_results:int = None,
+                  save:bool = True) -> dict:
+        """
+        the map at the block (the chain head if None), nested by its keys and sorted,
+        only the pairs that changed since the synced block are decoded,
+        max_results limits the pairs that are fetched (an entry is only reused with the same limit)
+        """
+        params = params or []
+        block_hash = block_hash or substrate.get_chain_head()
+        item = self.item_name(module, name, params)
+        with self.item_lock((network, item)):
+            entry = self.load_entry(network, item)
+            if entry != None and entry['block_hash'] == block_hash and entry.get('max_results', None) == max_results:
+                self.stats['hits'] += 1
+                return entry['value']
+            info = self.storage_info(substrate, module, name, params, block_hash)
+            pairs = self.raw_pairs(substrate, info['prefix'], block_hash, page_size=page_size, batch=batch, max_results=max_results)
+            old_keys = entry.get('keys', {}) if entry != None else {}
+            keys = {}
+            items = []
+            for raw_key, raw_value in pairs.items():
+                digest = self.digest(raw_value)
+                old = old_keys.get(raw_key, None)
+                if old != None and old[1] == digest:
+                    key, v = old[0], entry['value']
+                    for k in key:
+                        v = v[k]
+                    self.stats['unchanged'] += 1
+                else:
+                    key = self.decode_key(substrate, info, raw_key, block_hash=block_hash)
+                    v = self.decode(substrate, info['value_type'], raw_value, block_hash=block_hash)
+                    self.stats['decoded'] += 1
+                keys[raw_key] = [key, digest]
+                items.append((key, v))
+            del pairs
+            if max_results == None and entry != None and entry.get('max_results', None) == None:
+                self.stats['removed'] += len(set(old_keys) - set(keys))
+            self.stats['refreshes'] += 1
+            value = {}
+            for key, v in sorted(items, key=lambda x: x[0]):
+                c.dict_put(value, key, v)
+            entry = {'block_hash': block_hash,
+                     'timestamp': c.time(),
+                     'max_results': max_results,
+                     'keys': keys,
+                     'value': value}
+            self.save_entry(network, item, entry, save=save)
+        return value
+
+    def query(self,
+              substrate,
+              module:str,
+              name:str,
+              params:list = None,
+              block_hash:str = None,
+              network:str = 'main',
+              save:bool = True):
+        """
+        the value at the block (the chain head if None), only decoded if the raw value changed
+        """
+        params = params or []
+        block_hash = block_hash or substrate.get_chain_head()
+        item = self.item_name(module, name, params)
+        with self.item_lock((network, item)):
+            entry = self.load_entry(network, item)
+            if entry != None and entry['block_hash'] == block_hash:
+                self.stats['hits'] += 1
+                return entry['value']
+            storage_key = substrate.create_storage_key(module, name, params)
+            raw = substrate.rpc_request(method='state_getStorageAt', params=[storage_key.to_hex(), block_hash])['result']
+            if entry != None and raw != None and entry['raw'] == raw:
+                value = entry['value']
+                self.stats['unchanged'] += 1
+            elif raw != None:
+                value = self.decode(substrate, storage_key.value_scale_type, raw, block_hash=block_hash)
+                self.stats['decoded'] += 1
+            else:
+                # not in storage, the query resolves the default value
+                value = substrate.query(module=module, storage_function=name, params=params, block_hash=block_hash).value
+            self.stats['refreshes'] += 1
+            entry = {'block_hash': block_hash, 'timestamp': c.time(), 'raw': raw, 'value': value}
+            self.save_entry(network, item, entry, save=save)
+        return value
+
+    def rm_network(self, network:str):
+        for key in [k for k in self.entries if k[0] == network]:
+            self.entries.pop(key)
+        return self.rm(os.path.join(self.dirpath, network))
+
+    @classmethod
+    def test(cls, n:int = 2000, changes:int = 10, path:str = 'test_chain_state'):
+        """
+        syncs a map of n items from a stand-in node with the storage key layout of a substrate node,
+        changes a few of them and syncs again
+        """
+        node = StandInNode({'SubspaceModule': {
+            'Name': {'hashers': ['Identity', 'Identity'], 'params': ['u16', 'u16'], 'value': 'Bytes'},
+            'StakeTo': {'hashers': ['Identity', 'Blake2_128Concat'], 'params': ['u16', 'AccountId'], 'value': 'u64'}}})
+        for uid in range(n):
+            node.put('SubspaceModule', 'Name', [0, uid], f'module{uid}')
+        cls.store(path).rm_network('test')
+        self = cls(path=path, page_size=500)
+
+        t0 = c.time()
+        value = self.query_map(node, 'SubspaceModule', 'Name', network='test', batch=node.batch)
+        cold = c.time() - t0
+        # the key pages one by one, then the values of every page in one batch
+        assert node.requests == n // self.page_size + 2, node.requests
+        assert value[0][1] == 'module1' and len(value[0]) == n, value[0][1]
+        assert self.stats['decoded'] == n
+
+        assert self.query_map(node, 'SubspaceModule', 'Name', network='test') is value
+        assert self.stats['hits'] == 1 # same block, nothing fetched
+
+        node.block += 1
+        for uid in range(changes):
+            node.put('SubspaceModule', 'Name', [0, uid], f'renamed{uid}')
+        node.remove('SubspaceModule', 'Name', [0, n - 1])
+        t0 = c.time()
+        value = self.query_map(node, 'SubspaceModule', 'Name', network='test')
+        warm = c.time() - t0
+        assert self.stats['decoded'] == n + changes and self.stats['removed'] == 1, self.stats
+        assert value[0][0] == 'renamed0' and value[0][changes] == f'module{changes}'
+        assert len(value[0]) == n - 1
+
+        # a map under the prefix of a param, keyed by the accounts behind their blake2 hashes
+        keys = [c.module('key').gen().ss58_address for i in range(3)]
+        for i, key in enumerate(keys):
+            node.put('SubspaceModule', 'StakeTo', [0, key], 100 * (i + 1))
+        node.put('SubspaceModule', 'StakeTo', [1, keys[0]], 7)
+        stake_to = self.query_map(node, 'SubspaceModule', 'StakeTo', params=[0], network='test')
+        assert stake_to == {key: 100 * (i + 1) for i, key in enumerate(keys)}, stake_to
+
+        # max_results stops the paging, save=False keeps the entry in memory only
+        head = self.query_map(node, 'SubspaceModule', 'Name', network='test', max_results=10, save=False)
+        assert len(head[0]) == 10 and head[0][0] == 'renamed0', head
+        assert self.query_map(node, 'SubspaceModule', 'Name', network='test', max_results=10) is head
+
+        # a new process loads the last saved entry from disk, the decoded params and digests of its keys and its value
+        loaded = cls(path=path)
+        assert len(loaded.get('test', 'SubspaceModule', 'Name')[0]) == n - 1
+        entry = loaded.load_entry('test', cls.item_name('SubspaceModule', 'Name'))
+        assert sorted(entry) == ['block_hash', 'keys', 'max_results', 'timestamp', 'value'], entry.keys()
+        self.rm_network('test')
+        return {'success': True, 'cold_seconds': cold, 'warm_seconds': warm, **self.stats}
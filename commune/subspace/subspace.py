@@ -3,6 +3,8 @@ from retry import retry
 from typing import *
 import json
 import os
+import threading
+import functools
 import commune as c
 import requests 
 
@@ -58,37 +60,54 @@ class Subspace(c.Module):
 
     connection_mode = 'ws'
 
-    def resolve_url(self, url:str = None, network:str = network, mode=None , **kwargs):
+    def resolve_urls(self, network:str = network, mode=None, **kwargs) -> List[str]:
+        """
+        the urls of the providers that match url_search (in subspace.yaml)
+        """
         mode = mode or self.config.connection_mode
         network = 'network' or self.config.network
-        if url == None:
-            
-            url_search_terms = [x.strip() for x in self.config.url_search.split(',')]
-            is_match = lambda x: any([url in x for url in url_search_terms])
-            urls = []
-            for provider, mode2url in self.config.urls.items():
-                if is_match(provider):
-                    chain = c.module('subspace.chain')
-                    if provider == 'commune':
-                        url = chain.resolve_node_url(url=url, chain=network, mode=mode) 
-                    elif provider == 'local':
-                        url = chain.resolve_node_url(url=url, chain='local', mode=mode)
-                    else:
-                        url = mode2url[mode]
+        url = None
+        url_search_terms = [x.strip() for x in self.config.url_search.split(',')]
+        is_match = lambda x: any([url in x for url in url_search_terms])
+        urls = []
+        for provider, mode2url in self.config.urls.items():
+            if is_match(provider):
+                chain = c.module('subspace.chain')
+                if provider == 'commune':
+                    url = chain.resolve_node_url(url=url, chain=network, mode=mode) 
+                elif provider == 'local':
+                    url = chain.resolve_node_url(url=url, chain='local', mode=mode)
+                else:
+                    url = mode2url[mode]
 
-                    if isinstance(url, list):
-                        urls += url
-                    else:
-                        urls += [url] 
+                if isinstance(url, list):
+                    urls += url
+                else:
+                    urls += [url] 
+        return [url.replace(c.ip(), '0.0.0.0') for url in urls]
 
-            url = c.choice(urls)
+    def resolve_url(self, url:str = None, network:str = network, mode=None , **kwargs):
+        if url == None:
+            url = c.choice(self.resolve_urls(network=network, mode=mode))
         
         url = url.replace(c.ip(), '0.0.0.0')
         
 
         return url
-    
-    url2substrate = {}
+
+    pools = {} # (mode, urls) -> pool, shared by every subspace of the process
+    pools_lock = threading.Lock()
+    def get_pool(self, network:str = 'main', mode:str = 'http', url:str = None, **substrate_kwargs) -> 'SubstratePool':
+        """
+        the connection pool of the urls of the network (or of the url), round robin across them
+        """
+        urls = [self.resolve_url(url)] if url != None else self.resolve_urls(network=network, mode=mode)
+        key = (mode, tuple(urls))
+        with self.pools_lock:
+            if key not in self.pools:
+                self.pools[key] = c.module('subspace.pool')(urls=urls, **substrate_kwargs)
+        return self.pools[key]
+
     def get_substrate(self, 
                 network:str = 'main',
                 url : str = None,
@@ -133,9 +152,19 @@ class Subspace(c.Module):
                 
         '''
         if cache:
-            if url in self.url2substrate:
-                return self.url2substrate[url]
-
+            # the interface of the pool, each call checks a connection out and back in
+            pool = self.get_pool(network=network, 
+                                 mode=mode, 
+                                 url=url, 
+                                 ss58_format=ss58_format, 
+                                 type_registry=type_registry, 
+                                 type_registry_preset=type_registry_preset, 
+                                 auto_discover=auto_discover, 
+                                 auto_reconnect=auto_reconnect)
+            substrate = pool.get()
+            self.network = network
+            self.url = substrate.url
+            return substrate
 
         while trials > 0:
             try:
@@ -156,9 +185,6 @@ class Subspace(c.Module):
                 trials = trials - 1
                 if trials > 0:
                     raise e
-        
-        if cache:
-            self.url2substrate[url] = substrate
 
         self.network = network
         self.url = url
@@ -186,13 +212,15 @@ class Subspace(c.Module):
 
 
     def rank_modules(self,search=None, k='stake', n=10, modules=None, reverse=True, names=False, **kwargs):
-        modules = self.modules(search=search, **kwargs) if modules == None else modules
-        modules = sorted(modules, key=lambda x: x[k], reverse=reverse)
+        ModuleTable = c.module('subspace.table')
+        modules = self.modules(search=search, as_table=True, **kwargs) if modules == None else modules
+        if isinstance(modules, list):
+            is_tables = len(modules) > 0 and isinstance(modules[0], ModuleTable)
+            modules = ModuleTable.concat(modules) if is_tables else ModuleTable.from_rows(modules)
         if names:
-            return [m['name'] for m in modules]
-        if n != None:
-            modules = modules[:n]
-        return modules[:n]
+            return modules.sort(k, reverse=reverse)['name'].tolist()
+        # only the top n are sorted and built as dicts
+        return modules.top(k, n=n, reverse=reverse).rows()
     
     def top_modules(self,search=None, k='stake', n=10, modules=None, **kwargs):
         top_modules = self.rank_modules(search=search, k=k, n=n, modules=modules, reverse=True, **kwargs)
@@ -247,6 +275,9 @@ class Subspace(c.Module):
         return wasm_file_path
 
     def my_stake_from(self, netuid = 0, block=None, update=False, network=network, fmt='j', max_age=1000 , **kwargs):
+        indexer = self.indexer(network=network, block=block) if netuid not in ['all', None] else None
+        if indexer != None:
+            return indexer.my_stake_from(keys=list(c.address2key().keys()), netuid=netuid, fmt=fmt)
         stake_from_tuples = self.stake_from(netuid=netuid,
                                              block=block,
                                                update=update, 
@@ -281,6 +312,9 @@ class Subspace(c.Module):
         return delegation_fee
 
     def stake_to(self, netuid = 0, network=network, block=None, update=False, fmt='nano',**kwargs):
+        indexer = self.indexer(network=network, block=block) if netuid not in ['all', None] else None
+        if indexer != None:
+            return {k: [[_k, _v] for _k, _v in v.items()] for k, v in indexer.stake_to(netuid=netuid, fmt=fmt).items()}
         stake_to = self.query_map('StakeTo', netuid=netuid, block=block, update=update, network=network, **kwargs)
         format_tuples = lambda x: [[_k, self.format_amount(_v, fmt=fmt)] for _k,_v in x]
         if netuid == 'all':
@@ -322,39 +356,42 @@ class Subspace(c.Module):
         
         """
         query a subspace storage function with params and block.
+        the value is cached per block hash in the chain state (and only decoded if it changed),
+        it is persisted unless save=False
         """
 
         network = self.resolve_network(network)
-        path = f'query/{network}/{module}.{name}'
     
         params = params or []
         if not isinstance(params, list):
             params = [params]
         if netuid != None and netuid != 'all':
             params = [netuid] + params
-            
-        # we want to cache based on the params if there are any
-        if len(params) > 0 :
-            path = path + f'::params::' + '-'.join([str(p) for p in params])
 
+        state = self.chain_state()
         if not update:
-            value = self.get(path, None)
+            value = state.get(network, module, name, params)
             if value != None:
                 return value
-        substrate = self.get_substrate(network=network, mode=mode)
-        response =  substrate.query(
-            module=module,
-            storage_function = name,
-            block_hash = None if block == None else substrate.get_block_hash(block), 
-            params = params
-        )
-        value =  response.value
+        with self.get_pool(network=network, mode=mode).connection() as substrate:
+            block_hash = None if block == None else substrate.get_block_hash(block)
+            return state.query(substrate, module, name, params, block_hash=block_hash, network=network, save=save)
 
-        # if the value is a tuple then we want to convert it to a list
-        if save:
-            self.put(path, value)
+    def chain_state(self, path:str = 'chain_state') -> 'ChainState':
+        """
+        the chain state cache shared by every subspace of the process
+        """
+        return c.module('subspace.state').store(path)
 
-        return value
+    def indexer(self, network:str = None, block:int = None):
+        """
+        the indexer served on this host if it indexes the network, the stake and key helpers answer from it
+        (it follows the chain head) and query the chain without it or at a past block,
+        the client is cached per network (see Indexer.connect)
+        """
+        if block != None:
+            return None
+        return c.module('subspace.indexer').connect(network=network or self.network)
 
     def query_constant( self, 
                         constant_name: str, 
@@ -386,14 +423,18 @@ class Subspace(c.Module):
                   network:str = 'main',
                   netuid = None,
                   page_size=1000,
-                  max_results=100000,
+                  max_results=100000, # the pairs that are fetched at most
                   module='SubspaceModule',
                   update: bool = True,
                   max_age = None, # max age in seconds
                   mode = 'ws',
+                  save: bool = True, # persist the map in the chain state (else it is only kept in memory)
                   **kwargs
                   ) -> Optional[object]:
-        """ Queries subspace map storage with params and block. """
+        """ 
+        Queries subspace map storage with params and block. 
+        the map is cached per block hash in the chain state, a refresh only decodes the pairs that changed
+        """
 
         # if all lowercase then we want to capitalize the first letter
         if name[0].islower():
@@ -404,7 +445,6 @@ class Subspace(c.Module):
             module = 'System'
 
         network = self.resolve_network(network, new_connection=False, mode=mode)
-        path = f'query/{network}/{module}.{name}'
         # resolving the params
         params = params or []
 
@@ -414,59 +454,28 @@ class Subspace(c.Module):
 
         if not isinstance(params, list):
             params = [params]
-        if len(params) > 0 :
-            path = path + f'::params::' + '-'.join([str(p) for p in params])
 
-        value = None if update else self.get(path, None, max_age=max_age)
+        state = self.chain_state()
+        value = None if update else state.get(network, module, name, params, max_age=max_age)
         
         if value == None:
             network = self.resolve_network(network)
-            # if the value is a tuple then we want to convert it to a list
-            block = block or self.block
-            substrate = self.get_substrate(network=network, mode=mode)
-            qmap =  substrate.query_map(
-                module=module,
-                storage_function = name,
-                params = params,
-                page_size = page_size,
-                max_results = max_results,
-                block_hash =substrate.get_block_hash(block)
-            )
-
-            new_qmap = {} 
-            progress_bar = c.progress(qmap, desc=f'Querying {name} map')
-            for (k,v) in qmap:
-                progress_bar.update(1)
-                if not isinstance(k, tuple):
-                    k = [k]
-                if type(k) in [tuple,list]:
-                    # this is a double map
-                    k = [_k.value for _k in k]
-                if hasattr(v, 'value'):
-                    v = v.value
-                    c.dict_put(new_qmap, k, v)
-        else:
-            new_qmap = value
-
-        # this is a double
-        if isinstance(new_qmap, dict) and len(new_qmap) > 0:
-
-            k = list(new_qmap.keys())[0]    
-            v = list(new_qmap.values())[0]
+            pool = self.get_pool(network=network, mode=mode)
+            # one connection for the runtime, the pages and their batches
+            with pool.connection() as substrate:
+                block_hash = None if block == None else substrate.get_block_hash(block)
+                value = state.query_map(substrate, 
+                                        module, 
+                                        name, 
+                                        params, 
+                                        block_hash=block_hash, 
+                                        network=network, 
+                                        page_size=page_size,
+                                        batch=functools.partial(pool.batch, connection=substrate),
+                                        max_results=max_results,
+                                        save=save)
 
-            if c.is_digit(k):
-                new_qmap = {int(k): v for k,v in new_qmap.items()}
-            new_qmap = dict(sorted(new_qmap.items(), key=lambda x: x[0]))
-            if isinstance(v, dict):
-                for k,v in new_qmap.items():
-                    _k = list(v.keys())[0]
-                    if c.is_digit(_k):
-                        new_qmap[k] = dict(sorted(new_qmap[k].items(), key=lambda x: x[0]))
-                        new_qmap[k] = {int(_k): _v for _k, _v in v.items()}
-
-        self.put(path, new_qmap)
-
-        return new_qmap
+        return value
     
     def runtime_spec_version(self, network:str = 'main'):
         # Get the runtime version
@@ -493,6 +502,9 @@ class Subspace(c.Module):
     
     """ Returns network Tempo hyper parameter """
     def stakes(self, netuid: int = 0, block: Optional[int] = None, fmt:str='nano', max_staleness = 100,network=None, update=False, **kwargs) -> int:
+        indexer = self.indexer(network=network, block=block)
+        if indexer != None:
+            return indexer.stakes(netuid=netuid, fmt=fmt)
         stakes =  self.query_map('Stake', update=update, **kwargs)[netuid]
         return {k: self.format_amount(v, fmt=fmt) for k,v in stakes.items()}
 
@@ -574,6 +586,9 @@ class Subspace(c.Module):
         
         key_ss58 = self.resolve_key_ss58( key_ss58)
         netuid = self.resolve_netuid( netuid )
+        indexer = self.indexer(block=block)
+        if indexer != None:
+            return indexer.stake(key_ss58, netuid=netuid, fmt=fmt)
         stake = self.query( 'Stake',params=[netuid, key_ss58], block=block , update=update)
         return self.format_amount(stake, fmt=fmt)
 
@@ -641,8 +656,12 @@ class Subspace(c.Module):
         
         key_address = self.resolve_key_ss58( key )
         netuid = self.resolve_netuid( netuid )
-        stake_to = self.query( 'StakeTo', params=[netuid, key_address], block=block, update=update, network=network)
-        stake_to =  {k: self.format_amount(v, fmt=fmt) for k, v in stake_to}
+        indexer = self.indexer(network=network, block=block)
+        if indexer != None:
+            stake_to = indexer.stake_to(key_address, netuid=netuid, fmt=fmt)
+        else:
+            stake_to = self.query( 'StakeTo', params=[netuid, key_address], block=block, update=update, network=network)
+            stake_to =  {k: self.format_amount(v, fmt=fmt) for k, v in stake_to}
         if module_key != None:
             module_key = self.resolve_key_ss58( module_key )
             stake_to ={ k:v for k, v in stake_to.items()}.get(module_key, 0)
@@ -694,7 +713,11 @@ class Subspace(c.Module):
     def get_stake_from( self, key: str, from_key=None, block: Optional[int] = None, netuid:int = None, fmt='j', update=True  ) -> Optional['Balance']:
         key = self.resolve_key_ss58( key )
         netuid = self.resolve_netuid( netuid )
-        state_from =  [(k, self.format_amount(v, fmt=fmt)) for k, v in self.query( 'StakeFrom', block=block, params=[netuid, key], update=update )]
+        indexer = self.indexer(block=block)
+        if indexer != None:
+            state_from = list(indexer.stake_from(key, netuid=netuid, fmt=fmt).items())
+        else:
+            state_from =  [(k, self.format_amount(v, fmt=fmt)) for k, v in self.query( 'StakeFrom', block=block, params=[netuid, key], update=update )]
  
         if from_key is not None:
             from_key = self.resolve_key_ss58( from_key )
@@ -801,8 +824,21 @@ class Subspace(c.Module):
         time2archive = cls.time2archive(network=network)
         return time2archive[latest_archive_time]
 
+    network2archive = {}
+    @classmethod
+    def get_archive(cls, network=network) -> 'Archive':
+        """
+        the snapshots (bases and deltas) of the state dicts of the network
+        """
+        if network not in cls.network2archive:
+            cls.network2archive[network] = c.module('subspace.archive')(network=network)
+        return cls.network2archive[network]
+
     @classmethod
     def latest_archive_time(cls, network=network):
+        archive = cls.get_archive(network=network)
+        if len(archive.index) > 0:
+            return archive.index[-1]['time']
         time2archive = cls.time2archive(network=network)
         if len(time2archive) == 0:
             return None
@@ -821,6 +857,9 @@ class Subspace(c.Module):
 
     @classmethod
     def latest_archive(cls, network=network):
+        archive = cls.get_archive(network=network)
+        if len(archive.index) > 0:
+            return archive.load()
         path = cls.latest_archive_path(network=network)
         if path == None:
             return {}
@@ -1304,10 +1343,14 @@ class Subspace(c.Module):
         
     def name2key(self, search:str=None, network=network, netuid: int = 0, update=False ) -> Dict[str, str]:
         # netuid = self.resolve_netuid(netuid)
-        self.resolve_network(network)
-        names = self.names(netuid=netuid, update=update)
-        keys = self.keys(netuid=netuid, update=update)
-        name2key = dict(zip(names, keys))
+        indexer = self.indexer(network=network)
+        if indexer != None:
+            name2key = indexer.name2key(netuid=netuid)
+        else:
+            self.resolve_network(network)
+            names = self.names(netuid=netuid, update=update)
+            keys = self.keys(netuid=netuid, update=update)
+            name2key = dict(zip(names, keys))
         if search != None:
             name2key = {k:v for k,v in name2key.items() if search in k}
             if len(name2key) == 1:
@@ -1584,6 +1627,7 @@ class Subspace(c.Module):
                 page_size = 100,
                 lite: bool = True,
                 page = None,
+                as_table: bool = False, # return the ModuleTable(s) instead of dicts
                 **kwargs
                 ) -> Dict[str, 'ModuleInfo']:
         if search == 'all':
@@ -1637,74 +1681,51 @@ class Subspace(c.Module):
             netuids = [netuid]
             state = {k:{netuid: v} for k,v in state.items()}
             
-        all_modules = []
+        ModuleTable = c.module('subspace.table')
+        tables = []
         return_netuid = isinstance(netuid, int)
         for netuid in netuids:
-            c.print(netuid)
             path = f'modules/{network}.{netuid}'
 
-            modules = [] if update else self.get(path, [])
+            columns = {} if update else self.get(path, {})
             
-            if len(modules) == 0:
-                c.print(state.keys())
-                c.print(state)
-                for uid, key in enumerate(state['key'][netuid]):
-                    module = { 'uid': uid, 'key': key}
-                    for  f in features:
-                        if f in ['name', 'address', 'emission', 'incentive', 
-                                 'dividends', 'last_update', 'regblock']:
-                            module[f] = state[f][netuid][uid]
-                        elif f in ['trust']:
-                            module[f] = state[f][netuid][uid] if len(state[f][netuid]) > uid else 0
-                        elif f in ['delegation_fee']:
-                            module[f] = state[f][netuid].get(key, 20)
-                        elif f in ['stake_from']:
-                            module[f] = state[f].get(netuid, {}).get(key, [])
-                            module['stake'] =  sum([v for k,v in module['stake_from']])
-                        elif f in ['weights']:
-                            module[f] = state[f].get(netuid, {}).get(uid, [])
-                    modules.append(module)
-                self.put(path, modules)
+            if isinstance(columns, list):
+                # the modules of older versions were cached as rows
+                table = ModuleTable.from_rows(columns)
+            elif len(columns) == 0:
+                table = ModuleTable.from_state(state, netuid=netuid, features=features)
+                self.put(path, table.to_columns())
+            else:
+                table = ModuleTable(columns)
 
-            for i, module in enumerate(modules):
-                modules[i] = self.format_module(modules[i], fmt=fmt, features=features)
+            # every module is formatted and filtered at once
+            table = table.format(fmt=fmt, features=features)
             if search != None and search != 'all':
-                modules = [m for m in modules if search in m['name']]
-        
-            all_modules.append(modules)
-            
+                table = table.filter(search=search)
+            if sortby != None and sortby in table:
+                table = table.sort(sortby)
+            tables.append(table)
 
-        
-        # sort by emission
-        if sortby != None and sortby in features:
-            all_modules = [sorted(modules, key=lambda x: x[sortby] if 'sortby' != 'weights' else len(x[sortby]), reverse=True) for modules in all_modules]
-    
         if return_netuid:
-            modules =  all_modules[0]
-            n = len(modules)
+            n = len(tables[0])
         else:
-            modules = all_modules
-            n = sum([len(m) for m in modules])
+            n = sum([len(t) for t in tables])
 
-        c.print(f'Fetched {len(modules)} modules in {c.time() - t1} seconds')
+        c.print(f'Fetched {n} modules in {c.time() - t1} seconds')
         if page != None:
-            if isinstance(modules[0], list): 
-                # flatten list
-                new_modules = []
-                for m in modules:
-                    new_modules += m
-                modules = new_modules
-            num_pages = n//page_size
+            # the pages are over the modules of every subnet
+            table = ModuleTable.concat(tables) if len(tables) > 1 else tables[0]
             start_idx = page*page_size
             end_idx = start_idx + page_size
-            modules = modules[start_idx:end_idx]
-
             c.print(f'Page {page} of {n//page_size} pages')
-    
-            
-
+            table = table.take(slice(start_idx, end_idx))
+            return table if as_table else table.rows()
 
-        return modules
+        if as_table:
+            return tables[0] if return_netuid else tables
+        # the rows are only built here
+        modules = [t.rows() for t in tables]
+        return modules[0] if return_netuid else modules
     
 
 
@@ -1737,7 +1758,11 @@ class Subspace(c.Module):
              return_dict = True,
              **kwargs):
         netuid = self.resolve_netuid(netuid)
-        uid2key =  self.query_map('Keys',  netuid=netuid, update=update, network=network, **kwargs)
+        indexer = self.indexer(network=network, block=kwargs.get('block', None))
+        if indexer != None:
+            uid2key = {int(k): v for k, v in indexer.uid2key(netuid=netuid).items()}
+        else:
+            uid2key =  self.query_map('Keys',  netuid=netuid, update=update, network=network, **kwargs)
         # sort by uid
         if uid != None:
             return uid2key[uid]
@@ -1873,7 +1898,9 @@ class Subspace(c.Module):
                     update=False,
                     network=network,
                     fmt='nano', **kwargs) -> List[Dict[str, Union[str, int]]]:
-        
+        indexer = self.indexer(network=network, block=block) if netuid not in ['all', None] else None
+        if indexer != None:
+            return {k: [[_k, _v] for _k, _v in v.items()] for k, v in indexer.stake_from(netuid=netuid, fmt=fmt).items()}
         stake_from = self.query_map('StakeFrom', netuid=netuid, block=block, update=update, network=network, **kwargs)
         format_tuples = lambda x: [[_k, self.format_amount(_v, fmt=fmt)] for _k,_v in x]
         if netuid == 'all':
@@ -1958,6 +1985,7 @@ class Subspace(c.Module):
                     start_time: Optional[Union[int, str]] = None, 
                     netuid=0, 
                     n = 1000,
+                    network = network,
                     **kwargs):
 
 
@@ -1967,54 +1995,45 @@ class Subspace(c.Module):
             c.print(end_time)
             
             end_time = c.datetime2time(end_time)
-        elif isinstance(end_time, int):
+        elif isinstance(end_time, (int, float)):
             pass
         else:
             raise Exception(f'Invalid end_time {end_time}')
-            end_time = c.time2datetime(end_time)
-
-
 
         if start_time == None:
             start_time = end_time - lookback_hours*3600
-            start_time = c.time2datetime(start_time)
-
-        if isinstance(start_time, int) or isinstance(start_time, float):
-            start_time = c.time2datetime(start_time)
-        
-        if isinstance(end_time, int) or isinstance(end_time, float):
-            end_time = c.time2datetime(end_time)
-        
+        elif isinstance(start_time, str):
+            start_time = c.datetime2time(start_time)
 
         assert end_time > start_time, f'end_time {end_time} must be greater than start_time {start_time}'
-        datetime2archive = cls.datetime2archive()
-        datetime2archive= {k: v for k,v in datetime2archive.items() if k >= start_time and k <= end_time}
-        c.print(len(datetime2archive))
-        factor = len(datetime2archive)//n
+        archive = cls.get_archive(network=network)
+        if len(archive.index) == 0:
+            # the json state dicts of older versions
+            archive.import_json([p for p in cls.ls_archives(network=network) if p.endswith('.json')])
+        entries = archive.entries(start_time=start_time, end_time=end_time)
+        c.print(len(entries))
+        factor = len(entries)//n
         if factor == 0:
             factor = 1
+        entries = entries[::factor]
+        block2time = {e['block']: e['time'] for e in entries}
         archives = []
 
-        c.print('Searching archives from', start_time, 'to', end_time)
+        c.print('Searching archives from', c.time2datetime(start_time), 'to', c.time2datetime(end_time))
 
-        cnt = 0
-        for i, (archive_dt, archive_path) in enumerate(datetime2archive.items()):
-            if i % factor != 0:
-                continue
-            archive_block = int(archive_path.split('block-')[-1].split('-time')[0])
-            archive = c.get(archive_path)
-            total_balances = sum([b for b in archive['balances'].values()])
+        # one pass over the bases and deltas, the states are rebuilt block by block
+        for archive_block, state in archive.iter_states(list(block2time.keys())):
+            total_balances = sum([b for b in state['balances'].values()])
 
-            total_stake = sum([sum([_[1]for _ in m['stake_from']]) for m in archive['modules'][netuid]])
-            subnet = archive['subnets'][netuid]
+            total_stake = sum([sum([_[1]for _ in m['stake_from']]) for m in state['modules'][netuid]])
+            subnet = state['subnets'][netuid]
             row = {
                     'block': archive_block,  
                     'total_stake': total_stake*1e-9,
                     'total_balance': total_balances*1e-9, 
                     'market_cap': (total_stake+total_balances)*1e-9 , 
-                    'dt': archive_dt, 
-                    'block': archive['block'], 
-                    'path': archive_path, 
+                    'dt': c.time2datetime(block2time[archive_block]), 
+                    'path': archive.dirpath, 
                     'mcap_per_block': 0,
                 }
             
@@ -2238,15 +2257,12 @@ class Subspace(c.Module):
         if save:
             update = True
         if not update:
-            state_path = self.latest_archive_path() # get the latest archive path
-            state_dict = c.get(state_path, None)
-            if state_path != None:
+            state_dict = self.latest_archive(network=network)
+            if len(state_dict) > 0:
                 return state_dict
 
         block = block or self.block
 
-        path = f'state_dict/{network}.block-{block}-time-{int(c.time())}'
-
         
         def get_feature(feature, **kwargs):
             self = Subspace(mode=mode)
@@ -2289,16 +2305,18 @@ class Subspace(c.Module):
             
             feature2result = {}
 
-        if save:
-            self.put(path, state_dict)
-            end_time = c.time()
-            latency = end_time - start_time
-            response = {"success": True,
-                        "msg": f'Saving state_dict to {path}', 
-                        'latency': latency, 
-                        'block': state_dict['block']}
+        if not save:
+            return state_dict
+
+        # a full base every base_interval snapshots, a compressed delta against the last one otherwise
+        snapshot = self.get_archive(network=network).save(state_dict)
+        end_time = c.time()
+        latency = end_time - start_time
+        response = {"success": True,
+                    "msg": f'Saved the state_dict as a {snapshot["kind"]} ({snapshot["size"]} bytes)', 
+                    'latency': latency, 
+                    'block': state_dict['block']}
 
-        
         return response  # put it in storage
     
 
@@ -2980,9 +2998,14 @@ class Subspace(c.Module):
                         netuid:int = 0,
                         min_balance = 100_000_000_000,
                         n:str = 100,
-                        network: str = None) -> Optional['Balance']:
+                        network: str = None,
+                        submit: bool = True) -> Optional['Balance']:
         network = self.resolve_network( network )
         netuid = self.resolve_netuid( netuid )
+        if isinstance(key, list):
+            # every key stakes, the keys are sent concurrently through the tx pipeline
+            calls = [self.stake_many(modules=c.copy(modules), amounts=c.copy(amounts), key=k, netuid=netuid, min_balance=min_balance, n=n, network=network, submit=False) for k in key]
+            return self.submit_calls(calls, network=network)
         key = self.resolve_key( key )
 
         if modules == None:
@@ -3011,6 +3034,8 @@ class Subspace(c.Module):
             "module_keys": module_keys,
             "amounts": amounts
         }
+        if not submit:
+            return {'key': key, 'fn': 'add_stake_multiple', 'params': params}
 
         response = self.compose_call('add_stake_multiple', params=params, key=key)
 
@@ -3025,8 +3050,12 @@ class Subspace(c.Module):
                         netuid:int = 0,
                         n:str = 10,
                         local:bool = False,
-                        network: str = None) -> Optional['Balance']:
+                        network: str = None,
+                        submit: bool = True) -> Optional['Balance']:
         network = self.resolve_network( network )
+        if isinstance(key, list):
+            calls = [self.transfer_multiple(destinations=c.copy(destinations), amounts=c.copy(amounts), key=k, netuid=netuid, n=n, network=network, submit=False) for k in key]
+            return self.submit_calls(calls, network=network)
         key = self.resolve_key( key )
         balance = self.get_balance(key=key, fmt='j')
 
@@ -3076,6 +3105,8 @@ class Subspace(c.Module):
             "destinations": destinations,
             "amounts": amounts
         }
+        if not submit:
+            return {'key': key, 'fn': 'transfer_multiple', 'params': params}
 
         response = self.compose_call('transfer_multiple', params=params, key=key)
 
@@ -3089,9 +3120,13 @@ class Subspace(c.Module):
                         amounts:Union[List[str], float, int] = None,
                         key: str = None, 
                         netuid:int = 0,
-                        network: str = None) -> Optional['Balance']:
+                        network: str = None,
+                        submit: bool = True) -> Optional['Balance']:
         
         network = self.resolve_network( network )
+        if isinstance(key, list):
+            calls = [self.unstake_many(modules=c.copy(modules), amounts=c.copy(amounts), key=k, netuid=netuid, network=network, submit=False) for k in key]
+            return self.submit_calls(calls, network=network)
         key = self.resolve_key( key )
 
         if modules == None or modules == 'all':
@@ -3134,6 +3169,8 @@ class Subspace(c.Module):
             "amounts": amounts
         }
         c.print(params)
+        if not submit:
+            return {'key': key, 'fn': 'remove_stake_multiple', 'params': params}
         response = self.compose_call('remove_stake_multiple', params=params, key=key)
 
         return response
@@ -3636,7 +3673,7 @@ class Subspace(c.Module):
 
         start_time = c.datetime()
         ss58_address = key.ss58_address
-        paths = {m: f'history/{self.network}/{ss58_address}/{m}/{start_time}.json' for m in ['complete', 'pending']}
+        store = c.module('subspace.tx').store(ss58_address, network=self.network)
         params = {k: int(v) if type(v) in [float]  else v for k,v in params.items()}
         compose_kwargs = dict(
                 call_module=module,
@@ -3645,66 +3682,76 @@ class Subspace(c.Module):
         )
 
         c.print(f'Sending Transaction: 📡', compose_kwargs, color=color)
-        tx_state = dict(status = 'pending',start_time=start_time, end_time=None)
-
-        self.put_json(paths['pending'], tx_state)
-
-        substrate = self.get_substrate(network=network, mode='ws')
-        call = substrate.compose_call(**compose_kwargs)
-
-        if sudo:
-            call = substrate.compose_call(
-                call_module='Sudo',
-                call_function='sudo',
-                call_params={
-                    'call': call,
-                }
-            )
-        if unchecked_weight:
-            # uncheck the weights for set_code
-            call = substrate.compose_call(
-                call_module="Sudo",
-                call_function="sudo_unchecked_weight",
-                call_params={
-                    "call": call,
-                    'weight': (0,0)
-                },
-            )
-        # get nonce 
-        extrinsic = substrate.create_signed_extrinsic(call=call,keypair=key,nonce=nonce, tip=tip)
-
-        response = substrate.submit_extrinsic(extrinsic=extrinsic,
-                                                wait_for_inclusion=wait_for_inclusion, 
-                                                wait_for_finalization=wait_for_finalization)
-
-        if wait_for_finalization:
-            if process_events:
-                response.process_events()
-
-            if response.is_success:
-                response =  {'success': True, 'tx_hash': response.extrinsic_hash, 'msg': f'Called {module}.{fn} on {self.network} with key {key.ss58_address}'}
+        tx_state = dict(id=f'{c.time()}_{c.random_int(0, 10**6)}', status = 'pending', fns=[fn], start_time=start_time, end_time=None)
+        if save_history:
+            store.put(tx_state)
+
+        # one connection from the composition of the call to its submission
+        with self.get_pool(network=network, mode='ws').connection() as substrate:
+            call = substrate.compose_call(**compose_kwargs)
+
+            if sudo:
+                call = substrate.compose_call(
+                    call_module='Sudo',
+                    call_function='sudo',
+                    call_params={
+                        'call': call,
+                    }
+                )
+            if unchecked_weight:
+                # uncheck the weights for set_code
+                call = substrate.compose_call(
+                    call_module="Sudo",
+                    call_function="sudo_unchecked_weight",
+                    call_params={
+                        "call": call,
+                        'weight': (0,0)
+                    },
+                )
+            # get nonce 
+            extrinsic = substrate.create_signed_extrinsic(call=call,keypair=key,nonce=nonce, tip=tip)
+
+            response = substrate.submit_extrinsic(extrinsic=extrinsic,
+                                                    wait_for_inclusion=wait_for_inclusion, 
+                                                    wait_for_finalization=wait_for_finalization)
+
+            if wait_for_finalization:
+                if process_events:
+                    response.process_events()
+
+                if response.is_success:
+                    response =  {'success': True, 'tx_hash': response.extrinsic_hash, 'msg': f'Called {module}.{fn} on {self.network} with key {key.ss58_address}'}
+                else:
+                    response =  {'success': False, 'error': response.error_message, 'msg': f'Failed to call {module}.{fn} on {self.network} with key {key.ss58_address}'}
             else:
-                response =  {'success': False, 'error': response.error_message, 'msg': f'Failed to call {module}.{fn} on {self.network} with key {key.ss58_address}'}
-        else:
-            response =  {'success': True, 'tx_hash': response.extrinsic_hash, 'msg': f'Called {module}.{fn} on {self.network} with key {key.ss58_address}'}
+                response =  {'success': True, 'tx_hash': response.extrinsic_hash, 'msg': f'Called {module}.{fn} on {self.network} with key {key.ss58_address}'}
         
 
         tx_state['end_time'] = c.datetime()
-        tx_state['status'] = 'completed'
+        tx_state['status'] = 'included' if response['success'] else 'failed'
         tx_state['response'] = response
-
-        # remo 
-        self.rm(paths['pending'])
-        self.put_json(paths['complete'], tx_state)
+        if save_history:
+            store.put(tx_state)
 
         return response
-            
+
+    def tx_pipeline(self, network:str = None, **kwargs) -> 'TxPipeline':
+        """
+        the pipeline that sends many calls from many keys over the connection pool of the network
+        """
+        network = self.resolve_network(network, new_connection=False)
+        return c.module('subspace.tx')(connection=self.get_pool(network=network, mode='ws').connection, network=network, **kwargs)
+
+    def submit_calls(self, calls:List[dict], network:str = None, **kwargs) -> List[dict]:
+        """
+        sends the calls [{key, fn, params, module}] as batches per key, the keys concurrently
+        """
+        calls = [{**call, 'key': self.resolve_key(call['key'])} for call in calls]
+        return self.tx_pipeline(network=network, **kwargs).submit(calls)
 
     def tx_history(self, key:str=None, mode='complete',network=network, **kwargs):
         key_ss58 = self.resolve_key_ss58(key)
-        assert mode in ['pending', 'complete']
-        pending_path = f'history/{network}/{key_ss58}/{mode}'
-        return self.glob(pending_path)
+        return c.module('subspace.tx').history(key_ss58, network=network, mode=mode)
     
     def pending_txs(self, key:str=None, **kwargs):
         return self.tx_history(key=key, mode='pending', **kwargs)
@@ -0,0 +1,212 @@
+import commune as c
+import numpy as np
+from typing import *
+
+U16_MAX = 2**16 - 1
+
+class ModuleTable(c.Module):
+    """
+    Columnar table of subnet modules (struct of arrays)
+
+    every feature is one numpy array over the modules (uid, key, name, stake, emission, ...),
+    formatting, filtering and ranking are vectorized and rows are only built as dicts when they are asked for
+    """
+    amount_features = ['emission', 'stake']
+    ratio_features = ['incentive', 'dividends']
+    numeric_features = ['uid', 'netuid', 'emission', 'stake', 'incentive', 'dividends', 'last_update', 'regblock', 'trust', 'delegation_fee']
+
+    def __init__(self, columns:Dict[str, Any] = None, amount_scale:float = 1):
+        self.columns = {k: self.to_array(k, v) for k, v in (columns or {}).items()}
+        self.amount_scale = amount_scale # applied to the amounts in stake_from when rows are built
+
+    @classmethod
+    def to_array(cls, feature:str, values) -> np.ndarray:
+        if isinstance(values, np.ndarray):
+            return values
+        if feature in cls.numeric_features:
+            return np.asarray(values)
+        # lists of lists (stake_from, weights) stay one python object per module
+        array = np.empty(len(values), dtype=object)
+        array[:] = list(values)
+        return array
+
+    @classmethod
+    def from_state(cls, state:dict, netuid:int = 0, features:List[str] = None) -> 'ModuleTable':
+        """
+        the table of a subnet from its feature maps ({feature: {netuid: values}})
+        """
+        keys = state['key'][netuid]
+        n = len(keys)
+        columns = {'uid': np.arange(n), 'key': keys}
+        for f in (features or state.keys()):
+            if f in ['name', 'address', 'emission', 'incentive', 'dividends', 'last_update', 'regblock']:
+                columns[f] = state[f][netuid][:n]
+            elif f in ['trust']:
+                trust = list(state[f][netuid][:n])
+                columns[f] = trust + [0] * (n - len(trust))
+            elif f in ['delegation_fee']:
+                fees = state[f][netuid]
+                columns[f] = [fees.get(key, 20) for key in keys]
+            elif f in ['stake_from']:
+                key2stake_from = state[f].get(netuid, {})
+                columns[f] = [key2stake_from.get(key, []) for key in keys]
+                columns['stake'] = np.fromiter((sum(v for k, v in s) for s in columns[f]), dtype=np.float64, count=n)
+            elif f in ['weights']:
+                uid2weights = state[f].get(netuid, {})
+                columns[f] = [uid2weights.get(uid, []) for uid in range(n)]
+        return cls(columns)
+
+    @classmethod
+    def from_rows(cls, rows:List[dict]) -> 'ModuleTable':
+        features = list(rows[0].keys()) if len(rows) > 0 else []
+        return cls({f: [row.get(f, None) for row in rows] for f in features})
+
+    @classmethod
+    def concat(cls, tables:List['ModuleTable']) -> 'ModuleTable':
+        tables = [t for t in tables if len(t) > 0]
+        if len(tables) == 0:
+            return cls()
+        features = [f for f in tables[0].columns if all(f in t.columns for t in tables)]
+        columns = {f: np.concatenate([t.columns[f] for t in tables]) for f in features}
+        return cls(columns, amount_scale=tables[0].amount_scale)
+
+    def to_columns(self) -> Dict[str, list]:
+        """
+        the columns as lists (json serializable)
+        """
+        return {k: v.tolist() for k, v in self.columns.items()}
+
+    @property
+    def features(self) -> List[str]:
+        return list(self.columns.keys())
+
+    def __len__(self):
+        return len(next(iter(self.columns.values()))) if len(self.columns) > 0 else 0
+
+    def __contains__(self, feature:str):
+        return feature in self.columns
+
+    def __getitem__(self, idx):
+        if isinstance(idx, str):
+            return self.columns[idx]
+        if isinstance(idx, (int, np.integer)):
+            return self.rows(idx=[idx])[0]
+        return self.take(idx)
+
+    def __iter__(self):
+        return iter(self.rows())
+
+    def __repr__(self):
+        return f'<ModuleTable n={len(self)} features={self.features}>'
+
+    def take(self, idx) -> 'ModuleTable':
+        """
+        the sub table of an index array, a boolean mask or a slice
+        """
+        return ModuleTable({k: v[idx] for k, v in self.columns.items()}, amount_scale=self.amount_scale)
+
+    def select(self, features:List[str]) -> 'ModuleTable':
+        return ModuleTable({f: self.columns[f] for f in features if f in self.columns}, amount_scale=self.amount_scale)
+
+    def format(self, fmt:str = 'j', features:List[str] = None) -> 'ModuleTable':
+        """
+        converts the amounts (nano to tokens for fmt j) and the u16 ratios of every module at once
+        """
+        columns = dict(self.columns)
+        scale = 1
+        if fmt in ['token', 'unit', 'j', 'J']:
+            scale = 1 / 10**9
+            for f in self.amount_features:
+                if f in columns:
+                    columns[f] = columns[f] * scale
+        for f in self.ratio_features:
+            if f in columns:
+                columns[f] = columns[f] / U16_MAX
+        table = ModuleTable(columns, amount_scale=self.amount_scale * scale)
+        if features != None:
+            features = list(features) + (['stake'] if 'stake_from' in features and 'stake' not in features else [])
+            table = table.select(features)
+        return table
+
+    def filter(self, search:str = None, **feature2value) -> 'ModuleTable':
+        """
+        the modules whose name contains search (and whose features equal the given values)
+        """
+        mask = np.ones(len(self), dtype=bool)
+        if search != None:
+            mask &= np.char.find(self.columns['name'].astype(str), search) >= 0
+        for f, v in feature2value.items():
+            mask &= self.columns[f] == v
+        return self.take(mask)
+
+    def sort_values(self, feature:str) -> np.ndarray:
+        values = self.columns[feature]
+        if values.dtype == object:
+            # lists (weights, stake_from) rank by their length
+            values = np.fromiter((len(v) if isinstance(v, (list, tuple, dict)) else 0 for v in values), dtype=np.int64, count=len(values))
+        return values
+
+    def argsort(self, feature:str, reverse:bool = True) -> np.ndarray:
+        values = self.sort_values(feature)
+        idx = np.argsort(-values if reverse else values, kind='stable')
+        return idx
+
+    def sort(self, feature:str, reverse:bool = True) -> 'ModuleTable':
+        return self.take(self.argsort(feature, reverse=reverse))
+
+    def top(self, feature:str = 'stake', n:int = 10, reverse:bool = True) -> 'ModuleTable':
+        """
+        the n modules with the highest (lowest if not reverse) feature
+        """
+        values = self.sort_values(feature)
+        values = -values if reverse else values
+        if n != None and n < len(self):
+            # partition first so only the top n are sorted
+            idx = np.argpartition(values, n)[:n]
+            idx = idx[np.argsort(values[idx], kind='stable')]
+        else:
+            idx = np.argsort(values, kind='stable')
+        return self.take(idx)
+
+    def rows(self, features:List[str] = None, idx = None) -> List[dict]:
+        """
+        the modules as dicts (the only place they are built)
+        """
+        features = features or self.features
+        columns = []
+        for f in features:
+            values = self.columns[f] if idx is None else self.columns[f][idx]
+            values = values.tolist()
+            if f == 'stake_from' and self.amount_scale != 1:
+                values = [[[k, v * self.amount_scale] for k, v in s] for s in values]
+            columns.append(values)
+        return [dict(zip(features, row)) for row in zip(*columns)]
+
+    to_dicts = rows
+
+    def df(self, features:List[str] = None):
+        return c.df(self.rows(features=features))
+
+    @classmethod
+    def test(cls, n:int = 10000):
+        state = {'key': {0: [f'key{i}' for i in range(n)]},
+                 'name': {0: [f'module{i}' for i in range(n)]},
+                 'emission': {0: [i * 10**9 for i in range(n)]},
+                 'incentive': {0: [U16_MAX] * n},
+                 'stake_from': {0: {f'key{i}': [['staker', i * 10**9]] for i in range(n)}},
+                 'weights': {0: {0: [[1, 1], [2, 1]]}}}
+        t0 = c.time()
+        table = cls.from_state(state, netuid=0, features=['name', 'emission', 'incentive', 'stake_from', 'weights'])
+        table = table.format(fmt='j')
+        seconds = c.time() - t0
+        assert table['emission'][5] == 5 and table['incentive'][0] == 1
+        assert table[3]['stake_from'] == [['staker', 3]] and table[3]['stake'] == 3
+        top = table.top('stake', n=3)
+        assert top['name'].tolist() == [f'module{n-1}', f'module{n-2}', f'module{n-3}']
+        assert table.top('stake', n=2, reverse=False)['name'].tolist() == ['module0', 'module1']
+        assert table.sort('weights')[0]['name'] == 'module0'
+        assert len(table.filter(search='module99')) == len([i for i in range(n) if 'module99' in f'module{i}'])
+        loaded = cls(table.to_columns(), amount_scale=table.amount_scale)
+        assert loaded.rows() == table.rows()
+        assert len(cls.concat([table, table])) == 2 * n
+        return {'success': True, 'msg': 'module table test passed', 'build_and_format_seconds': seconds}
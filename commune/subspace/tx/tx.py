@@ -0,0 +1,456 @@
+import commune as c
+import os
+import json
+import threading
+import contextlib
+from typing import *
+
+
+class MockChain:
+    """
+    an extrinsic endpoint for tests with the nonce rules of a substrate node,
+    a submitted extrinsic waits in the pool until a block includes it (with all the nonces before it)
+    and the block keeps the events of its extrinsics, a call to one of the failing_fns fails like a dispatch error
+    """
+    def __init__(self, block_time:float = 0.05, failing_fns:List[str] = None):
+        self.key2nonce = {} # the nonce on chain
+        self.pool = {} # (ss58, nonce) -> extrinsic
+        self.included = []
+        self.blocks = [{'hash': '0x' + c.hash('block_0'), 'extrinsics': [], 'events': []}]
+        self.failing_fns = failing_fns or []
+        self.submits = 0
+        self.lock = threading.Lock()
+        self.stopped = False
+        self.block_time = block_time
+        c.thread(self.produce_blocks)
+
+    def get_account_nonce(self, ss58:str) -> int:
+        # like system_accountNextIndex, the nonces waiting in the pool count
+        with self.lock:
+            nonce = self.key2nonce.get(ss58, 0)
+            while (ss58, nonce) in self.pool:
+                nonce += 1
+            return nonce
+
+    def query(self, module:str, name:str, params:list):
+        with self.lock:
+            return c.munch({'value': {'nonce': self.key2nonce.get(params[0], 0)}})
+
+    def compose_call(self, call_module:str, call_function:str, call_params:dict) -> dict:
+        return {'call_module': call_module, 'call_function': call_function, 'call_params': call_params}
+
+    def create_signed_extrinsic(self, call:dict, keypair, nonce:int, tip:int = 0) -> dict:
+        return {'ss58': keypair.ss58_address, 'nonce': nonce, 'call': call, 'extrinsic_hash': '0x' + c.hash(f'{keypair.ss58_address}{nonce}{call}')}
+
+    def submit_extrinsic(self, extrinsic:dict, wait_for_inclusion:bool = False, wait_for_finalization:bool = False):
+        with self.lock:
+            self.submits += 1
+            ss58, nonce = extrinsic['ss58'], extrinsic['nonce']
+            if nonce < self.key2nonce.get(ss58, 0):
+                raise Exception({'code': 1010, 'message': 'Invalid Transaction', 'data': 'Transaction is outdated'})
+            if (ss58, nonce) in self.pool:
+                raise Exception({'code': 1014, 'message': 'Priority is too low: (0 vs 0)', 'data': 'The transaction has too low priority to replace another transaction already in the pool.'})
+            self.pool[(ss58, nonce)] = extrinsic
+        return c.munch({'extrinsic_hash': extrinsic['extrinsic_hash']})
+
+    def event(self, idx:int, module_id:str, event_id:str, attributes:dict = None):
+        return c.munch({'value': {'extrinsic_idx': idx, 'module_id': module_id, 'event_id': event_id, 'attributes': attributes}})
+
+    def dispatch(self, idx:int, call:dict) -> list:
+        """
+        the events of an extrinsic, batch_all fails as a whole and batch stops at the failing call
+        """
+        error = {'Module': {'index': 0, 'error': '0x00000000'}}
+        if call['call_module'] != 'Utility':
+            if call['call_function'] in self.failing_fns:
+                return [self.event(idx, 'System', 'ExtrinsicFailed', {'dispatch_error': error})]
+            return [self.event(idx, 'System', 'ExtrinsicSuccess')]
+        calls = call['call_params']['calls']
+        failed = [i for i, call in enumerate(calls) if call['call_function'] in self.failing_fns]
+        if len(failed) == 0:
+            return [self.event(idx, 'Utility', 'BatchCompleted'), self.event(idx, 'System', 'ExtrinsicSuccess')]
+        if call['call_function'] == 'batch_all':
+            return [self.event(idx, 'System', 'ExtrinsicFailed', {'dispatch_error': error})]
+        return [self.event(idx, 'Utility', 'BatchInterrupted', {'index': failed[0], 'error': error}),
+                self.event(idx, 'System', 'ExtrinsicSuccess')]
+
+    def produce_blocks(self):
+        while not self.stopped:
+            c.sleep(self.block_time)
+            with self.lock:
+                block = {'hash': '0x' + c.hash(f'block_{len(self.blocks)}'), 'extrinsics': [], 'events': []}
+                for ss58, nonce in sorted(self.pool):
+                    if nonce == self.key2nonce.get(ss58, 0):
+                        extrinsic = self.pool.pop((ss58, nonce))
+                        block['events'] += self.dispatch(len(block['extrinsics']), extrinsic['call'])
+                        block['extrinsics'].append(extrinsic)
+                        self.included.append(extrinsic)
+                        self.key2nonce[ss58] = nonce + 1
+                self.blocks.append(block)
+
+    def get_block_number(self, block_hash:str = None) -> int:
+        with self.lock:
+            if block_hash == None:
+                return len(self.blocks) - 1
+            return [block['hash'] for block in self.blocks].index(block_hash)
+
+    def get_block_hash(self, block_id:int = None) -> str:
+        with self.lock:
+            return self.blocks[-1 if block_id == None else block_id]['hash']
+
+    def get_extrinsics(self, block_hash:str = None, block_number:int = None) -> list:
+        block_number = self.get_block_number(block_hash) if block_number == None else block_number
+        return [c.munch({'value': {'extrinsic_hash': extrinsic['extrinsic_hash']}}) for extrinsic in self.blocks[block_number]['extrinsics']]
+
+    def retrieve_extrinsic_by_hash(self, block_hash:str, extrinsic_hash:str):
+        block = self.blocks[self.get_block_number(block_hash)]
+        idx = [extrinsic['extrinsic_hash'] for extrinsic in block['extrinsics']].index(extrinsic_hash)
+        return c.munch({'block_hash': block_hash,
+                        'extrinsic_hash': extrinsic_hash,
+                        'triggered_events': [event for event in block['events'] if event.value['extrinsic_idx'] == idx]})
+
+    def bump(self, ss58:str, n:int = 1):
+        """
+        includes n transactions of the key that were sent from somewhere else
+        """
+        with self.lock:
+            self.key2nonce[ss58] = self.key2nonce.get(ss58, 0) + n
+
+    def stop(self):
+        self.stopped = True
+
+
+class TxStore:
+    """
+    the transactions of a key, an append only log with one json line per status update,
+    the updates are folded by tx id when it is read and the log is compacted once it is mostly old updates
+    """
+    def __init__(self, path:str):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.lock = threading.Lock()
+        self.id2tx = {}
+        self.lines = 0
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        tx = json.loads(line)
+                    except Exception as e:
+                        continue # a partial line from an interrupted write
+                    self.id2tx[tx['id']] = {**self.id2tx.get(tx['id'], {}), **tx}
+                    self.lines += 1
+
+    def put(self, tx:dict):
+        with self.lock:
+            self.id2tx[tx['id']] = {**self.id2tx.get(tx['id'], {}), **tx}
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(tx, default=str) + '\n')
+            self.lines += 1
+            if self.lines > 2 * len(self.id2tx) + 100:
+                self.compact()
+
+    def compact(self):
+        with open(self.path + '.tmp', 'w') as f:
+            f.write(''.join(json.dumps(tx, default=str) + '\n' for tx in self.id2tx.values()))
+        os.replace(self.path + '.tmp', self.path)
+        self.lines = len(self.id2tx)
+
+    def txs(self, status:List[str] = None) -> List[dict]:
+        with self.lock:
+            return [tx for tx in self.id2tx.values() if status == None or tx.get('status', None) in status]
+
+
+class TxPipeline(c.Module):
+    """
+    Pipelined submission of many calls from many keys
+
+    - the calls of a key are packed into Utility batches of at most max_calls
+    - the nonces of a key are allocated locally (fetched once from the chain), so the batches of a key
+      are sent back to back without waiting for the previous one to be included
+    - the keys are sent concurrently, each from its own connection
+    - a nonce conflict (outdated, or too low priority for a nonce in the pool) refetches the nonce and resends
+    - once the nonce of its key on chain is past its nonce, a batch is looked up in the blocks since it was sent,
+      it is included if its events succeed and failed on ExtrinsicFailed or BatchInterrupted (or if another
+      extrinsic took its nonce)
+    every status change (pending, submitted, included, failed) is appended to the TxStore of the key
+    """
+    pending_status = ['pending', 'submitted']
+    complete_status = ['included', 'failed']
+    failed_events = [('System', 'ExtrinsicFailed'), ('Utility', 'BatchInterrupted')]
+    nonce_conflicts = ['Transaction is outdated', 'Priority is too low', 'Stale']
+    path2store = {} # one TxStore per path per process
+
+    def __init__(self,
+                 connection:Callable = None, # a context manager of a substrate connection (SubstratePool.connection)
+                 network:str = 'main',
+                 max_calls:int = 100, # calls per batch
+                 batch_fn:str = 'batch_all', # batch_all reverts the whole batch if a call fails, batch stops at the failing call
+                 max_retries:int = 3, # resends on a nonce conflict
+                 wait_for_inclusion:bool = True,
+                 timeout:float = 120, # seconds to wait for the inclusion of a key's batches
+                 poll_interval:float = 2, # seconds between checks of the nonces on chain
+                 tip:int = 0):
+        self.connection = connection
+        self.network = network
+        self.max_calls = max_calls
+        self.batch_fn = batch_fn
+        self.max_retries = max_retries
+        self.wait_for_inclusion = wait_for_inclusion
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.tip = tip
+        self.key2nonce = {}
+        self.nonce_lock = threading.Lock()
+        self.stats = {'txs': 0, 'calls': 0, 'retries': 0, 'failed': 0, 'included': 0}
+        self.stats_lock = threading.Lock()
+
+    def count(self, **kwargs):
+        # the keys are sent from several threads
+        with self.stats_lock:
+            for k, v in kwargs.items():
+                self.stats[k] += v
+
+    @classmethod
+    def store(cls, key_ss58:str, network:str = 'main') -> TxStore:
+        """
+        the shared store of the transactions of a key
+        """
+        path = cls.resolve_path(f'history/{network}/{key_ss58}.jsonl')
+        if path not in cls.path2store:
+            cls.path2store[path] = TxStore(path)
+        return cls.path2store[path]
+
+    @classmethod
+    def history(cls, key_ss58:str, network:str = 'main', mode:str = 'complete') -> List[dict]:
+        assert mode in ['pending', 'complete', 'all'], f'Invalid mode {mode}'
+        status = {'pending': cls.pending_status, 'complete': cls.complete_status, 'all': None}[mode]
+        return cls.store(key_ss58, network=network).txs(status=status)
+
+    def next_nonce(self, substrate, key_ss58:str) -> int:
+        with self.nonce_lock:
+            if key_ss58 not in self.key2nonce:
+                self.key2nonce[key_ss58] = substrate.get_account_nonce(key_ss58)
+            nonce = self.key2nonce[key_ss58]
+            self.key2nonce[key_ss58] += 1
+            return nonce
+
+    def release_nonce(self, key_ss58:str, nonce:int):
+        """
+        gives back a nonce that was not used, the next one is fetched again unless it was the last one handed out
+        """
+        with self.nonce_lock:
+            if self.key2nonce.get(key_ss58, None) == nonce + 1:
+                self.key2nonce[key_ss58] = nonce
+            else:
+                self.key2nonce.pop(key_ss58, None)
+
+    def reset_nonce(self, key_ss58:str):
+        with self.nonce_lock:
+            self.key2nonce.pop(key_ss58, None)
+
+    def is_nonce_conflict(self, e:Exception) -> bool:
+        return any(m in str(e) for m in self.nonce_conflicts)
+
+    @staticmethod
+    def chain_nonce(substrate, key_ss58:str) -> int:
+        """
+        the nonce of the key on chain (without the transactions in the pool)
+        """
+        return substrate.query('System', 'Account', [key_ss58]).value['nonce']
+
+    def submit(self, calls:List[dict]) -> List[dict]:
+        """
+        calls : [{key, fn, params, module='SubspaceModule'}]
+        returns the transactions (one per batch) in the order of the keys
+        """
+        key2calls = {}
+        key2keypair = {}
+        for call in calls:
+            key = call['key']
+            key2keypair[key.ss58_address] = key
+            key2calls.setdefault(key.ss58_address, []).append(call)
+        futures = [c.submit(self.send_key, kwargs={'key': key2keypair[ss58], 'calls': key_calls}, timeout=self.timeout + 60)
+                   for ss58, key_calls in key2calls.items()]
+        txs = []
+        for result in c.wait(futures, timeout=self.timeout + 60):
+            assert isinstance(result, list), f'Failed to send the transactions: {result}'
+            txs += result
+        return txs
+
+    def send_key(self, key, calls:List[dict]) -> List[dict]:
+        """
+        sends the batches of a key back to back and waits until they are included
+        """
+        ss58 = key.ss58_address
+        store = self.store(ss58, network=self.network)
+        txs = []
+        for i in range(0, len(calls), self.max_calls):
+            chunk = calls[i:i + self.max_calls]
+            tx = {'id': f'{c.time()}_{c.random_int(0, 10**6)}',
+                  'status': 'pending',
+                  'fns': [call['fn'] for call in chunk],
+                  'start_time': c.time()}
+            store.put(tx)
+            txs.append(tx)
+        with self.connection() as substrate:
+            block = substrate.get_block_number(None) # the batches are included after this block
+            for i, tx in enumerate(txs):
+                tx['block'] = block
+                self.send(substrate, key, calls[i * self.max_calls:(i + 1) * self.max_calls], tx)
+                store.put({k: tx[k] for k in ['id', 'status', 'nonce', 'tx_hash', 'block', 'error'] if k in tx})
+        if self.wait_for_inclusion:
+            self.wait_included(ss58, txs)
+        return txs
+
+    def send(self, substrate, key, calls:List[dict], tx:dict) -> dict:
+        ss58 = key.ss58_address
+        composed = [substrate.compose_call(call_module=call.get('module', 'SubspaceModule'),
+                                           call_function=call['fn'],
+                                           call_params=call.get('params', {})) for call in calls]
+        if len(composed) == 1:
+            call = composed[0]
+        else:
+            call = substrate.compose_call(call_module='Utility', call_function=self.batch_fn, call_params={'calls': composed})
+        for trial in range(self.max_retries + 1):
+            nonce = self.next_nonce(substrate, ss58)
+            try:
+                extrinsic = substrate.create_signed_extrinsic(call=call, keypair=key, nonce=nonce, tip=self.tip)
+                receipt = substrate.submit_extrinsic(extrinsic=extrinsic, wait_for_inclusion=False, wait_for_finalization=False)
+                tx.update(status='submitted', nonce=nonce, tx_hash=receipt.extrinsic_hash)
+                break
+            except Exception as e:
+                if self.is_nonce_conflict(e) and trial < self.max_retries:
+                    self.reset_nonce(ss58)
+                    self.count(retries=1)
+                    continue
+                self.release_nonce(ss58, nonce)
+                tx.update(status='failed', error=str(e), end_time=c.time())
+                self.count(failed=1)
+                break
+        self.count(txs=1, calls=len(calls))
+        return tx
+
+    def receipt(self, substrate, tx:dict, head:int):
+        """
+        the receipt of the transaction in the blocks since it was sent (up to the head), None if another extrinsic took its nonce
+        """
+        for number in range(tx['block'], head + 1):
+            block_hash = substrate.get_block_hash(number)
+            for extrinsic in substrate.get_extrinsics(block_hash=block_hash) or []:
+                if extrinsic.value.get('extrinsic_hash', None) == tx['tx_hash']:
+                    tx['block'] = number # the block that included it
+                    return substrate.retrieve_extrinsic_by_hash(block_hash, tx['tx_hash'])
+        return None
+
+    def receipt_error(self, receipt) -> Optional[str]:
+        """
+        the error of a receipt from its events, None if the extrinsic (and every call of its batch) succeeded
+        """
+        if receipt == None:
+            return 'Transaction was replaced by another extrinsic with the same nonce'
+        for event in receipt.triggered_events:
+            event = event.value
+            if (event['module_id'], event['event_id']) in self.failed_events:
+                return f"{event['module_id']}.{event['event_id']}: {event.get('attributes', None)}"
+        return None
+
+    def wait_included(self, key_ss58:str, txs:List[dict]) -> List[dict]:
+        """
+        polls the nonce of the key on chain until it is past the nonces of the transactions (or the timeout),
+        then resolves each transaction from the events of its receipt
+        """
+        store = self.store(key_ss58, network=self.network)
+        pending = [tx for tx in txs if tx['status'] == 'submitted']
+        t0 = c.time()
+        while len(pending) > 0 and c.time() - t0 < self.timeout:
+            with self.connection() as substrate:
+                nonce = self.chain_nonce(substrate, key_ss58)
+                head = substrate.get_block_number(None)
+                for tx in sorted(pending, key=lambda tx: tx['nonce']):
+                    if tx['nonce'] >= nonce:
+                        continue
+                    receipt = self.receipt(substrate, tx, head)
+                    error = self.receipt_error(receipt)
+                    if error == None:
+                        tx.update(status='included', block_hash=receipt.block_hash, end_time=c.time())
+                        self.count(included=1)
+                    else:
+                        tx.update(status='failed', error=error, end_time=c.time())
+                        if receipt != None:
+                            tx['block_hash'] = receipt.block_hash
+                        self.count(failed=1)
+                    store.put({k: tx[k] for k in ['id', 'status', 'block', 'block_hash', 'error', 'end_time'] if k in tx})
+            pending = [tx for tx in pending if tx['status'] == 'submitted']
+            if len(pending) > 0:
+                c.sleep(self.poll_interval)
+        return txs
+
+    @classmethod
+    def test(cls, n_keys:int = 8, n_calls:int = 250, network:str = 'test_tx'):
+        cls.rm(f'history/{network}')
+        cls.path2store = {}
+        chain = MockChain()
+        try:
+            self = cls(connection=lambda: contextlib.nullcontext(chain), network=network, poll_interval=0.05, timeout=30)
+            keys = [c.module('key').gen() for i in range(n_keys)]
+            # a wallet of the first key sends on its own while the pipeline has its nonce cached
+            self.next_nonce(chain, keys[0].ss58_address)
+            self.release_nonce(keys[0].ss58_address, 0)
+            chain.bump(keys[0].ss58_address, 2)
+            calls = [{'key': key, 'fn': 'add_stake', 'params': {'netuid': 0, 'module_key': key.ss58_address, 'amount': i}}
+                     for key in keys for i in range(n_calls)]
+            t0 = c.time()
+            txs = self.submit(calls)
+            seconds = c.time() - t0
+            batches = -(-n_calls // self.max_calls)
+            assert len(txs) == n_keys * batches, len(txs)
+            assert all(tx['status'] == 'included' for tx in txs), [tx for tx in txs if tx['status'] != 'included']
+            assert self.stats['retries'] >= 1 and self.stats['calls'] == n_keys * n_calls, self.stats
+            assert chain.key2nonce[keys[0].ss58_address] == 2 + batches
+            assert sum(len(tx['call']['call_params']['calls']) for tx in chain.included) == n_keys * n_calls
+            history = cls.history(keys[1].ss58_address, network=network)
+            assert len(history) == batches and all(tx['status'] == 'included' for tx in history)
+            # the store folds the updates when it is loaded again
+            cls.path2store = {}
+            assert [tx['status'] for tx in cls.history(keys[1].ss58_address, network=network)] == ['included'] * batches
+            assert cls.history(keys[1].ss58_address, network=network, mode='pending') == []
+            return {'success': True, 'msg': 'tx pipeline test passed', 'seconds': seconds, 'submits': chain.submits, **self.stats}
+        finally:
+            chain.stop()
+            cls.rm(f'history/{network}')
+            cls.path2store = {}
+
+    @classmethod
+    def test_failed_batches(cls, network:str = 'test_tx_failed'):
+        cls.rm(f'history/{network}')
+        cls.path2store = {}
+        chain = MockChain(failing_fns=['remove_stake'])
+        try:
+            key2status = {}
+            for batch_fn in ['batch_all', 'batch']:
+                self = cls(connection=lambda: contextlib.nullcontext(chain), network=network, poll_interval=0.05, timeout=30, max_calls=3, batch_fn=batch_fn)
+                key = c.module('key').gen()
+                fns = ['add_stake', 'add_stake', 'add_stake', # a batch that succeeds
+                       'add_stake', 'remove_stake', 'add_stake', # a batch with a failing call
+                       'remove_stake'] # a single failing call
+                txs = self.submit([{'key': key, 'fn': fn, 'params': {'netuid': 0, 'amount': i}} for i, fn in enumerate(fns)])
+                assert [tx['status'] for tx in txs] == ['included', 'failed', 'failed'], txs
+                event = 'Utility.BatchInterrupted' if batch_fn == 'batch' else 'System.ExtrinsicFailed'
+                assert event in txs[1]['error'], txs[1]
+                assert 'System.ExtrinsicFailed' in txs[2]['error'], txs[2]
+                assert self.stats['included'] == 1 and self.stats['failed'] == 2, self.stats
+                cls.path2store = {}
+                key2status[batch_fn] = [tx['status'] for tx in cls.history(key.ss58_address, network=network)]
+                assert key2status[batch_fn] == ['included', 'failed', 'failed'], key2status
+            # a nonce taken by another extrinsic is not included
+            self = cls(connection=lambda: contextlib.nullcontext(chain), network=network, poll_interval=0.05, timeout=30)
+            key = c.module('key').gen()
+            tx = {'id': 'replaced', 'status': 'submitted', 'nonce': 0, 'tx_hash': '0x' + c.hash('other'), 'block': chain.get_block_number(None)}
+            chain.bump(key.ss58_address)
+            assert self.wait_included(key.ss58_address, [tx])[0]['status'] == 'failed' and 'replaced' in tx['error'], tx
+            return {'success': True, 'msg': 'failed batches are resolved from their events', 'history': key2status}
+        finally:
+            chain.stop()
+            cls.rm(f'history/{network}')
+            cls.path2store = {}
@@ -0,0 +1,267 @@
+import commune as c
+import os
+import json
+import atexit
+import threading
+from typing import *
+
+class Scores(c.Module):
+    """
+    In-memory columnar table of module scores for the validator
+
+    every module is one row of the columns (name, key, uid, w, latency, timestamp, info),
+    info is a dict with the other fields of the module record (schema, history, ...), reads never touch disk and updates are persisted in batches (write-behind)
+        {path}/scores.json        compact columnar snapshot {column: [values]}
+        {path}/scores.log.jsonl   the rows updated since the snapshot, one json row per line
+    loading replays the log over the snapshot, the log is compacted into the snapshot once it is max_log rows long
+    """
+    columns = ['name', 'key', 'uid', 'w', 'latency', 'timestamp', 'info']
+    score_columns = ['name', 'key', 'uid', 'w', 'latency', 'timestamp']
+    path2store = {} # one store per path per process
+
+    def __init__(self,
+                 path:str = 'scores',
+                 flush_interval:float = 10.0, # seconds between background flushes
+                 max_log:int = 10000, # rows in the log before it is compacted into the snapshot
+                 ):
+        self.path = path
+        self.dirpath = self.resolve_path(path)
+        os.makedirs(self.dirpath, exist_ok=True)
+        self.flush_interval = flush_interval
+        self.max_log = max_log
+        self.lock = threading.Lock() # guards the table
+        self.flush_lock = threading.Lock() # guards the log and the snapshot
+        self.table = {k: [] for k in self.columns}
+        self.name2row = {}
+        self.dirty = {} # name -> row (None if removed) that are not flushed yet
+        self.log_size = 0
+        self.version = 0 # bumped on every change, votes are cached per version
+        self.cache = {}
+        self.closed = False
+        self.load()
+        c.thread(self.flush_loop)
+        atexit.register(self.flush)
+
+    @classmethod
+    def store(cls, path:str = 'scores', **kwargs) -> 'Scores':
+        """
+        the shared store of a path
+        """
+        if path not in cls.path2store:
+            cls.path2store[path] = cls(path=path, **kwargs)
+        return cls.path2store[path]
+
+    @property
+    def snapshot_path(self) -> str:
+        return os.path.join(self.dirpath, 'scores.json')
+
+    @property
+    def log_path(self) -> str:
+        return os.path.join(self.dirpath, 'scores.log.jsonl')
+
+    def __len__(self):
+        return len(self.name2row)
+
+    def __contains__(self, name:str):
+        return name in self.name2row
+
+    def get_row(self, name:str, default=None) -> Optional[dict]:
+        i = self.name2row.get(name, None)
+        if i == None:
+            return default
+        return {k: self.table[k][i] for k in self.columns}
+
+    def update(self, name:str, row:dict = None, **kwargs) -> dict:
+        """
+        sets the columns of the row of the module (adding the row if it is new), the other keys are merged into its info
+        """
+        row = {**(row or {}), **kwargs}
+        info = {k: v for k, v in row.items() if k not in self.columns}
+        row = {k: v for k, v in row.items() if k in self.columns and k != 'name'}
+        with self.lock:
+            if len(info) > 0:
+                i = self.name2row.get(name, None)
+                info = {**((self.table['info'][i] or {}) if i != None else {}), **(row.get('info', None) or {}), **info}
+                row['info'] = info
+            self._set_row(name, row)
+            self.dirty[name] = self.get_row(name)
+            self.version += 1
+        return self.dirty[name]
+
+    def _set_row(self, name:str, row:dict):
+        i = self.name2row.get(name, None)
+        if i == None:
+            i = self.name2row[name] = len(self.table['name'])
+            for k in self.columns:
+                self.table[k].append(name if k == 'name' else None)
+        for k, v in row.items():
+            self.table[k][i] = v
+
+    def remove(self, name:str) -> bool:
+        """
+        removes the row by moving the last row into its place
+        """
+        with self.lock:
+            removed = self._remove_row(name)
+            if removed:
+                self.dirty[name] = None
+                self.version += 1
+        return removed
+
+    def _remove_row(self, name:str) -> bool:
+        i = self.name2row.pop(name, None)
+        if i == None:
+            return False
+        last = len(self.table['name']) - 1
+        for k in self.columns:
+            self.table[k][i] = self.table[k][last]
+            self.table[k].pop()
+        if i != last:
+            self.name2row[self.table['name'][i]] = i
+        return True
+
+    def rows(self, keys:List[str] = None) -> List[dict]:
+        keys = keys or self.columns
+        with self.lock:
+            columns = [self.table[k] for k in keys]
+            return [dict(zip(keys, values)) for values in zip(*columns)]
+
+    def votes(self, key2uid:Dict[str, int] = None) -> dict:
+        """
+        the weight vector of the modules with a key (and a uid), cached until the next change
+        """
+        if self.cache.get('version') == self.version and self.cache.get('key2uid') is key2uid:
+            return self.cache['votes']
+        votes = {'keys': [], 'weights': [], 'uids': [], 'timestamp': c.time()}
+        with self.lock:
+            for key, uid, w in zip(self.table['key'], self.table['uid'], self.table['w']):
+                if key == None or w == None or w < 0:
+                    continue
+                uid = key2uid.get(key, None) if key2uid != None else uid
+                if uid == None:
+                    continue
+                votes['keys'].append(key)
+                votes['weights'].append(w)
+                votes['uids'].append(uid)
+        self.cache = {'version': self.version, 'key2uid': key2uid, 'votes': votes}
+        return votes
+
+    def df(self, sort_by:List[str] = ['w', 'staleness']):
+        df = c.df(self.rows(keys=self.score_columns))
+        if len(df) > 0:
+            df['staleness'] = c.time() - df['timestamp'].fillna(0)
+            df.sort_values(by=sort_by, ascending=False, inplace=True)
+        return df
+
+    leaderboard = df
+
+    def load(self):
+        """
+        loads the snapshot and replays the log over it
+        """
+        if os.path.exists(self.snapshot_path):
+            try:
+                with open(self.snapshot_path) as f:
+                    table = json.load(f)
+                for i, name in enumerate(table['name']):
+                    self._set_row(name, {k: table[k][i] for k in self.columns if k in table and k != 'name'})
+            except Exception as e:
+                c.print(f'Failed to load {self.snapshot_path}: {e}', color='red')
+        if os.path.exists(self.log_path):
+            with open(self.log_path) as f:
+                for line in f:
+                    try:
+                        row = json.loads(line)
+                    except Exception as e:
+                        continue # a partial line from an interrupted flush
+                    self.log_size += 1
+                    if row.get('removed', False):
+                        self._remove_row(row['name'])
+                    else:
+                        self._set_row(row['name'], {k: v for k, v in row.items() if k in self.columns and k != 'name'})
+        return {'success': True, 'n': len(self), 'log_size': self.log_size}
+
+    def flush_loop(self):
+        while not self.closed:
+            c.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                c.print(f'Failed to flush {self.path}: {e}', color='red')
+
+    def flush(self) -> dict:
+        """
+        appends the changed rows to the log, compacts the log into the snapshot when it is too long
+        """
+        if self.closed:
+            return {'success': False, 'msg': 'store is closed'}
+        with self.flush_lock:
+            with self.lock:
+                dirty, self.dirty = self.dirty, {}
+                if len(dirty) == 0:
+                    return {'success': True, 'n': 0}
+                if self.log_size + len(dirty) >= self.max_log:
+                    self.compact()
+                    return {'success': True, 'n': len(dirty), 'compacted': True}
+            lines = ''.join(json.dumps(row if row != None else {'name': name, 'removed': True}, default=str) + '\n'
+                            for name, row in dirty.items())
+            with open(self.log_path, 'a') as f:
+                f.write(lines)
+            self.log_size += len(dirty)
+        return {'success': True, 'n': len(dirty)}
+
+    def compact(self):
+        """
+        writes the table as the snapshot and truncates the log (hold both locks)
+        """
+        with open(self.snapshot_path + '.tmp', 'w') as f:
+            json.dump(self.table, f, default=str)
+        os.replace(self.snapshot_path + '.tmp', self.snapshot_path)
+        if os.path.exists(self.log_path):
+            os.remove(self.log_path)
+        self.log_size = 0
+
+    @classmethod
+    def rm_store(cls, path:str = 'scores'):
+        store = cls.path2store.pop(path, None)
+        if store != None:
+            store.closed = True
+        return cls.rm(path)
+
+    @classmethod
+    def test(cls, n:int = 5000, path:str = 'test_scores'):
+        cls.rm_store(path)
+        self = cls.store(path, max_log=n + 2)
+        t0 = c.time()
+        for i in range(n):
+            self.update(f'module{i}', key=f'key{i}', w=i / n, latency=0.1, timestamp=t0)
+        update_us = 1e6 * (c.time() - t0) / n
+        key2uid = {f'key{i}': i for i in range(0, n, 2)}
+        t0 = c.time()
+        votes = self.votes(key2uid)
+        votes_ms = 1000 * (c.time() - t0)
+        assert len(votes['uids']) == n // 2
+        assert self.votes(key2uid) is votes # cached until the next change
+        self.flush()
+        assert self.remove('module0') and 'module0' not in self
+        assert self.get_row('module1')['w'] == 1 / n
+        self.update('module1', w=0.5)
+        self.flush() # compacts, the log is full
+        assert not os.path.exists(self.log_path)
+        self.update('module2', w=0.25)
+        self.flush()
+        loaded = cls(path=path)
+        loaded.closed = True
+        assert len(loaded) == n - 1, len(loaded)
+        assert loaded.get_row('module1')['w'] == 0.5
+        assert loaded.get_row('module2')['w'] == 0.25
+        # the fields that are not score columns are kept in the info of the row
+        self.update('module3', w=0.75, schema={'forward': {}}, history=[{'w': 0.75}])
+        self.update('module3', history=[{'w': 0.75}, {'w': 0.5}])
+        assert self.get_row('module3')['info'] == {'schema': {'forward': {}}, 'history': [{'w': 0.75}, {'w': 0.5}]}
+        self.flush()
+        loaded = cls(path=path)
+        loaded.closed = True
+        assert loaded.get_row('module3')['info']['schema'] == {'forward': {}} and loaded.get_row('module3')['w'] == 0.75
+        cls.rm_store(path)
+        return {'success': True, 'msg': 'scores test passed', 'update_us': update_us, 'votes_ms': votes_ms}
@@ -1,5 +1,11 @@
 
 import commune as c
+import asyncio
+import inspect
+import heapq
+from collections import deque
+from typing import *
+
 class Vali(c.Module):
     
     last_sync_time = 0
@@ -36,8 +42,23 @@ class Vali(c.Module):
             'vote_interval': self.config.vote_interval,
             'epochs': self.epochs,
             'workers': self.workers(),
+            **self.eval_stats(),
         }
         return info
+
+    def eval_stats(self, window:int = 60) -> dict:
+        """
+        the throughput of the engine over the last window seconds and the evals in flight
+        """
+        now = c.time()
+        eval_times = getattr(self, 'eval_times', [])
+        recent = [t for t in eval_times if now - t < window]
+        elapsed = min(window, now - getattr(self, 'start_time', now)) or 1
+        return {'evals_per_second': len(recent) / elapsed,
+                'in_flight': len(getattr(self, 'in_flight', [])),
+                'requests': self.requests,
+                'successes': self.successes,
+                'errors': self.errors}
     
 
     
@@ -101,74 +122,127 @@ class Vali(c.Module):
 
     @classmethod        
     def worker(cls, config = None, id = 0, **kwargs):
-        color = c.random_color()
-
         self = cls(config=config, **kwargs)
-        worker_name = self.worker_name(id)
+        # every worker thread (or process) runs the engine on an event loop of its own
+        loop = c.new_event_loop(nest_asyncio=True)
+        return loop.run_until_complete(self.async_worker(id=id))
 
-        batch_size = self.config.batch_size 
+    async def async_worker(self, id = 0, max_evals:int = None):
+        """
+        keeps batch_size evaluations in flight, picking the stalest module next, 
+        until the worker is stopped (or max_evals evaluations are done)
+        """
+        color = c.random_color()
+        worker_name = self.worker_name(id)
         self.running = True
+        self.start_time = c.time()
         last_print = 0
-        executor = c.module('executor.thread')(max_workers=self.config.threads_per_worker)
-        futures = []
+        n_evals = 0
+        pending = set()
+        loop = asyncio.get_running_loop()
 
         while self.running:
-            
             if c.time() - self.last_sync_time > self.config.sync_interval:
-                self.sync()
+                # the namespace can take a while, the evaluations in flight keep going meanwhile,
+                # it is fetched in a thread and applied here, so the schedule only changes on the loop
+                network = await loop.run_in_executor(None, self.fetch_network)
+                self.apply_network(**network)
+
+            # keep the window full
+            while len(pending) < self.config.batch_size and (max_evals == None or n_evals + len(pending) < max_evals):
+                module = self.next_module()
+                if module == None:
+                    break
+                self.in_flight.add(module)
+                self.last_sent = c.time()
+                pending.add(asyncio.ensure_future(self.async_eval_module(module)))
+
+            if len(pending) == 0:
+                if max_evals != None and n_evals >= max_evals:
+                    break
+                # every module was evaluated within max_staleness
+                await asyncio.sleep(self.config.sleep_time)
+                continue
 
-            module_addresses = c.shuffle(list(self.namespace.values()))
-            batch_size = min(batch_size, len(module_addresses))
-            
-            # select a module
-            for  i, module_address in enumerate(module_addresses):
-                
-
-                # if the futures are less than the batch, we can submit a new future
-                if len(futures) < batch_size:
-                    self.last_sent = c.time()
-                    future = executor.submit(self.eval_module, args=[module_address], timeout=self.config.timeout)
-                    futures.append(future)
+            done, pending = await asyncio.wait(pending, timeout=self.config.print_interval, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                n_evals += 1
+                try:
+                    result = task.result()
+                except Exception as e:
+                    result = c.detailed_error(e)
+                if c.is_error(result):
+                    self.errors += 1
                 else:
-                    try:
-                        for ready_future in c.as_completed(futures, timeout=self.config.timeout):
-                            result = ready_future.result()
-
-                            if c.is_error(result):
-                                self.errors += 1
-                            else:
-                                self.successes += 1
-                                self.last_success = c.time()
-                            c.print(result, verbose=self.config.verbose or self.config.debug)
-
-                            futures.remove(ready_future)
-                            break
-                    except Exception as e:
-                        self.errors += 1
-                        result = c.detailed_error(e)
-                        c.print(result, verbose=self.config.verbose or self.config.debug)
-
-                        continue
-
-                    
-                    
-                if c.time() - last_print > self.config.print_interval:
-                    stats =  {
-                        'successes': self.successes,
-                        'sent': self.requests,
-                        'errors': self.errors,
-                        'network': self.network,
-                        'pending': len(futures),
-                        'vote_staleness': self.vote_staleness,
-                        'last_success': c.round(c.time() - self.last_success,2),
-                        'last_sent': c.round(c.time() - self.last_sent,2),
-                        'worker_name': worker_name,
-                            }
-                    self.put(f'clone_stats/{worker_name}', stats)
-                    c.print(stats, color=color)
-                    last_print = c.time()
-                
-
+                    self.last_success = c.time()
+                c.print(result, verbose=self.config.verbose or self.config.debug)
+
+            if c.time() - last_print > self.config.print_interval:
+                stats =  {
+                    'successes': self.successes,
+                    'sent': self.requests,
+                    'errors': self.errors,
+                    'network': self.network,
+                    'pending': len(pending),
+                    'vote_staleness': self.vote_staleness,
+                    'last_success': c.round(c.time() - self.last_success,2),
+                    'last_sent': c.round(c.time() - self.last_sent,2),
+                    'worker_name': worker_name,
+                    **self.eval_stats(),
+                        }
+                self.put(f'clone_stats/{worker_name}', stats)
+                c.print(stats, color=color)
+                last_print = c.time()
+
+        for task in pending:
+            task.cancel()
+        return {'success': True, 'evals': n_evals, **self.eval_stats()}
+
+    def schedule_modules(self):
+        """
+        (re)builds the staleness schedule, a heap of (last eval time, module) for the namespace
+        """
+        module2time = getattr(self, 'module2time', {})
+        self.module2time = {name: module2time.get(name, 0) for name in self.namespace}
+        self.schedule = [(t, name) for name, t in self.module2time.items()]
+        heapq.heapify(self.schedule)
+        if not hasattr(self, 'in_flight'):
+            self.in_flight = set()
+            self.address2client = {}
+            self.eval_times = deque(maxlen=100000)
+
+    def next_module(self) -> Optional[str]:
+        """
+        pops the stalest module, or None if every module was evaluated within max_staleness
+        """
+        now = c.time()
+        while len(self.schedule) > 0:
+            t, name = self.schedule[0]
+            if self.module2time.get(name, None) != t or name in self.in_flight:
+                # the module left the namespace, was rescheduled or is being evaluated
+                heapq.heappop(self.schedule)
+                continue
+            if now - t < self.config.max_staleness:
+                return None
+            heapq.heappop(self.schedule)
+            return name
+        return None
+
+    def reschedule_module(self, name:str, timestamp:float = None):
+        self.in_flight.discard(name)
+        if name in self.module2time:
+            timestamp = timestamp or c.time()
+            self.module2time[name] = timestamp
+            heapq.heappush(self.schedule, (timestamp, name))
+
+    def get_client(self, address:str) -> 'c.Client':
+        """
+        one client per address, all of them share the keep-alive session of the loop
+        """
+        if address not in self.address2client:
+            ip, port = address.split('://')[-1].split(':')
+            self.address2client[address] = c.module('client')(ip=ip, port=int(port), key=self.key, save_history=False)
+        return self.address2client[address]
 
     def clone_stats(self):
         workers = self.workers()
@@ -183,7 +257,22 @@ class Vali(c.Module):
                      netuid:int=None, 
                      fn : str = None,
                      update: bool = False):
-        
+        """
+        fetches the network (see fetch_network) and applies it to the vali (see apply_network)
+        """
+        network = self.fetch_network(network=network, search=search, netuid=netuid, fn=fn, update=update)
+        return self.apply_network(**network)
+    sync = set_network
+
+    def fetch_network(self, 
+                     network:str=None, 
+                     search:str=None,  
+                     netuid:int=None, 
+                     fn : str = None,
+                     update: bool = False) -> dict:
+        """
+        the namespace (and the keys of the subnet) of the network, the vali itself is not changed
+        """
         network = network or self.config.network
         search =  search or self.config.search
         netuid = netuid or self.config.netuid
@@ -205,24 +294,54 @@ class Vali(c.Module):
                 network = 'subspace'
                 netuid = 0
                 netuid = netuid
-            self.subspace = c.module("subspace")(netuid=netuid)
+            subspace = c.module("subspace")(netuid=netuid)
+            # the keys of the subnet, from the indexer of the host if it is served (else from the chain)
+            key2uid = subspace.key2uid(netuid=netuid)
         else:
-            self.name2key = {}
+            subspace = None
+            key2uid = None # the uids of the score table
 
         # name2address / namespace
 
-        self.namespace = c.module('namespace').namespace(search=search, 
+        namespace = c.module('namespace').namespace(search=search, 
                                     network=network, 
                                     netuid=netuid, 
                                     update=update)
+        return {'network': network, 
+                'netuid': netuid, 
+                'search': search, 
+                'fn': fn, 
+                'namespace': namespace, 
+                'subspace': subspace, 
+                'key2uid': key2uid}
+
+    def apply_network(self, 
+                      network:str, 
+                      netuid:int, 
+                      search:str, 
+                      fn:str, 
+                      namespace:dict, 
+                      subspace = None, 
+                      key2uid:dict = None) -> dict:
+        """
+        switches the vali to a fetched network, the engine calls it on its loop
+        """
+        if subspace != None:
+            self.subspace = subspace
+        else:
+            self.name2key = {}
+        self.key2uid = key2uid
+        self.namespace = namespace
         self.n  = len(self.namespace)    
         self.address2name = {v: k for k, v in self.namespace.items()}    
         self.last_sync_time = c.time()
+        self.schedule_modules()
 
         self.network = self.config.network = network
         self.netuid = self.config.netuid = netuid
         self.search = self.config.search = search
         self.fn = self.config.fn = fn or self.config.fn
+        self.set_scores()
         
         r = {
                 'search': search,
@@ -233,12 +352,41 @@ class Vali(c.Module):
                 }
         c.print(r)
         return r
-    sync = set_network
+
+    def set_scores(self):
+        """
+        the score table of the network, the module infos of older versions (one json per module) are imported once
+        """
+        path = self.resolve_path(self.storage_path())
+        self.scores = c.module('vali.scores').store(path, flush_interval=self.config.flush_interval)
+        if len(self.scores) == 0:
+            for p in self.module_paths:
+                info = self.get_json(p, default={})
+                if isinstance(info, dict) and 'ss58_address' in info:
+                    self.save_module_info(info['name'], info)
+        return self.scores
         
-    def score_module(self, module: 'c.Module'):
+    async def score_module(self, module: 'c.Client'):
         # assert 'address' in info, f'Info must have a address key, got {info.keys()}'
+        # async score functions get the pooled client of the module, 
+        # sync ones (in subclasses) get a connection in a thread of their own
         return {'success': True, 'w': 1}
 
+    async def async_score_module(self, client:'c.Client', info:dict):
+        if inspect.iscoroutinefunction(self.score_module):
+            return await self.score_module(client)
+        if not hasattr(self, 'executor'):
+            self.executor = c.module('executor.thread')(max_workers=self.config.threads_per_worker)
+        future = self.executor.submit(fn=self.sync_score_module, args=[info['address']], timeout=self.config.timeout)
+        response = await asyncio.wrap_future(future)
+        if c.is_error(response):
+            raise Exception(response['error'])
+        return response
+
+    def sync_score_module(self, address:str):
+        module = c.connect(address, key=self.key)
+        return self.score_module(module)
+
     def check_response(self, response:dict):
         """
         The following processes the response from the module
@@ -253,7 +401,7 @@ class Vali(c.Module):
 
         return response
         
-    def get_module_info(self, module):
+    def get_module_info(self, module, load:bool = True):
         namespace = self.namespace
         # RESOLVE THE MODULE ADDRESS
 
@@ -267,7 +415,7 @@ class Vali(c.Module):
         else:
             module_name = module
 
-        info = self.load_module_info( module_name, {})
+        info = self.load_module_info( module_name, {}) if load else {}
         info['address'] = module_address
         info['name'] = module_name
         info['schema'] = info.get('schema', None)
@@ -275,51 +423,63 @@ class Vali(c.Module):
         return info
     
 
-    def eval_module(self, module:str):
+    async def async_get_module_info(self, module:str) -> dict:
+        return self.get_module_info(module)
+
+    async def async_eval_module(self, module:str):
         """
         The following evaluates a module sver
         """
-        # load the module stats (if it exists)
-
-        
         # load the module info and calculate the staleness of the module
         # if the module is stale, we can just return the module info
-
-        info = self.get_module_info(module)
-
-        module = c.connect(info['address'], key=self.key)
-
-        self.requests += 1
-
-        seconds_since_called = c.time() - info.get('timestamp', 0)
-        if seconds_since_called < self.config.max_staleness:
-            return {'w': info.get('w', 0),
-                    'module': info['name'],
-                    'address': info['address'],
-                        'timestamp': c.time(), 
-                        'msg': f'Module is not stale, {int(seconds_since_called)} < {self.config.max_staleness}'}
-        else:
-            module_info = module.info(timeout=self.config.timeout)
+        info = await self.async_get_module_info(module)
+        name, address = info['name'], info['address']
+        timestamp = None
+        evaluated = False
+        try:
+            seconds_since_called = c.time() - info.get('timestamp', 0)
+            if seconds_since_called < self.config.max_staleness:
+                timestamp = info['timestamp']
+                return {'w': info.get('w', 0),
+                        'module': info['name'],
+                        'address': info['address'],
+                            'timestamp': c.time(), 
+                            'msg': f'Module is not stale, {int(seconds_since_called)} < {self.config.max_staleness}'}
+
+            self.requests += 1
+            evaluated = True
+            client = self.get_client(info['address'])
+            module_info = await client.async_forward('info', timeout=self.config.timeout)
+            assert isinstance(module_info, dict) and not c.is_error(module_info), f'Failed to get info {module_info}'
             assert 'address' in info and 'name' in info
             # we want to make sure that the module info has a timestamp
             info.update(module_info)
-            info['timestamp'] = c.time()
+            # the namespace names the module, not the module itself
+            info['name'], info['address'] = name, address
+            info['timestamp'] = timestamp = c.time()
 
-        try:
-            # we want to make sure that the module info has a timestamp
-            response = self.score_module(module)
-            response = self.check_response(response)
-            info.update(response)            
-            self.successes += 1
-        except Exception as e:
-            e = c.detailed_error(e)
-            response = { 'w': 0,'msg': f'{c.emoji("cross")} {info["name"]} {c.emoji("cross")}'}  
-        
-        info['latency'] = c.time() - info['timestamp']
-        info['w'] = response['w']  * self.config.alpha + info['w'] * (1 - self.config.alpha)
-        path = f'{self.storage_path()}/{info["name"]}'
-        self.put_json(path, info)
-        return {'w': info['w'], 'module': info['name'], 'address': info['address'], 'latency': info['latency']}
+            try:
+                # we want to make sure that the module info has a timestamp
+                response = await self.async_score_module(client, info)
+                response = self.check_response(response)
+                info.update(response)            
+                self.successes += 1
+            except Exception as e:
+                e = c.detailed_error(e)
+                response = { 'w': 0,'msg': f'{c.emoji("cross")} {info["name"]} {c.emoji("cross")}'}  
+            
+            info['latency'] = c.time() - info['timestamp']
+            info['w'] = response['w']  * self.config.alpha + info.get('w', 0) * (1 - self.config.alpha)
+            info['history'] = (info.get('history', []) + [{'w': response['w'], 'latency': info['latency'], 'timestamp': info['timestamp']}])[-self.config.max_history:]
+            self.save_module_info(info['name'], info)
+            return {'w': info['w'], 'module': info['name'], 'address': info['address'], 'latency': info['latency']}
+        finally:
+            if evaluated:
+                self.eval_times.append(c.time())
+            self.reschedule_module(name, timestamp=timestamp)
+
+    def eval_module(self, module:str):
+        return c.get_event_loop().run_until_complete(self.async_eval_module(module))
         
 
     def storage_path(self):
@@ -349,18 +509,8 @@ class Vali(c.Module):
         return info
     
     def votes(self):
-        network = self.network
-        module_infos = self.module_infos(network=network, keys=['name', 'w', 'ss58_address'])
-        votes = {'keys' : [],'weights' : [],'uids': [], 'timestamp' : c.time()  }
-        key2uid = self.subspace.key2uid()
-        for info in module_infos:
-            ## valid modules have a weight greater than 0 and a valid ss58_address
-            if 'ss58_address' in info and info['w'] >= 0:
-                if info['ss58_address'] in key2uid:
-                    votes['keys'] += [info['ss58_address']]
-                    votes['weights'] += [info['w']]
-                    votes['uids'] += [key2uid[info['ss58_address']]]
-
+        ## valid modules have a weight greater than 0 and a registered key
+        votes = self.scores.votes(key2uid=self.key2uid)
         assert len(votes['uids']) == len(votes['weights']), f'Length of uids and weights must be the same, got {len(votes["uids"])} uids and {len(votes["weights"])} weights'
 
         return votes
@@ -432,16 +582,14 @@ class Vali(c.Module):
     def num_module_infos(cls, tag=None, network='subspace', **kwargs):
         return len(cls.module_infos(network=network,tag=tag, **kwargs))
 
-    @classmethod
-    def leaderboard(cls, *args, **kwargs): 
-        df =  c.df(cls.module_infos(*args, **kwargs))
-        df.sort_values(by=['w', 'staleness'], ascending=False, inplace=True)
-        return df
+    def leaderboard(self): 
+        return self.scores.df(sort_by=['w', 'staleness'])
     
     @property
     def module_paths(self):
+        # the module infos of older versions, one json file per module
         paths = self.ls(self.storage_path())
-        paths = list(filter(lambda x: x.endswith('.json'), paths))
+        paths = list(filter(lambda x: x.endswith('.json') and not x.endswith('scores.json'), paths))
         return paths
     
 
@@ -450,45 +598,42 @@ class Vali(c.Module):
         return self.subspace.get_module(self.key.ss58_address, netuid=self.netuid)
     
     def module_infos(self,
-                    batch_size:int=100 , # batch size for 
-                    timeout:int=10,
                     keys = ['name', 'w', 'staleness', 'timestamp', 'address', 'ss58_address'],
-                    path = 'cache/module_infos',
-                    update = True,
                     **kwargs
                     ):
-        
-        if not update:
-            modules_info = self.get(path, default=[])
-            if len(modules_info) > 0:
-                return modules_info
-            
-        paths = self.module_paths
-        jobs = [c.async_get_json(p) for p in paths]
+        """
+        the rows of the score table (the key is the ss58_address of the module)
+        """
         module_infos = []
-        # chunk the jobs into batches
-        for jobs_batch in c.chunk(jobs, batch_size):
-            results = c.wait(jobs_batch, timeout=timeout)
-            # last_interaction = [r['history'][-1][] for r in results if r != None and len(r['history']) > 0]
-            for s in results:
-                if isinstance(s, dict) and 'ss58_address' in s:
-                    s['staleness'] = c.time() - s.get('timestamp', 0)
-                    module_infos += [{k: s.get(k, None) for k in keys}]
-
-        if update:
-            self.put(path, module_infos)       
+        now = c.time()
+        for row in self.scores.rows():
+            if row['key'] == None:
+                continue
+            info = {**row, 
+                    'ss58_address': row['key'], 
+                    'address': self.namespace.get(row['name'], None),
+                    'staleness': now - (row['timestamp'] or 0)}
+            module_infos += [{k: info.get(k, None) for k in keys}]
         return module_infos
 
     def load_module_info(self, k:str,default=None):
+        """
+        the record of the module, its info fields with the score columns on top
+        """
         default = default if default != None else {}
-        path = self.storage_path() + f'/{k}'
-        return self.get_json(path, default=default)
+        row = self.scores.get_row(k)
+        if row == None:
+            return default
+        info = row.pop('info', None) or {}
+        return {**info, **row, 'ss58_address': row['key']}
     
     def save_module_info(self, k:str, v:dict):
-        path = self.storage_path() + f'/{k}'
-        self.put_json(path, v)
+        self.scores.update(k, v, key=v.get('ss58_address', v.get('key', None)))
 
     def get_history(self, k:str, default=None):
+        """
+        the last max_history evaluations of the module [{w, latency, timestamp}]
+        """
         module_infos = self.load_module_info(k, default=default)
         return module_infos.get('history', [])
     
@@ -564,6 +709,52 @@ class Vali(c.Module):
         return self.eval_module(self.random_module())
 
 
+    @classmethod
+    def test_module_info(cls):
+        self = cls(network='local', workers=0, start=False)
+        self.network = 'vali_test_module_info'
+        self.set_scores()
+        try:
+            info = {'name': 'echo', 'ss58_address': 'key0', 'w': 0.5, 'latency': 0.1, 'timestamp': c.time(),
+                    'schema': {'forward': {'input': {}}}, 'history': [{'w': 0.5, 'latency': 0.1, 'timestamp': c.time()}]}
+            self.save_module_info('echo', info)
+            self.scores.flush()
+            # the record is loaded again from disk with its fields that are not scores
+            self.scores.closed = True
+            self.scores = c.module('vali.scores')(path=self.resolve_path(self.storage_path()))
+            self.scores.closed = True
+            loaded = self.load_module_info('echo')
+            assert {k: loaded[k] for k in info} == info, loaded
+            assert self.get_history('echo') == info['history']
+            assert self.get_history('missing') == []
+        finally:
+            c.module('vali.scores').rm_store(self.resolve_path(self.storage_path()))
+            self.rm(self.storage_path())
+        return {'success': True, 'msg': 'module infos keep their full record'}
+
+    @classmethod
+    def test_sync(cls) -> dict:
+        """
+        the engine fetches the network in a thread and applies it on its loop
+        """
+        import threading
+        self = cls(network='local', workers=0, start=False)
+        namespace = {'echo.test': f'0.0.0.0:{c.free_port()}'}
+        fetch_threads, apply_threads = [], []
+        def fetch_network(**kwargs):
+            fetch_threads.append(threading.get_ident())
+            return {'network': 'local', 'netuid': 0, 'search': None, 'fn': self.config.fn, 'namespace': namespace}
+        apply_network = self.apply_network
+        def apply(**kwargs):
+            apply_threads.append(threading.get_ident())
+            return apply_network(**kwargs)
+        self.fetch_network, self.apply_network = fetch_network, apply
+        self.last_sync_time = 0
+        c.get_event_loop().run_until_complete(self.async_worker(max_evals=0))
+        assert apply_threads == [threading.get_ident()] and fetch_threads[0] != apply_threads[0], (fetch_threads, apply_threads)
+        assert self.namespace == namespace and set(self.module2time) == set(namespace)
+        return {'success': True, 'msg': 'the network is applied on the loop'}
+
     @classmethod
     def test_network(cls, network='subspace', search='vali'):
         server_name = 'vali::test'
@@ -575,6 +766,27 @@ class Vali(c.Module):
         return {'success': True, 'msg': f'Found {len(self.namespace)} modules in {network} {search}'}
 
 
+    @classmethod
+    def benchmark(cls, n:int = 100, batch_size:int = 64, timeout:int = 60) -> dict:
+        """
+        evaluates n modules (all served by one local echo server) with batch_size evaluations in flight
+        """
+        port = c.free_port()
+        process = c.module('server').echo_process(port=port, timeout=timeout)
+        try:
+            self = cls(network='local', workers=0, start=False, batch_size=batch_size, max_staleness=0, timeout=timeout)
+            self.network = 'vali_benchmark'
+            self.namespace = {f'echo.{i}': f'0.0.0.0:{port}' for i in range(n)}
+            self.set_scores()
+            self.schedule_modules()
+            result = c.get_event_loop().run_until_complete(self.async_worker(max_evals=n))
+            result['evals_per_second'] = result['evals'] / (c.time() - self.start_time)
+        finally:
+            process.kill()
+            c.module('vali.scores').rm_store(self.resolve_path(self.storage_path()))
+            self.rm(self.storage_path())
+        return result
+
     def start(self):
         # start the workers
         for i in range(self.config.workers):